@@ -2,7 +2,7 @@ import html
 import json
 import re
 import os
-from functions import usefulFunctions as fn
+import sharedResources as shared
 
 
 def generate_schema(instance: dict):
@@ -13,10 +13,7 @@ def generate_schema(instance: dict):
     :return dict:
     '''
 
-    this_file_dir = os.path.dirname(os.path.abspath(__file__))
-    parent_dir = this_file_dir[:this_file_dir.rfind('/')]
-    tempalte_path = os.path.join(parent_dir, 'templates')
-    template = fn.template_env(tempalte_path).get_template('schema.jinja')
+    template = shared.template_env().get_template('schema.jinja')
     schema = template.render(dataset=instance['dataset'])
 
     return schema
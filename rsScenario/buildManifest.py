@@ -0,0 +1,77 @@
+import hashlib
+import json
+
+
+def input_digest(*inputs) -> str:
+    '''
+    A function to return the SHA-256 of the inputs of a website output
+
+    :param inputs: JSON serialisable inputs, e.g. a template digest and the data it renders
+    :return: The hex digest
+    '''
+    digest = hashlib.sha256()
+    for item in inputs:
+        digest.update(json.dumps(item, sort_keys=True, default=str).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    '''
+    The inputs each website output was last built from, so a compile only re-renders and
+    uploads the outputs whose inputs changed and deletes only the outputs that are orphaned.
+    Records output -> digest of its inputs, and source -> digest of the source and the outputs
+    made from it, so an unchanged personae is skipped without reading its storylog.
+
+    :param outputs: A dict of output names to input digests, as saved by to_json
+    :param sources: A dict of source names to their digest and output names, as saved by to_json
+    '''
+    def __init__(self, outputs: dict = None, sources: dict = None):
+        self.outputs = dict(outputs or {})
+        self.sources = {source_name: {'digest': source['digest'], 'outputs': list(source['outputs'])} for source_name, source in (sources or {}).items()}
+
+    @classmethod
+    def from_json(cls, manifest_json: str) -> 'BuildManifest':
+        manifest = json.loads(manifest_json)
+        return cls(manifest.get('outputs'), manifest.get('sources'))
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'outputs': self.outputs,
+            'sources': self.sources
+        }, sort_keys=True)
+
+    def is_current(self, output_name: str, digest: str) -> bool:
+        return self.outputs.get(output_name) == digest
+
+    def set_output(self, output_name: str, digest: str) -> None:
+        self.outputs[output_name] = digest
+
+    def source_outputs(self, source_name: str, digest: str):
+        '''
+        A function to return the outputs made from a source if it is unchanged since they were built
+
+        :param source_name: The source name, e.g. a storylog blob
+        :param digest: The digest of the source as it is now
+        :return: :list: The output names, or None if the source changed or was never built
+        '''
+        source = self.sources.get(source_name)
+        if source is None or source['digest'] != digest:
+            return None
+        return source['outputs']
+
+    def set_source(self, source_name: str, digest: str, output_names) -> None:
+        self.sources[source_name] = {'digest': digest, 'outputs': sorted(output_names)}
+
+    def retain(self, source_names, output_names) -> None:
+        '''
+        A function to forget the sources and outputs that no longer exist
+
+        :param source_names: The sources that were built
+        :param output_names: The outputs that were built
+        :return: None
+        '''
+        source_names = set(source_names)
+        output_names = set(output_names)
+        self.sources = {source_name: source for source_name, source in self.sources.items() if source_name in source_names}
+        self.outputs = {output_name: digest for output_name, digest in self.outputs.items() if output_name in output_names}
@@ -0,0 +1,373 @@
+from collections import OrderedDict
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import excelProcessing as ep
+from storageBackends import NotFound
+
+
+class StandardCache:
+    '''
+    A content addressed cache of parsed standards.
+    Entries are keyed by the SHA-256 of the standard workbook plus the provenance paths it
+    was extended with, and hold the validation paths and the export paths (with [] cardinality
+    markers). A local directory is checked first, then the shared storage tier, so a byte
+    identical standard uploaded to any project is only ever parsed once.
+
+    :param cache_dir: The local directory to keep entries in
+    :param storage: The storage backend for the shared tier (or None for local only)
+    :param bucket_prefix: The prefix of the shared tier in the storage
+    :param max_bytes: The size of the local tier before the least recently used entries are evicted
+    :param max_bucket_bytes: The size of the bucket tier before the oldest entries are evicted (None for no limit)
+    '''
+    def __init__(self,
+                 cache_dir: str = None,
+                 storage=None,
+                 bucket_prefix: str = '_cache/standards',
+                 max_bytes: int = 64 * 1024 * 1024,
+                 max_bucket_bytes: int = None):
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'rsScenario', 'standard_cache')
+        self.storage = storage
+        self.bucket_prefix = bucket_prefix
+        self.max_bytes = max_bytes
+        self.max_bucket_bytes = max_bucket_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(standard_path: str, provenance_paths: list) -> str:
+        '''
+        A function to return the cache key of a standard workbook and provenance
+
+        :param standard_path: The path to the standard xlsx file
+        :param provenance_paths: The provenance paths the standard is extended with
+        :return: The SHA-256 hex digest
+        '''
+        digest = hashlib.sha256()
+        with open(standard_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+        digest.update(json.dumps(provenance_paths or [], sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def blob_name(self, key: str) -> str:
+        return f'{self.bucket_prefix}/{key}.json'
+
+    def get(self, key: str) -> dict:
+        '''
+        A function to return a cached entry, checking the local tier then the bucket tier
+
+        :param key: The cache key
+        :return: The entry, or None if it is not cached
+        '''
+        local_path = self.local_path(key)
+        try:
+            with open(local_path, 'rb') as f:
+                data = f.read()
+            entry = json.loads(data)
+            # refresh the modification time so eviction is least recently used
+            os.utime(local_path)
+            return entry
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            # a corrupt entry is a miss, remove it so it is replaced
+            try:
+                os.remove(local_path)
+            except FileNotFoundError:
+                pass
+
+        if self.storage is None:
+            return None
+
+        try:
+            data = self.storage.get(self.blob_name(key))
+            entry = json.loads(data)
+        except NotFound:
+            return None
+        except ValueError:
+            return None
+
+        # promote to the local tier
+        self.write_local(key, data)
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        '''
+        A function to store an entry in both tiers
+
+        :param key: The cache key
+        :param entry: The entry to store
+        :return: None
+        '''
+        data = json.dumps(entry).encode('utf-8')
+        self.write_local(key, data)
+
+        if self.storage is not None:
+            self.storage.put(self.blob_name(key), data, content_type='application/json')
+            if self.max_bucket_bytes is not None:
+                self.evict_bucket()
+
+    def write_local(self, key: str, data: bytes) -> None:
+        # write to a temporary file of this writer's own first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.local_path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict_local()
+
+    def evict_local(self) -> None:
+        '''
+        A function to remove the least recently used local entries until the tier fits in max_bytes
+
+        :return: None
+        '''
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def evict_bucket(self) -> None:
+        '''
+        A function to remove the oldest bucket entries until the tier fits in max_bucket_bytes
+
+        :return: None
+        '''
+        blobs = sorted(self.storage.list(prefix=f'{self.bucket_prefix}/'), key=lambda blob: blob.updated)
+        total = sum(blob.size or 0 for blob in blobs)
+
+        for blob in blobs:
+            if total <= self.max_bucket_bytes:
+                break
+            try:
+                self.storage.delete(blob.name)
+            except NotFound:
+                pass
+            total -= blob.size or 0
+
+    def get_or_parse(self, standard_path: str, provenance_paths: list) -> dict:
+        '''
+        A function to return the parsed paths of a standard, parsing it only on a cache miss
+
+        :param standard_path: The path to the standard xlsx file
+        :param provenance_paths: The provenance paths to extend record rows with
+        :return: A dict with the validation_paths and export_paths of the standard
+        '''
+        key = self.key(standard_path, provenance_paths)
+        entry = self.get(key)
+
+        if entry is None:
+            validation_paths, export_paths = ep.parse_standard(standard_path, provenance_paths)
+            entry = {
+                'validation_paths': validation_paths,
+                'export_paths': export_paths
+            }
+            self.put(key, entry)
+
+        return entry
+
+
+class ContinuousDataCache:
+    '''
+    An in-memory cache of continuous data blobs keyed by blob name and generation.
+    One cache is shared by a whole revalidation pass so a csv referenced by several
+    sheets and personae is downloaded once. Least recently used entries are evicted
+    once the cached bytes pass max_bytes. Safe to share between threads, and a blob
+    requested by several threads at once is only downloaded by the first.
+
+    :param max_bytes: The total size of the cached blobs
+    '''
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.loading = {}
+
+    def get(self, storage, blob_name: str) -> bytes:
+        '''
+        A function to return the contents of a blob, downloading it only if the
+        current generation is not cached
+
+        :param storage: The storage backend
+        :param blob_name: The full name of the blob
+        :return: The blob contents
+        '''
+        # a metadata request gives the current generation, so a replaced file is never served stale
+        blob = storage.stat(blob_name)
+        if blob is None:
+            raise NotFound(blob_name)
+
+        key = (blob_name, blob.generation)
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return self.entries[key]
+
+                loading = self.loading.get(key)
+                if loading is None:
+                    self.misses += 1
+                    loading = self.loading[key] = threading.Event()
+                    break
+
+            # another thread is downloading this blob, wait and look again
+            loading.wait()
+
+        try:
+            data = storage.get(blob_name, blob.generation)
+            with self.lock:
+                self.put(key, data)
+        finally:
+            with self.lock:
+                del self.loading[key]
+            loading.set()
+        return data
+
+    def put(self, key: tuple, data: bytes) -> None:
+        # called with the lock held
+        # older generations of the blob can never be hit again
+        for stale_key in [entry_key for entry_key in self.entries if entry_key[0] == key[0]]:
+            self.size -= len(self.entries.pop(stale_key))
+
+        if len(data) > self.max_bytes:
+            return
+
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def stats(self) -> dict:
+        '''
+        A function to return the cache counters
+
+        :return: A dict of hits, misses, entries and bytes
+        '''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.size
+            }
+
+
+class StandardIndexCache:
+    '''
+    The loaded path sets of standards, keyed by standard name and the version (blob name
+    and generation) they were loaded from. During a revalidation pass each standard's version
+    is checked once and the loaded path set is shared by every event and personae in the pass.
+    Outside a pass the version is checked on every lookup, which is a metadata request instead
+    of a download.
+    '''
+    def __init__(self):
+        self.entries = {}
+        self.verified = set()
+        self.in_pass = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.name_locks = {}
+
+    def begin_pass(self) -> None:
+        with self.lock:
+            self.verified = set()
+            self.in_pass = True
+
+    def end_pass(self) -> None:
+        with self.lock:
+            self.verified = set()
+            self.in_pass = False
+
+    def invalidate(self, standard_name: str = None) -> None:
+        '''
+        A function to drop a cached standard, or every standard if no name is given
+
+        :param standard_name: The name of the standard without extention
+        :return: None
+        '''
+        with self.lock:
+            if standard_name is None:
+                self.entries = {}
+                self.verified = set()
+            else:
+                self.entries.pop(standard_name, None)
+                self.verified.discard(standard_name)
+
+    def get(self, standard_name: str, current_version, load):
+        '''
+        A function to return the path set of a standard, loading it only if the current version is not cached
+
+        :param standard_name: The name of the standard without extention
+        :param current_version: A callable returning the current version of a standard
+        :param load: A callable loading a standard at a version
+        :return: The loaded path set
+        '''
+        with self.lock:
+            name_lock = self.name_locks.setdefault(standard_name, threading.Lock())
+
+        # one thread loads a standard while any others wanting it wait
+        with name_lock:
+            with self.lock:
+                entry = self.entries.get(standard_name)
+                if entry is not None and self.in_pass and standard_name in self.verified:
+                    self.hits += 1
+                    return entry[1]
+
+            version = current_version(standard_name)
+            hit = entry is not None and entry[0] == version
+            if not hit:
+                entry = (version, load(standard_name, version))
+
+            # the counters are shared by every standard so are only changed under the cache lock
+            with self.lock:
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                self.entries[standard_name] = entry
+                if self.in_pass:
+                    self.verified.add(standard_name)
+            return entry[1]
+
+    def stats(self) -> dict:
+        '''
+        A function to return the cache counters
+
+        :return: A dict of hits, misses and entries
+        '''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries)
+            }
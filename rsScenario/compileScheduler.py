@@ -0,0 +1,204 @@
+from collections import OrderedDict
+
+import threading
+import time
+import traceback
+import uuid
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class CompileJob:
+    '''
+    A website compile requested for a project. Every request for the project made while
+    the job is still queued is coalesced into it.
+
+    :param project: The project the compile is for
+    :param compile: A callable running the compile and returning its summary
+    :param due: The time the compile can start
+    '''
+    def __init__(self, project: str, compile, due: float):
+        self.job_id = uuid.uuid4().hex
+        self.project = project
+        self.compile = compile
+        self.due = due
+        self.status = QUEUED
+        self.requests = 1
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.summary = None
+        self.error = None
+        self.finished_event = threading.Event()
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.job_id,
+            'project': self.project,
+            'status': self.status,
+            'requests': self.requests,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'summary': self.summary,
+            'error': self.error
+        }
+
+
+class CompileScheduler:
+    '''
+    Runs website compiles on an in-process background worker.
+    A request waits debounce seconds, and any further requests for the same project in that
+    time are coalesced into it and push it back again, so a burst of saves makes one compile.
+    A request made while the project is compiling queues one more compile to run after it.
+    Compiles run one at a time so two never write the same website at once.
+
+    :param debounce: The seconds to wait for more requests before compiling
+    :param max_delay: The most seconds a request can be pushed back by later requests
+    :param keep_jobs: The number of finished jobs kept for status requests
+    '''
+    def __init__(self, debounce: float = 2.0, max_delay: float = 30.0, keep_jobs: int = 1000):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.keep_jobs = keep_jobs
+        self.jobs = OrderedDict()
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.worker = None
+        self.flushing = False
+
+    def submit(self, project: str, compile) -> str:
+        '''
+        A function to request a compile of a project
+
+        :param project: The project to compile
+        :param compile: A callable running the compile, the latest request's callable is the one run
+        :return: :str: The job id, shared by every request coalesced into the job
+        '''
+        with self.condition:
+            now = time.time()
+            job = self.pending.get(project)
+            if job is None:
+                job = CompileJob(project, compile, now + self.debounce)
+                self.pending[project] = job
+                self.jobs[job.job_id] = job
+                self.forget_finished()
+            else:
+                job.compile = compile
+                job.requests += 1
+                job.due = min(now + self.debounce, job.submitted + self.max_delay)
+
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, name='rsScenario-compile', daemon=True)
+                self.worker.start()
+            self.condition.notify_all()
+
+        return job.job_id
+
+    def status(self, job_id: str) -> dict:
+        '''
+        A function to return the status of a compile job
+
+        :param job_id: The job id returned by submit
+        :return: :dict: The job status, or None if the job is unknown
+        '''
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return None if job is None else job.to_dict()
+
+    def wait(self, job_id: str, timeout: float = None) -> dict:
+        '''
+        A function to wait for a compile job to finish
+
+        :param job_id: The job id returned by submit
+        :param timeout: The most seconds to wait (None to wait until it finishes)
+        :return: :dict: The job status
+        '''
+        with self.condition:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job.finished_event.wait(timeout)
+        return self.status(job_id)
+
+    def flush(self, timeout: float = None) -> None:
+        '''
+        A function to start every queued compile now and wait for them to finish
+
+        :param timeout: The most seconds to wait (None to wait until they finish)
+        :return: None
+        '''
+        with self.condition:
+            self.flushing = True
+            waiting = list(self.pending.values()) + [job for job in self.jobs.values() if job.status == RUNNING]
+            self.condition.notify_all()
+        try:
+            deadline = None if timeout is None else time.time() + timeout
+            for job in waiting:
+                job.finished_event.wait(None if deadline is None else max(deadline - time.time(), 0))
+        finally:
+            with self.condition:
+                self.flushing = False
+
+    def forget_finished(self) -> None:
+        # called with the lock held
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in (DONE, FAILED)]
+        for job_id in finished[:max(len(self.jobs) - self.keep_jobs, 0)]:
+            del self.jobs[job_id]
+
+    def next_job(self) -> CompileJob:
+        # wait for the queued job that is due first
+        with self.condition:
+            while True:
+                now = time.time()
+                due = [job for job in self.pending.values() if self.flushing or job.due <= now]
+                if due:
+                    job = min(due, key=lambda job: job.due)
+                    del self.pending[job.project]
+                    job.status = RUNNING
+                    job.started = now
+                    return job
+                timeout = min((job.due for job in self.pending.values()), default=now + 60) - now
+                self.condition.wait(timeout)
+
+    def run(self) -> None:
+        while True:
+            job = self.next_job()
+            try:
+                summary = job.compile()
+                error = None
+            except Exception as e:
+                summary = None
+                error = f'{type(e).__name__}: {e}'
+                print(f"Compile of {job.project} failed")
+                traceback.print_exc()
+
+            with self.condition:
+                job.summary = summary
+                job.error = error
+                job.status = DONE if error is None else FAILED
+                job.finished = time.time()
+            job.finished_event.set()
+
+
+# the process wide scheduler, made on first use
+shared_scheduler = None
+shared_scheduler_lock = threading.Lock()
+
+
+def default_scheduler() -> CompileScheduler:
+    '''
+    A function to return the compile scheduler shared by the process.
+    The worker is a daemon thread, so call flush before exiting to run any queued compiles
+
+    :return: The CompileScheduler
+    '''
+    global shared_scheduler
+    with shared_scheduler_lock:
+        if shared_scheduler is None:
+            shared_scheduler = CompileScheduler()
+        return shared_scheduler
@@ -0,0 +1,84 @@
+from jinja2 import Environment, FileSystemLoader
+
+import glob
+import json
+import os
+import shutil
+import sys
+import uuid
+
+import sharedResources as shared
+
+'''
+Compiles every template in the templates folder to a Python module, so workers load them
+without parsing and compiling them at runtime. App Engine cannot write to the app folder, so
+run it from the project folder before every deploy (see app.yaml):
+
+    python rsScenario/compileTemplates.py [template folder]
+    gcloud app deploy
+
+The compiled folder is a symlink to the latest build, so a running worker never sees half a build.
+'''
+
+
+def compile_templates(template_path: str = shared.TEMPLATE_DIR, compiled_path: str = None) -> list:
+    '''
+    A function to compile the templates of a folder to modules for sharedResources.PrecompiledLoader
+
+    :param template_path: The path to the template folder
+    :param compiled_path: The folder to write the modules to, next to the template folder if None
+    :return: :list: The names of the templates compiled
+    '''
+    compiled_path = compiled_path or shared.compiled_template_path(template_path)
+
+    # must match the environment sharedResources.template_env makes, or the modules would render differently
+    env = Environment(loader=FileSystemLoader(template_path))
+    template_names = env.list_templates()
+
+    # build into a new folder, the compiled path is swapped over to it once it is complete
+    build_path = f'{compiled_path}.{uuid.uuid4().hex}'
+    env.compile_templates(build_path, zip=None, ignore_errors=False)
+
+    digests = {}
+    for template_name in template_names:
+        source, file_name, uptodate = env.loader.get_source(env, template_name)
+        digests[template_name] = shared.source_digest(source)
+    with open(os.path.join(build_path, shared.COMPILED_TEMPLATE_MANIFEST), 'w') as f:
+        json.dump(digests, f, indent=4, sort_keys=True)
+
+    swap_build(compiled_path, build_path)
+    print(f"Compiled {len(template_names)} templates from {template_path} to {compiled_path}")
+
+    return template_names
+
+
+def swap_build(compiled_path: str, build_path: str) -> None:
+    '''
+    A function to point the compiled path at a finished build and delete the builds before it
+    The symlink is replaced in one rename, so the compiled path always holds a whole build
+
+    :param compiled_path: The compiled path, a symlink to the current build
+    :param build_path: The finished build
+    :return: None
+    '''
+    # a compiled folder from before builds were symlinked is moved aside once
+    if os.path.isdir(compiled_path) and not os.path.islink(compiled_path):
+        os.replace(compiled_path, f'{compiled_path}.{uuid.uuid4().hex}')
+
+    link_path = f'{build_path}.link'
+    os.symlink(os.path.basename(build_path), link_path)
+    os.replace(link_path, compiled_path)
+
+    # old builds, and any left by an interrupted run
+    for old_path in glob.glob(f'{glob.escape(compiled_path)}.*'):
+        if old_path != build_path:
+            if os.path.isdir(old_path) and not os.path.islink(old_path):
+                shutil.rmtree(old_path, ignore_errors=True)
+            else:
+                os.remove(old_path)
+
+    return
+
+
+if __name__ == '__main__':
+    compile_templates(*sys.argv[1:2])
@@ -0,0 +1,158 @@
+import json
+import threading
+
+
+# every standard path list is built with the provenance of its project
+PROVENANCE = 'provenance'
+
+
+class DependencyGraph:
+    '''
+    The inputs each personae was last validated against, so a change to a standard,
+    the provenance or a continuous data file only revalidates the personae it can affect.
+    Records persona -> standards, persona -> continuous data csvs and standard -> provenance.
+    The personae and standards changed since loading are tracked, so the changes can be
+    applied on top of a graph another process has saved in the meantime (see rebase).
+    Safe to share between the threads of a revalidation pass.
+
+    :param personae: A dict of personae file names to their dependencies, as saved by to_json
+    :param standards: A dict of standard names to the provenance they were built with
+    '''
+    def __init__(self, personae: dict = None, standards: dict = None):
+        self.personae = {}
+        self.standards = dict(standards or {})
+        self.changed_personae = set()
+        self.changed_standards = set()
+        self.lock = threading.Lock()
+
+        for personae_name, dependencies in (personae or {}).items():
+            self.set_personae(personae_name, dependencies.get('standards', []), dependencies.get('continuous_data', []))
+
+        # only changes made after loading are tracked
+        self.changed_personae.clear()
+
+    @classmethod
+    def from_json(cls, graph_json: str) -> 'DependencyGraph':
+        graph = json.loads(graph_json)
+        return cls(graph.get('personae'), graph.get('standards'))
+
+    def to_json(self) -> str:
+        with self.lock:
+            return json.dumps({
+                'personae': {
+                    personae_name: {
+                        'standards': sorted(dependencies['standards']),
+                        'continuous_data': sorted(dependencies['continuous_data'])
+                    }
+                    for personae_name, dependencies in self.personae.items()
+                },
+                'standards': self.standards
+            }, sort_keys=True)
+
+    def set_personae(self, personae_name: str, standards, continuous_data) -> None:
+        '''
+        A function to record the standards and continuous data a personae was validated against
+
+        :param personae_name: The personae file name
+        :param standards: The names of the standards used
+        :param continuous_data: The names of the continuous data csvs used
+        :return: None
+        '''
+        with self.lock:
+            self.personae[personae_name] = {
+                'standards': set(standards),
+                'continuous_data': set(continuous_data)
+            }
+            self.changed_personae.add(personae_name)
+
+    def add_continuous_data(self, personae_name: str, csv_name: str) -> None:
+        '''
+        A function to record a continuous data csv a personae uses, as validation opens it
+
+        :param personae_name: The personae file name
+        :param csv_name: The name of the continuous data csv
+        :return: None
+        '''
+        with self.lock:
+            dependencies = self.personae.setdefault(personae_name, {'standards': set(), 'continuous_data': set()})
+            dependencies['continuous_data'].add(csv_name)
+            self.changed_personae.add(personae_name)
+
+    def remove_personae(self, personae_name: str) -> None:
+        with self.lock:
+            self.personae.pop(personae_name, None)
+            self.changed_personae.add(personae_name)
+
+    def set_standard(self, standard_name: str, provenance: str = PROVENANCE) -> None:
+        with self.lock:
+            self.standards[standard_name] = provenance
+            self.changed_standards.add(standard_name)
+
+    def remove_standard(self, standard_name: str) -> None:
+        with self.lock:
+            self.standards.pop(standard_name, None)
+            self.changed_standards.add(standard_name)
+
+    def personae_names(self) -> set:
+        with self.lock:
+            return set(self.personae)
+
+    def rebase(self, saved: 'DependencyGraph') -> 'DependencyGraph':
+        '''
+        A function to apply the changes made to this graph since it was loaded on top of another graph,
+        e.g. one saved by another process since this one was loaded
+
+        :param saved: The graph to apply the changes to, it is not changed
+        :return: :DependencyGraph: A new graph with the other graph's entries and this graph's changes
+        '''
+        rebased = DependencyGraph.from_json(saved.to_json())
+        with self.lock:
+            for personae_name in self.changed_personae:
+                if personae_name in self.personae:
+                    dependencies = self.personae[personae_name]
+                    rebased.personae[personae_name] = {key: set(names) for key, names in dependencies.items()}
+                else:
+                    rebased.personae.pop(personae_name, None)
+            for standard_name in self.changed_standards:
+                if standard_name in self.standards:
+                    rebased.standards[standard_name] = self.standards[standard_name]
+                else:
+                    rebased.standards.pop(standard_name, None)
+        return rebased
+
+    def personae_using_standard(self, standard_name: str) -> set:
+        with self.lock:
+            return {personae_name for personae_name, dependencies in self.personae.items() if standard_name in dependencies['standards']}
+
+    def personae_using_continuous_data(self, csv_name: str) -> set:
+        with self.lock:
+            return {personae_name for personae_name, dependencies in self.personae.items() if csv_name in dependencies['continuous_data']}
+
+    def personae_using_provenance(self, provenance: str = PROVENANCE) -> set:
+        '''
+        A function to return the personae whose standards were built with the provenance.
+        Standards a personae uses that are not recorded (e.g. missing when it was validated)
+        are treated as dependent, so those personae are revalidated too
+
+        :param provenance: The provenance name
+        :return: :set: The personae file names
+        '''
+        affected = set()
+        with self.lock:
+            for personae_name, dependencies in self.personae.items():
+                if any(self.standards.get(standard_name, provenance) == provenance for standard_name in dependencies['standards']):
+                    affected.add(personae_name)
+        return affected
+
+    def affected_personae(self, existing_personae, personae: set) -> set:
+        '''
+        A function to limit affected personae to those that exist, adding any personae the graph
+        has no record of since their dependencies are unknown
+
+        :param existing_personae: The personae file names currently in the project
+        :param personae: The personae found to be affected from the graph
+        :return: :set: The personae file names to revalidate
+        '''
+        existing_personae = set(existing_personae)
+        unknown = existing_personae - self.personae_names()
+        return (set(personae) | unknown) & existing_personae
@@ -1,14 +1,19 @@
+import io
 import os
 import re
 from flask import flash
 import openpyxl
-from functions import usefulFunctions as uf
+import numpy as np
+import usefulFunctions as uf
+import standardIndex as si
 import csv
 import json
 import shutil
-from jinja2 import Environment, FileSystemLoader
+import tempfile
+import sharedResources as shared
 from flask import render_template
 import copy
+import itertools
 from datetime import datetime, time, date
 
 # custom error handler
@@ -32,6 +37,11 @@ class MissingGroupAliasError(ExcelProcessingError):
         self.message = message
         super().__init__(self.message)
         
+class CircularAliasError(ExcelProcessingError):
+    def __init__(self, message="Circular path alias in excel file"):
+        self.message = message
+        super().__init__(self.message)
+
 class MissingSheetError(ExcelProcessingError):
     def __init__(self, message="Missing sheet in excel file"):
         super().__init__(self.message)
@@ -69,24 +79,74 @@ class CustomEncoder(json.JSONEncoder):
             obj = self.encode_dict(obj)
         return super().encode(obj)
     
+# number of rows at the top of a sheet that are searched for headings before the rest of the sheet
+HEADER_BAND_ROWS = 20
+
+
+class HeaderIndex:
+    '''
+    Records the coordinates of every heading in the header band of a sheet so that
+    heading lookups are answered from a dictionary instead of a scan of the sheet.
+    Only the first HEADER_BAND_ROWS rows are read up front. A heading that is not in them
+    is looked for in the rest of the sheet, which is then read once.
+    The index is not updated when the sheet is written, so make one per read of a sheet.
+
+    :param sheet: The sheet to index
+    :param band_rows: The number of rows at the top of the sheet to search for headings
+    '''
+    def __init__(self, sheet, band_rows: int = HEADER_BAND_ROWS):
+        self.sheet = sheet
+        self.band_rows = band_rows
+        self.locations = {}
+        self.scanned = False
+
+        # asking an editable sheet for rows past its end creates empty cells, read only sheets may not know their size
+        max_row = band_rows if sheet.max_row is None else min(band_rows, sheet.max_row)
+        self.add_rows(1, max_row)
+
+    def add_rows(self, min_row: int, max_row: int = None) -> None:
+        '''
+        A function to record the headings in a range of rows
+
+        :param min_row: The first row to read
+        :param max_row: The last row to read, the end of the sheet if None
+        :return: None
+        '''
+        for row_index, row in enumerate(self.sheet.iter_rows(min_row=min_row, max_row=max_row, values_only=True), start=min_row):
+            for cell_index, value in enumerate(row, start=1):
+                if value is not None:
+                    # the first (top left) occurrence of a heading wins
+                    self.locations.setdefault(str(value).lower().strip(), (row_index, cell_index))
+
+    def find(self, cell_value: str) -> tuple:
+        '''
+        Return the coordinates of a heading in the sheet
+
+        :param cell_value: The heading text to look up
+        :return: A tuple containing the row and column coordinates.
+        '''
+        heading = cell_value.lower().strip()
+        if heading not in self.locations and not self.scanned:
+            # headings below the band are rare, so the rest of the sheet is only read when one is asked for
+            self.scanned = True
+            if self.sheet.max_row is None or self.sheet.max_row > self.band_rows:
+                self.add_rows(self.band_rows + 1)
+        try:
+            return self.locations[heading]
+        except KeyError:
+            raise MissingHeadingsError(f"Missing heading '{cell_value}' in sheet {self.sheet.title}")
+
+
 def find_cell_location(sheet, cell_value: str) -> tuple:
     '''
-    Find the coordinates of a cell in a worksheet and return as a tuple.
+    Find the coordinates of a heading cell in a worksheet and return as a tuple.
+    To look up several headings of a sheet, make one HeaderIndex and use its find instead.
 
     :param sheet: The sheet to search.
     :param cell_value: The text to search for in the sheet.
     :return: A tuple containing the row and column coordinates.
     '''
-    row_index = 1
-    for row in sheet.iter_rows():
-        cell_index = 1
-        for cell in row:
-            value = str(cell.value).lower().strip()
-            if value == cell_value.lower():
-                return row_index, cell_index
-            cell_index += 1
-        row_index += 1
-    raise MissingHeadingsError(f"Missing headings in excel file {sheet.sheet_name}")
+    return HeaderIndex(sheet).find(cell_value)
 
 # not sure how to test this
 def open_workbook_sheets(path: str):
@@ -111,38 +171,153 @@ def open_workbook_sheets(path: str):
 
 
 
-# a function to get the group aliases from a sheet
-def expand_group_aliases(group_alias_sheet: dict, group_alias_name: str) -> list:
+def alias_cell_text(value):
     '''
-    A function to expand the group aliases in a sheet
+    A function to normalise the contents of an alias sheet cell
 
-    :param group_alias_sheet: The group alias sheet to process
-    :param group_alias_name: The name of the group alias to expand
-    :return: A list of expanded group aliases
+    :param value: The raw cell value
+    :return: The lowercased and stripped value, or None for empty cells
     '''
+    if value is None:
+        return None
+    value = str(value).lower().strip()
+    return value if value else None
+
 
-    # get the cell locations for the group alias name and path
-    alias_name_cell = find_cell_location(group_alias_sheet, 'Group Alias Name')
-    alias_path_cell = find_cell_location(group_alias_sheet, 'Path')
+class AliasResolver:
+    '''
+    Loads the path alias and group alias sheets of a workbook once into hash maps
+    and expands aliases from memory. Fully expanded path aliases, including nested
+    ($a -> $b.c) and indexed ($alias[2]) forms, are memoized for the life of the resolver.
 
-    # get the group alias paths
-    group_alias_paths = []
+    One resolver should be created per workbook and shared by every scenario sheet in it.
+
+    :param path_alias_sheet: The path alias sheet (or None if the workbook has none)
+    :param group_alias_sheet: The group alias sheet (or None if the workbook has none)
+    '''
+    def __init__(self, path_alias_sheet=None, group_alias_sheet=None):
+        self.path_aliases = {}
+        self.group_aliases = {}
+        self.expanded = {}
+        self.resolving = set()
+
+        if path_alias_sheet is not None:
+            self.load_path_aliases(path_alias_sheet)
+        if group_alias_sheet is not None:
+            self.load_group_aliases(group_alias_sheet)
+
+    def load_path_aliases(self, path_alias_sheet) -> None:
+        '''
+        A function to read every path alias in the sheet into the path alias map.
+        The first definition of a name wins, as it did when the sheet was scanned per lookup.
+
+        :param path_alias_sheet: The path alias sheet
+        :return: None
+        '''
+        header_index = HeaderIndex(path_alias_sheet)
+        alias_name_cell = header_index.find('Path Alias Name')
+        alias_value_cell = header_index.find('Value')
+        min_col = min(alias_name_cell[1], alias_value_cell[1])
+        name_offset = alias_name_cell[1] - min_col
+        value_offset = alias_value_cell[1] - min_col
+
+        for row in path_alias_sheet.iter_rows(min_row=alias_name_cell[0] + 1,
+                                              min_col=min_col,
+                                              max_col=max(alias_name_cell[1], alias_value_cell[1]),
+                                              values_only=True):
+            alias_name = alias_cell_text(row[name_offset])
+            alias_value = alias_cell_text(row[value_offset])
+
+            if alias_name and alias_value:
+                self.path_aliases.setdefault(alias_name, alias_value)
+
+    def load_group_aliases(self, group_alias_sheet) -> None:
+        '''
+        A function to read every group alias in the sheet into the group alias map.
+        The value of each group alias path is held in the column after the path.
+
+        :param group_alias_sheet: The group alias sheet
+        :return: None
+        '''
+        header_index = HeaderIndex(group_alias_sheet)
+        alias_name_cell = header_index.find('Group Alias Name')
+        alias_path_cell = header_index.find('Path')
+
+        for row in group_alias_sheet.iter_rows(min_row=alias_name_cell[0] + 1,
+                                               min_col=alias_name_cell[1],
+                                               max_col=alias_path_cell[1] + 1,
+                                               values_only=True):
+            alias_name = alias_cell_text(row[0])
+            if alias_name:
+                alias_path = alias_cell_text(row[-2])
+                alias_value = alias_cell_text(row[-1])
+                self.group_aliases.setdefault(alias_name, []).append((alias_path, alias_value))
+
+    def expand_path_alias(self, path_alias_name: str) -> str:
+        '''
+        A function to expand a single path alias element such as $alias or $alias[2]
+
+        :param path_alias_name: The path alias element to expand
+        :return: The fully expanded path
+        '''
+        if path_alias_name in self.expanded:
+            return self.expanded[path_alias_name]
+
+        if '[' in path_alias_name:
+            alias_name, alias_index = path_alias_name.split('[', 1)
+            expanded_value = f'{self.expand_path_alias(alias_name)}[{alias_index}'
+        else:
+            if path_alias_name not in self.path_aliases:
+                raise MissingPathAliasError(f'Missing path alias {path_alias_name} in excel file')
+            if path_alias_name in self.resolving:
+                raise CircularAliasError(f'Circular path alias {path_alias_name} in excel file')
+
+            self.resolving.add(path_alias_name)
+            try:
+                alias_value = self.path_aliases[path_alias_name]
+                if '$' in alias_value:
+                    alias_value = '.'.join(self.expand_split_path(alias_value.split('.')))
+            finally:
+                self.resolving.discard(path_alias_name)
+            expanded_value = alias_value
+
+        self.expanded[path_alias_name] = expanded_value
+        return expanded_value
+
+    def expand_split_path(self, split_path: list) -> list:
+        '''
+        A function to expand every path alias element in a split path
+
+        :param split_path: The path as a list of elements
+        :return: A new list with each $ element replaced by its expansion
+        '''
+        return [self.expand_path_alias(element) if element.startswith('$') else element
+                for element in split_path]
+
+    def expand_group_aliases(self, group_alias_name: str) -> tuple:
+        '''
+        A function to expand a group alias into its paths and values
+
+        :param group_alias_name: The name of the group alias to expand (without the $$)
+        :return: A tuple of (path, value) pairs, so callers cannot change the loaded alias
+        '''
+        try:
+            return tuple(self.group_aliases[group_alias_name])
+        except KeyError:
+            raise MissingGroupAliasError(f'Missing group alias {group_alias_name} in excel file')
 
-    for row in group_alias_sheet.iter_rows(min_row=alias_name_cell[0] + 1,
-                                           max_row=group_alias_sheet.max_row,
-                                           min_col=alias_name_cell[1],
-                                           max_col=alias_path_cell[1]+1):
-        if row[0].value:
-            alias_name = row[0].value.lower().strip()
-            alias_path = row[-2].value.lower().strip()
-            alias_value = row[-1].value.lower().strip()
 
-            if alias_name == group_alias_name:
-                group_alias_paths.append([alias_path, alias_value])
+# a function to get the group aliases from a sheet
+def expand_group_aliases(group_alias_sheet: dict, group_alias_name: str) -> tuple:
+    '''
+    A function to expand the group aliases in a sheet
+    Prefer AliasResolver.expand_group_aliases when expanding more than one alias from a workbook
 
-    if group_alias_paths:
-        return group_alias_paths
-    return MissingGroupAliasError(f'Missing group alias {group_alias_name} in excel file')
+    :param group_alias_sheet: The group alias sheet to process
+    :param group_alias_name: The name of the group alias to expand
+    :return: A tuple of (path, value) pairs
+    '''
+    return AliasResolver(group_alias_sheet=group_alias_sheet).expand_group_aliases(group_alias_name)
 
 def trim_first_elements(path_list: list):
     '''
@@ -189,6 +364,75 @@ def sort_paths(start_paths: list):
                 sorted_paths.append([path_item])
     return sorted_paths
 
+def is_indexed(segment: str) -> bool:
+    '''
+    A function to check if a path segment carries an index such as [2], [] or [*]
+
+    :param segment: The path segment to check
+    :return: :bool:
+    '''
+    open_bracket = segment.find('[')
+    while open_bracket != -1:
+        end = open_bracket + 1
+        while end < len(segment) and segment[end] in '0123456789*':
+            end += 1
+        if end < len(segment) and segment[end] == ']':
+            return True
+        open_bracket = segment.find('[', open_bracket + 1)
+    return False
+
+
+def build_object(start_paths: list) -> dict:
+    '''
+    A function that creates a JSON object from a path list in a single pass.
+    Produces the same shape as create_object in O(total segments): paths are inserted
+    into a tree keyed by segment (keeping first-seen order) which is then emitted,
+    with indexed segments ([n]) becoming lists in the order their index was first seen.
+    Expects a well formed path list, i.e. no path is also the start of a longer path.
+
+    :param start_paths: the path list (as a list of [path, value] where path is a list of elements)
+    :return: :dict:
+    '''
+    # each node is (children keyed by segment, values of paths ending at the node)
+    root = ({}, [])
+    for path, value in start_paths:
+        node = root
+        for segment in path:
+            child = node[0].get(segment)
+            if child is None:
+                child = node[0][segment] = ({}, [])
+            node = child
+        node[1].append(value)
+
+    return emit_object(root[0])
+
+
+def emit_object(children: dict) -> dict:
+    '''
+    A function to turn the children of a build_object tree node into a JSON object
+
+    :param children: The children of the node keyed by segment
+    :return: :dict:
+    '''
+    result = {}
+    for segment, (grandchildren, values) in children.items():
+        if grandchildren:
+            item = emit_object(grandchildren)
+        else:
+            item = str(values[-1])
+
+        if is_indexed(segment):
+            key = segment.split('[')[0]
+            existing = result.get(key)
+            if isinstance(existing, list):
+                existing.append(item)
+            else:
+                result[key] = [item]
+        else:
+            result[segment] = item
+    return result
+
+
 # a function to turn scenario paths into a JSON object
 def create_object(start_paths: list):
     '''
@@ -262,13 +506,218 @@ def create_object(start_paths: list):
 
 
 
+# scenario sheet intermediate representation (IR)
+# Each instruction is a list whose first element is the opcode and second the sheet row:
+#   ['path', row, segments, value]              literal path
+#   ['alias', row, segments, value]             path containing $ path aliases
+#   ['group', row, prefix_segments, alias_name] $$ group alias fan-out
+#   ['loop', row, csv_name, template_lines]     $loop block with its [path, value] template lines
+SCENARIO_IR_VERSION = 1
+
+
+def compile_scenario_sheet(scenario_sheet) -> dict:
+    '''
+    A function to compile a scenario sheet into an instruction list.
+    The sheet is read once and each row is classified once, so the result can be
+    evaluated many times (or cached with scenario_ir_to_json) without touching openpyxl again.
+
+    :param scenario_sheet: The scenario sheet to compile
+    :return: :dict: The compiled sheet
+    '''
+    header_index = HeaderIndex(scenario_sheet)
+    path_location = header_index.find('Data Path')
+    example_data_location = header_index.find('Example Data')
+    min_col = min(path_location[1], example_data_location[1])
+    path_offset = path_location[1] - min_col
+    value_offset = example_data_location[1] - min_col
+
+    instructions = []
+    loop = None
+
+    for row_number, row in enumerate(scenario_sheet.iter_rows(min_row=path_location[0] + 1,
+                                                              min_col=min_col,
+                                                              max_col=max(path_location[1], example_data_location[1]),
+                                                              values_only=True),
+                                     start=path_location[0] + 1):
+        if not row or not row[path_offset]:
+            continue
+
+        path = str(row[path_offset]).lower().strip()
+        value = row[value_offset] if len(row) > value_offset else None
+
+        # collect the template lines of a loop block
+        if loop is not None:
+            if path == '$loopend':
+                instructions.append(loop)
+                loop = None
+            else:
+                loop[3].append([path, value])
+
+        elif '$$' in path:
+            split_path = path.split('.')
+            group_alias_name = split_path[-1].replace('$$', '').strip()
+            instructions.append(['group', row_number, split_path[:-1], group_alias_name])
+
+        elif '$loop' in path:
+            if path != '$loopend':
+                csv_name = path.replace('$loop', '').strip()
+                loop = ['loop', row_number, csv_name, []]
+
+        elif '$' in path:
+            instructions.append(['alias', row_number, path.split('.'), value])
+
+        else:
+            instructions.append(['path', row_number, path.split('.'), value])
+
+    if loop is not None:
+        raise ExcelProcessingError(f'$loop on row {loop[1]} of sheet {scenario_sheet.title} has no $loopend')
+
+    return {
+        'version': SCENARIO_IR_VERSION,
+        'sheet': scenario_sheet.title,
+        'instructions': instructions
+    }
+
+
+def iter_scenario_ir(scenario_ir: dict, resolver: AliasResolver, continuous_data):
+    '''
+    A generator that evaluates a compiled scenario sheet into path/value pairs
+
+    :param scenario_ir: The compiled sheet from compile_scenario_sheet
+    :param resolver: The alias resolver for the workbook
+    :param continuous_data: A callable taking a csv name and returning an iterable of its rows
+    :return: Yields (segments, value, row) tuples in sheet order
+    '''
+    for instruction in scenario_ir['instructions']:
+        opcode, row = instruction[0], instruction[1]
+
+        if opcode == 'path':
+            yield instruction[2], instruction[3], row
+
+        elif opcode == 'alias':
+            expanded = '.'.join(resolver.expand_split_path(instruction[2]))
+            yield expanded.split('.'), instruction[3], row
+
+        elif opcode == 'group':
+            prefix = '.'.join(resolver.expand_split_path(instruction[2]))
+            for alias_path, alias_value in resolver.expand_group_aliases(instruction[3]):
+                with_group_alias = f'{prefix}.{alias_path}' if prefix else alias_path
+                if '$' in with_group_alias:
+                    with_group_alias = '.'.join(resolver.expand_split_path(with_group_alias.split('.')))
+                yield with_group_alias.split('.'), alias_value, row
+
+        elif opcode == 'loop':
+            rows = continuous_data(instruction[2])
+            for path, value in iter_loop_lines_columnar(instruction[3], rows, resolver):
+                yield path.split('.'), value, row
+
+        else:
+            raise ExcelProcessingError(f'Unknown scenario instruction {opcode}')
+
+
+def evaluate_scenario_ir(scenario_ir: dict, resolver: AliasResolver, continuous_data) -> list:
+    '''
+    A function to evaluate a compiled scenario sheet into a path list
+
+    :param scenario_ir: The compiled sheet from compile_scenario_sheet
+    :param resolver: The alias resolver for the workbook
+    :param continuous_data: A callable taking a csv name and returning its rows
+    :return: :list: A list of [segments, value] pairs
+    '''
+    return [[segments, value] for segments, value, row in iter_scenario_ir(scenario_ir, resolver, continuous_data)]
+
+
+def encode_ir_value(obj):
+    '''
+    A function to tag the date and time values of a compiled sheet for json.dumps, used as its default
+
+    :param obj: A value json cannot serialise
+    :return: :dict: The value in isoformat under a __datetime__, __date__ or __time__ key
+    '''
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+    if isinstance(obj, date):
+        return {'__date__': obj.isoformat()}
+    if isinstance(obj, time):
+        return {'__time__': obj.isoformat()}
+    raise TypeError("Type not serializable")
+
+
+def decode_ir_value(obj: dict):
+    '''
+    A function to turn the values tagged by encode_ir_value back into dates and times, used as the json.loads object_hook
+
+    :param obj: A decoded JSON object
+    :return: The datetime, date or time, or the object unchanged if it is not tagged
+    '''
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    if '__time__' in obj:
+        return time.fromisoformat(obj['__time__'])
+    return obj
+
+
+def scenario_ir_to_json(scenario_ir: dict) -> str:
+    '''
+    A function to serialise a compiled scenario sheet so it can be cached next to the workbook
+
+    :param scenario_ir: The compiled sheet
+    :return: :str: The JSON text
+    '''
+    return json.dumps(scenario_ir, default=encode_ir_value)
+
+
+def scenario_ir_from_json(scenario_ir_json: str) -> dict:
+    '''
+    A function to load a compiled scenario sheet saved with scenario_ir_to_json
+
+    :param scenario_ir_json: The JSON text
+    :return: :dict: The compiled sheet
+    '''
+    scenario_ir = json.loads(scenario_ir_json, object_hook=decode_ir_value)
+    if scenario_ir.get('version') != SCENARIO_IR_VERSION:
+        raise ExcelProcessingError(f'Unsupported scenario IR version {scenario_ir.get("version")}')
+    return scenario_ir
+
+
+def iter_continuous_data(csv_stream):
+    '''
+    A generator that parses a continuous data csv from a binary stream row by row
+
+    :param csv_stream: A binary file-like object (local file, bucket blob reader, BytesIO)
+    :return: Yields each non-blank csv row as a list of cells
+    '''
+    text_stream = io.TextIOWrapper(csv_stream, encoding='utf-8', newline='')
+    try:
+        for row in csv.reader(text_stream, delimiter=','):
+            if row:
+                yield row
+    finally:
+        # leave the underlying stream for the caller to close
+        text_stream.detach()
+
+
+def read_continuous_data(continuous_data_path: str):
+    '''
+    A generator that streams the rows of a local continuous data csv file
+
+    :param continuous_data_path: The path to the continuous data file
+    :return: Yields the csv rows
+    '''
+    with open(continuous_data_path, 'rb') as csv_file:
+        yield from iter_continuous_data(csv_file)
+
+
 # a function to process the scenario sheets in an excel file
 def get_scenario_path_list(scenario_sheet: dict,
                            group_alias_sheet: dict,
                            path_alias_sheet: dict,
                            continuous_data_path: list,
                            user_session: str,
-                           TMP_DIR: str) -> list:
+                           TMP_DIR: str,
+                           resolver: AliasResolver = None) -> list:
     '''
     A function to process a scenario sheet and return the paths
 
@@ -277,188 +726,39 @@ def get_scenario_path_list(scenario_sheet: dict,
     :param path_alias_sheet: The path alias sheet
     :param continuous_data_path: The path to the continuous data file
     :param TMP_DIR: The path to the temporary directory
+    :param resolver: The alias resolver shared by every sheet of the workbook. Built from the alias sheets if not given
     '''
+    if resolver is None:
+        resolver = AliasResolver(path_alias_sheet, group_alias_sheet)
 
-    # get the cell locations for the path and example data
-    
-    path_location = find_cell_location(scenario_sheet, 'Data Path')
-    example_data_location = find_cell_location(scenario_sheet, 'Example Data')
-
+    # continuous data for $loop blocks is read from the session upload directory
+    def continuous_data(csv_name):
+        return read_continuous_data(f'{TMP_DIR}/{user_session}/upload/{csv_name}')
 
-    # get the paths
+    scenario_ir = compile_scenario_sheet(scenario_sheet)
+    
+    # expand the sheet, tracking the row each path/value pair was first seen on
     path_list = []
-    duplicates = []
-    in_loop = False
-
-    for row in scenario_sheet.iter_rows(min_row=path_location[0] + 1,
-                                        max_row=scenario_sheet.max_row,
-                                        min_col=path_location[1],
-                                        max_col=example_data_location[1]):
-        
-        # loop over the rows and expand the path if needed
-        if row[0].value:
-            path = row[0].value.lower().strip()
-            value = row[1].value
-
-            # check if in loop
-            if in_loop:
-                if path != '$loopend':
-                    continue
-                elif path == '$loopend':
-                    in_loop = False
-                    continue
-
-            # process group alias
-            elif '$$' in path:
-                
-                # get the group alias name
-                group_alias_name = path.split('.')[-1].replace('$$', '').strip().lower()
-
-                # get the rest of the path
-                without_alias = '.'.join(path.split('.')[:-1])
+    tracker = DuplicateTracker()
+    for segments, value, row in iter_scenario_ir(scenario_ir, resolver, continuous_data):
+        path_list.append([segments, value])
+        tracker.add(segments, value, row)
 
-                # get the group alias paths
-                group_alias_paths = expand_group_aliases(group_alias_sheet, group_alias_name)
-
-                split_path = path.split('.')
-                for index, element in enumerate(split_path[:-1]):
-                    if element.startswith('$'):
-                        # if element has an index, remove it
-                        if '[' in element:
-                            element_no_index = element.split('[')[0]
-                            element_index = element.split('[')[1].replace(']', '')
-                        
-                            # get the expanded value
-                            expanded_value = expand_path_alias(element_no_index, path_alias_sheet)
-                            expanded_value = f'{expanded_value}[{element_index}]'
-                        else:
-                            # get the expanded value
-                            expanded_value = expand_path_alias(element, path_alias_sheet)
-                        
-                        # replace the element with the expanded value
-                        split_path[index] = expanded_value
-
-                path = '.'.join(split_path)
-
-                for alias_path in group_alias_paths:
-                    with_group_alias = f'{path.split("$$")[0]}{alias_path[0]}'
-                    path_list.append([with_group_alias.split('.'), alias_path[1]])
-
-            elif '$loop' in path:
-                
-                # set in loop to true
-                in_loop = True
-                
-                # get csv name & path
-                csv_name = path.replace('$loop', '').strip().lower()
-                continuous_data_path = f'{TMP_DIR}/{user_session}/upload/{csv_name}'
-                
-                # get loop lines
-                loop_start = row[0].row
-                
-                # get loop lines
-                loop_lines = get_loop_lines(scenario_sheet, loop_start, path_location[1], example_data_location[1])
-                
-                # expand the loop lines
-                expanded_loop_lines = expand_loop_lines(loop_lines, continuous_data_path, path_alias_sheet, group_alias_sheet)
-
-                # append to path list
-                [path_list.append([arr[0].split('.'), arr[1]]) for arr in expanded_loop_lines]
-                
-            elif '$' in path:
-                
-                # get split path
-                split_path = path.split('.')
-                
-                # loop over the split path if there is a $ find the expanded value and replace
-                for index, element in enumerate(split_path):
-                    if element.startswith('$'):
-                        # if element has an index, remove it
-                        if '[' in element:
-                            element_no_index = element.split('[')[0]
-                            element_index = element.split('[')[1].replace(']', '')
-                        
-                            # get the expanded value
-                            expanded_value = expand_path_alias(element_no_index, path_alias_sheet)
-                            expanded_value = f'{expanded_value}[{element_index}]'
-                        else:
-                            # get the expanded value
-                            expanded_value = expand_path_alias(element, path_alias_sheet)
-                        
-                        # replace the element with the expanded value
-                        split_path[index] = expanded_value
-
-                # add to path list
-                path_list.append([split_path, value])
-            
-            else:
-                # add to path list
-                path_list.append([path.split('.'), value])
-                
-            if [path.split('.'), value] in path_list[:-1]:
-                duplicates.append(path_list[-1])
-
-    return path_list, duplicates
-                
-
-            
+    return path_list, tracker.duplicates
 
 
 # a function to expand path aliases
 def expand_path_alias(path_alias_name, path_alias_sheet):
     '''
     A function to expand path aliases
+    Prefer AliasResolver.expand_path_alias when expanding more than one alias from a workbook
+
     :param path_alias_name: The name of the path alias to expand
     :param path_alias_sheet: The path alias sheet
     
     :return: A list of expanded path aliases
     '''
-    
-    # get the cell locations for the path alias name and path
-    alias_name_cell = find_cell_location(path_alias_sheet, 'Path Alias Name')
-    alias_path_cell = find_cell_location(path_alias_sheet, 'Value')
-    
-    origional_name = path_alias_name
-    
-    if '[' in path_alias_name:
-        path_alias_name = origional_name.split('[')[0]
-        alias_index = origional_name.split('[')[-1][:-1]
-    else:
-        alias_index = None
-
-    # get the path alias paths
-    for row in path_alias_sheet.iter_rows(min_row=alias_name_cell[0] + 1,
-                                          max_row=path_alias_sheet.max_row,
-                                          min_col=alias_name_cell[1],
-                                          max_col=alias_path_cell[1]+1):
-        alias_name = row[0].value.lower().strip()
-        alias_value = row[1].value.lower().strip()
-        
-        if alias_value and alias_name:
-            if alias_name == path_alias_name:
-                if '$' in alias_value:
-                    # split the path alias value
-                    split_value = alias_value.split('.')
-                    
-                    # loop over the split value if there is a $ find the expanded value and replace
-                    for index, element in enumerate(split_value):
-                        if element.startswith('$'):
-                            # get the expanded value
-                            expanded_value = expand_path_alias(element, path_alias_sheet)
-                            
-                            # replace the element with the expanded value
-                            split_value[index] = expanded_value
-                            
-                            if alias_index != None:
-                                return f'{".".join(split_value)}[{alias_index}]'
-                            else: 
-                                return '.'.join(split_value)
-                else:
-                    if alias_index != None:
-                        return f'{alias_value}[{alias_index}]'
-                    else:
-                        return alias_value
-    raise MissingPathAliasError(f'Missing path alias {path_alias_name} in excel file')
+    return AliasResolver(path_alias_sheet=path_alias_sheet).expand_path_alias(path_alias_name)
     
 
 def get_loop_lines(scenario_sheet: dict, loop_start: int, path_cell: int, value_cell: int) -> list:
@@ -486,103 +786,237 @@ def get_loop_lines(scenario_sheet: dict, loop_start: int, path_cell: int, value_
             
             loop_lines.append([path, value])
 
-def expand_loop_lines(loop_lines: list, 
-                      continuous_data_path: str,
-                      path_alias_sheet: dict,
-                      group_alias_sheet: dict):
+def convert_continuous_value(cell: str):
     '''
-    A function to expand the loop lines
-    
+    A function to convert a continuous data cell to an example data value
+
+    :param cell: The csv cell
+    :return: An int for digit-only cells, otherwise the lowercased and stripped text
+    '''
+    if cell.isdigit():
+        return int(cell)
+    return cell.lower().strip()
+
+
+def compile_loop_lines(loop_lines: list) -> list:
+    '''
+    A function to pre-process loop template lines once, before any csv row is read
+
+    :param loop_lines: The [path, value] loop lines
+    :return: :list: (path parts split on %, csv column or None, value, is group alias, has path alias) per line
+    '''
+    compiled = []
+    for path, value in loop_lines:
+        column = int(value.replace('#', '')) if str(value).startswith('#') else None
+        is_group_alias = path.split('.')[-1].startswith('$$')
+        compiled.append((path.split('%'), column, value, is_group_alias, '$' in path))
+    return compiled
+
+
+def iter_loop_lines(loop_lines: list, continuous_data, resolver: AliasResolver):
+    '''
+    A generator that lazily expands loop lines over the rows of a continuous data file.
+    % in a path is replaced by the row index and a #n value by column n of the row.
+    Each referenced column is converted once per row and shared by every loop line.
+
     :param loop_lines: The loop lines to expand
-    :param continuous_data_path: The path to the continuous data file
-    :param path_alias_sheet: The path alias sheet
-    :param group_alias_sheet: The group alias sheet
-    :return: :list:
+    :param continuous_data: An iterable of csv rows, e.g. from iter_continuous_data
+    :param resolver: The alias resolver for the workbook
+    :return: Yields [path, value] pairs
     '''
-    
-    path_list = []
-    
-    # open continuous data file
-    with open(continuous_data_path) as csv_file:
-        continuous_data = list(csv.reader(csv_file, delimiter=','))
-        
+    compiled = compile_loop_lines(loop_lines)
+
     for index, continuous_data_arr in enumerate(continuous_data):
+        index_str = str(index)
+        converted = {}
 
+        for path_parts, column, value, is_group_alias, has_alias in compiled:
 
-        # loop over loop_lines
-        for loop_lines_arr in loop_lines:
-            path = loop_lines_arr[0]
-            value = loop_lines_arr[1]
-            
             # apply index to path
-            path = path.replace('%', str(index))
-            
-            # check value isnt a reference
-            if str(value).startswith('#'):
-                
-                # get index of value from continuous data 
-                value_index = int(value.replace('#',''))
-                
-                # sort the csv file into array
-                # test
-                
-                value = str(continuous_data_arr[value_index])
-                
-                
-                # if digit then convert to int
-                if value.isdigit():
-                    value = int(value)
-                else:
-                    value = value.lower().strip()
-            
+            path = index_str.join(path_parts)
+
+            # take the value from the csv row
+            if column is not None:
+                if column not in converted:
+                    converted[column] = convert_continuous_value(str(continuous_data_arr[column]))
+                value = converted[column]
+
             # check for group alias
-            if path.split('.')[-1].startswith('$$'):
-                group_alias_name = path.split('.')[-1].replace('$$', '').strip().lower()
-                group_alias_paths = expand_group_aliases(group_alias_sheet, group_alias_name)
+            if is_group_alias:
+                split_path = path.split('.')
+                group_alias_name = split_path[-1].replace('$$', '').strip().lower()
 
-                for alias_path in group_alias_paths:
-                    if len(path.split('.')[:-1]) != 0:
-                        path_array = '.'.join([path.split('.')[:-1], alias_path[0]]).split('.')
-                    else:
-                        path_array = alias_path[0].split('.')
+                for alias_path, alias_value in resolver.expand_group_aliases(group_alias_name):
+                    path_array = resolver.expand_split_path(split_path[:-1] + alias_path.split('.'))
+                    yield ['.'.join(path_array), alias_value]
 
-                    path_value = alias_path[1]
+            # check for path alias
+            elif has_alias:
+                yield ['.'.join(resolver.expand_split_path(path.split('.'))), value]
 
-                    # check for path aliases
-                    for index, element in enumerate(path_array):
-                        if element.startswith('$'):
+            else:
+                yield [path, value]
 
-                            # expand path alias
-                            expanded = expand_path_alias(element, path_alias_sheet)
 
-                            # replace the element with the expanded value
-                            path_array[index] = expanded
+# number of csv rows expanded together by the columnar loop engine
+LOOP_CHUNK_ROWS = 10000
 
-                    path_list.append(['.'.join(path_array), path_value])
 
-            # check for path alias
-            if '$' in path:
-                
-                # get split path
-                split_path = path.split('.')
-                
-                # loop over the split path if there is a $ find the expanded value and replace
-                for index, element in enumerate(split_path):
-                    if element.startswith('$'):
-                        # get the expanded value
-                        expanded_value = expand_path_alias(element, path_alias_sheet)
-                        
-                        # replace the element with the expanded value
-                        split_path[index] = expanded_value
-
-                # add to path list
-                path_list.append(['.'.join(split_path), value])
-            
-            else:
-                # add to path list
-                path_list.append([path, value])
-                
-    return path_list
+def compile_loop_template(path: str, resolver: AliasResolver) -> list:
+    '''
+    A function to expand the path aliases of a loop path template while keeping its % placeholders.
+    $alias[%] expands as $alias with the [%] kept, exactly as it does once the index is applied
+
+    :param path: The loop line path
+    :param resolver: The alias resolver for the workbook
+    :return: :list: The expanded path split on %, or None if it can only be expanded row by row
+    '''
+    split_path = path.split('.')
+    for index, element in enumerate(split_path):
+        if element.startswith('$'):
+            alias_name, bracket, rest = element.partition('[')
+            if '%' in alias_name:
+                return None
+            expanded = resolver.expand_path_alias(alias_name)
+            if '%' in expanded:
+                return None
+            split_path[index] = f'{expanded}{bracket}{rest}'
+    return '.'.join(split_path).split('%')
+
+
+def compile_loop_outputs(loop_lines: list, resolver: AliasResolver) -> list:
+    '''
+    A function to compile loop lines into the outputs produced for every csv row
+
+    :param loop_lines: The [path, value] loop lines
+    :param resolver: The alias resolver for the workbook
+    :return: :list: (path parts split on %, csv column or None, constant value) per output, or None if the
+             loop has to be expanded row by row
+    '''
+    outputs = []
+    for path_parts, column, value, is_group_alias, has_alias in compile_loop_lines(loop_lines):
+        path = '%'.join(path_parts)
+
+        if is_group_alias:
+            split_path = path.split('.')
+            group_alias_name = split_path[-1].replace('$$', '').strip().lower()
+            if '%' in group_alias_name:
+                return None
+            prefix_parts = compile_loop_template('.'.join(split_path[:-1]), resolver) if len(split_path) > 1 else ['']
+            if prefix_parts is None:
+                return None
+
+            for alias_path, alias_value in resolver.expand_group_aliases(group_alias_name):
+                expanded_alias = '.'.join(resolver.expand_split_path(alias_path.split('.')))
+                separator = '.' if len(split_path) > 1 else ''
+                outputs.append((prefix_parts[:-1] + [f'{prefix_parts[-1]}{separator}{expanded_alias}'], None, alias_value))
+
+        else:
+            template = compile_loop_template(path, resolver) if has_alias else path_parts
+            if template is None:
+                return None
+            outputs.append((template, column, value))
+    return outputs
+
+
+def convert_continuous_column(cells: list) -> list:
+    '''
+    A function to convert a whole csv column with convert_continuous_value semantics in bulk
+
+    :param cells: The csv cells of the column
+    :return: :list: The converted values
+    '''
+    cells = np.array(cells, dtype=str)
+    digits = np.char.isdigit(cells)
+    values = np.char.strip(np.char.lower(cells)).astype(object)
+
+    if digits.any():
+        try:
+            values[digits] = cells[digits].astype(np.int64).tolist()
+        except (ValueError, OverflowError):
+            values[digits] = [int(cell) for cell in cells[digits]]
+
+    return values.tolist()
+
+
+def expand_loop_chunk(outputs: list, chunk: list, start: int) -> list:
+    '''
+    A function to expand one chunk of csv rows column by column
+
+    :param outputs: The compiled loop outputs from compile_loop_outputs
+    :param chunk: The csv rows of the chunk
+    :param start: The index of the first row of the chunk
+    :return: :list: The [path, value] pairs of the chunk in row order
+    '''
+    row_count = len(chunk)
+    indexes = np.arange(start, start + row_count).astype(str)
+
+    # convert each referenced column once for the whole chunk
+    columns = {}
+    for path_parts, column, value in outputs:
+        if column is not None and column not in columns:
+            columns[column] = convert_continuous_column([row[column] for row in chunk])
+
+    expanded = []
+    for path_parts, column, value in outputs:
+        if len(path_parts) == 1:
+            paths = [path_parts[0]] * row_count
+        else:
+            paths = np.char.add(path_parts[0], indexes)
+            for index, part in enumerate(path_parts[1:], start=1):
+                if part:
+                    paths = np.char.add(paths, part)
+                if index < len(path_parts) - 1:
+                    paths = np.char.add(paths, indexes)
+            paths = paths.tolist()
+
+        values = columns[column] if column is not None else [value] * row_count
+        expanded.append(zip(paths, values))
+
+    # interleave the outputs back into row order
+    return [[path, value] for row in zip(*expanded) for path, value in row]
+
+
+def iter_loop_lines_columnar(loop_lines: list, continuous_data, resolver: AliasResolver, chunk_rows: int = LOOP_CHUNK_ROWS):
+    '''
+    A generator that expands loop lines with the same output as iter_loop_lines, but
+    compiles the template once and generates the paths and values of each template line
+    for a whole chunk of csv rows at a time with NumPy.
+    Loops whose aliases depend on the row index fall back to iter_loop_lines.
+
+    :param loop_lines: The loop lines to expand
+    :param continuous_data: An iterable of csv rows, e.g. from iter_continuous_data
+    :param resolver: The alias resolver for the workbook
+    :param chunk_rows: The number of csv rows to expand at a time
+    :return: Yields [path, value] pairs
+    '''
+    outputs = compile_loop_outputs(loop_lines, resolver)
+    if outputs is None:
+        yield from iter_loop_lines(loop_lines, continuous_data, resolver)
+        return
+
+    rows = iter(continuous_data)
+    start = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            return
+        yield from expand_loop_chunk(outputs, chunk, start)
+        start += len(chunk)
+
+
+def expand_loop_lines(loop_lines: list, 
+                      continuous_data,
+                      resolver: AliasResolver):
+    '''
+    A function to expand the loop lines
+    
+    :param loop_lines: The loop lines to expand
+    :param continuous_data: The rows of the continuous data file
+    :param resolver: The alias resolver for the workbook
+    :return: :list:
+    '''
+    return list(iter_loop_lines(loop_lines, continuous_data, resolver))
 
 
 def serialize_datetime(obj): 
@@ -591,6 +1025,21 @@ def serialize_datetime(obj):
     raise TypeError("Type not serializable")
 
 
+# the encoder the .paths.json files have always been written with
+paths_encoder = CustomEncoder(indent=4, default=serialize_datetime)
+
+def encode_path_item(segments, value) -> str:
+    '''
+    A function to encode one scenario path as an item of a .paths.json list, so the list can be
+    written a path at a time in the same format as json.dump(scenario_paths, f, indent=4) wrote it
+
+    :param segments: The path elements
+    :param value: The example data of the path
+    :return: :str: The encoded item, indented one level
+    '''
+    return ''.join(paths_encoder.iterencode([segments, value])).replace('\n', '\n    ')
+
+
 # a main wrapper function for the scenario tool
 def scenario_tool(upload_dir: str, 
                   user_session: str, 
@@ -644,8 +1093,7 @@ def scenario_tool(upload_dir: str,
     os.mkdir(f'{TMP_DIR}/{user_session}/website/logs')
     
     # render the index tempalte
-    env = Environment(loader=FileSystemLoader('templates'))
-    template = env.get_template('index_template.jinja')
+    template = shared.template_env('templates').get_template('index_template.jinja')
     output = template.render(personae=personae)
 
     with open(f'{TMP_DIR}/{user_session}/website/index.html', 'w') as f:
@@ -705,35 +1153,69 @@ def scenario_tool(upload_dir: str,
         scenario_false_paths[file_name] = {}
         scenario_duplicates[file_name] = {}
         
+        # index the standard once for every sheet
+        standard_index = si.StandardIndex.coerce(standard_paths)
+        
+        # one alias resolver is shared by every scenario sheet in the workbook
+        resolver = AliasResolver(path_alias_sheet, group_alias_sheet)
+        
+        # continuous data for $loop blocks is read from the session upload directory
+        def continuous_data(csv_name):
+            return read_continuous_data(f'{TMP_DIR}/{user_session}/upload/{csv_name}')
+        
         for scenario in scenario_sheets:
-            scenario_paths, duplicates = get_scenario_path_list(scenario, group_alias_sheet, path_alias_sheet, continuous_data_files, user_session,TMP_DIR)
-            
-            if file_name != 'Provenance.xlsx':
-                # save scenario paths
-                with open(f'{TMP_DIR}/{user_session}/output/logs/{file_name}-{scenario.title}.paths.json', 'w') as f:
-                    json.dump(scenario_paths, f, indent=4, cls=CustomEncoder, default=serialize_datetime)
-
-            # check for invalid paths
-            false_paths = validate_scenario_paths(scenario_paths, standard_paths)
             scenario_name = scenario.title
-            scenario_false_paths[file_name][scenario_name] = false_paths
-            scenario_duplicates[file_name][scenario_name] = duplicates
+            scenario_ir = compile_scenario_sheet(scenario)
+            tracker = DuplicateTracker()
+            false_paths = []
+            linked_data = LinkedDataWriter()
+            paths_file = None
+            if file_name != 'Provenance.xlsx':
+                paths_file = open(f'{TMP_DIR}/{user_session}/output/logs/{file_name}-{scenario_name}.paths.json', 'w')
             
-            # make the scenario paths into a JSON object
-            scenario_object = create_object(scenario_paths)
+            # stream the paths of the sheet into the object, saving, checking and collecting each on the way
+            def scenario_paths():
+                written = 0
+                for segments, value, row in iter_scenario_ir(scenario_ir, resolver, continuous_data):
+                    tracker.add(segments, value, row)
+                    linked_data.add(segments, value)
+                    false_paths.extend(validate_scenario_paths([[segments, value]], standard_index, report_prefix=True))
+                    if paths_file is not None:
+                        paths_file.write((',\n    ' if written else '[\n    ') + encode_path_item(segments, value))
+                        written += 1
+                    yield segments, value
+                if paths_file is not None:
+                    paths_file.write('\n]' if written else '[]')
             
-            # render the scenario object
-            uf.render_template('json_render.html', scenario_object, f'{TMP_DIR}/{user_session}/website/data/{file_name}/rendered/{scenario_name}.html')
-            uf.render_template('tree_view_template.jinja', scenario_object, f'{TMP_DIR}/{user_session}/website/data/{file_name}/tree/{scenario_name}.html')
-            with open(f'{TMP_DIR}/{user_session}/website/data/{file_name}/json/{scenario_name}.json', 'w') as f:
-                json.dump(scenario_object, f, indent=4)
+            try:
+                try:
+                    # make the scenario paths into a JSON object
+                    scenario_object = build_object(scenario_paths())
+                finally:
+                    if paths_file is not None:
+                        paths_file.close()
+                scenario_false_paths[file_name][scenario_name] = false_paths
+                scenario_duplicates[file_name][scenario_name] = tracker.duplicates
                 
-            for index, event in enumerate(combined_timeline_story['timeline']):
-                sheet = event['sheet']
-                event['standard'] = story_object['standard_name']
-                if sheet == scenario_name:
-                    combined_timeline_story['timeline'][index]['linked_data'] = convert_paths_to_linked_data(scenario_paths)
-                    break
+                # render the scenario object
+                uf.render_template('json_render.html', scenario_object, f'{TMP_DIR}/{user_session}/website/data/{file_name}/rendered/{scenario_name}.html')
+                uf.render_template('tree_view_template.jinja', scenario_object, f'{TMP_DIR}/{user_session}/website/data/{file_name}/tree/{scenario_name}.html')
+                with open(f'{TMP_DIR}/{user_session}/website/data/{file_name}/json/{scenario_name}.json', 'w') as f:
+                    json.dump(scenario_object, f, indent=4)
+                    
+                for index, event in enumerate(combined_timeline_story['timeline']):
+                    sheet = event['sheet']
+                    event['standard'] = story_object['standard_name']
+                    if sheet == scenario_name:
+                        # very large events are copied to a jsonl chunk next to the storylog
+                        linked_data_ref = f'{file_name}-{scenario_name}.linked_data.jsonl'
+                        if linked_data.spilled:
+                            with open(f'{TMP_DIR}/{user_session}/output/logs/{linked_data_ref}', 'wb') as f:
+                                shutil.copyfileobj(linked_data.rewind(), f)
+                        linked_data.apply(event, linked_data_ref)
+                        break
+            finally:
+                linked_data.close()
         try:
             with open(f'{TMP_DIR}/{user_session}/output/logs/{file_name}-storylog.json', 'w') as f:
                 json.dump(combined_timeline_story, f, indent=4, cls=CustomEncoder, default=serialize_datetime)
@@ -747,14 +1229,128 @@ def scenario_tool(upload_dir: str,
 def convert_paths_to_linked_data(scenario_paths: list):
     converted = []
     for arr in scenario_paths:
-        converted.append({
-            'dataPath': '.'.join(arr[0]),
-            'exampleData': arr[1]
-        })
-        
+        converted.append(linked_data_item(arr[0], arr[1]))
+
     return converted
 
 
+# events with more linked data items than this are written out as a jsonl chunk
+# and referenced from the storylog with linked_data_ref instead of being embedded
+LINKED_DATA_SPILL_ITEMS = 50000
+
+
+def linked_data_item(path, value) -> dict:
+    '''
+    A function to build a storylog linked data item
+
+    :param path: The path as a list of elements or a dotted string
+    :param value: The example data value
+    :return: :dict:
+    '''
+    return {
+        'dataPath': path if isinstance(path, str) else '.'.join(path),
+        'exampleData': value
+    }
+
+
+def write_linked_data_line(stream, item: dict) -> None:
+    stream.write(json.dumps(item, default=serialize_datetime).encode('utf-8'))
+    stream.write(b'\n')
+
+
+def iter_linked_data_lines(stream):
+    '''
+    A generator that reads linked data items from a jsonl stream
+
+    :param stream: A binary or text stream with one json item per line
+    :return: Yields the linked data items
+    '''
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_linked_data(event: dict, open_chunk):
+    '''
+    A generator over the linked data of a storylog event, whether embedded or spilled to a chunk
+
+    :param event: The storylog timeline event
+    :param open_chunk: A callable that opens the linked_data_ref of the event as a readable stream
+    :return: Yields the linked data items
+    '''
+    if event.get('linked_data_ref'):
+        with open_chunk(event['linked_data_ref']) as stream:
+            yield from iter_linked_data_lines(stream)
+    else:
+        yield from event.get('linked_data', [])
+
+
+class LinkedDataWriter:
+    '''
+    Collects the linked data of an event, keeping it in memory until it passes the spill
+    threshold and then streaming it to a temporary jsonl file, so a very large $loop
+    expansion is never held as a list of dicts and then as one serialised storylog.
+
+    :param spill_items: The number of items kept in memory before spilling to disk
+    '''
+    def __init__(self, spill_items: int = LINKED_DATA_SPILL_ITEMS):
+        self.spill_items = spill_items
+        self.items = []
+        self.spill_file = None
+        self.count = 0
+
+    @property
+    def spilled(self) -> bool:
+        return self.spill_file is not None
+
+    def add(self, path, value) -> None:
+        item = linked_data_item(path, value)
+        self.count += 1
+
+        if self.spill_file is not None:
+            write_linked_data_line(self.spill_file, item)
+            return
+
+        self.items.append(item)
+        if len(self.items) > self.spill_items:
+            self.spill_file = tempfile.TemporaryFile('w+b')
+            for item in self.items:
+                write_linked_data_line(self.spill_file, item)
+            self.items = []
+
+    def rewind(self):
+        '''
+        A function to return the spill file positioned at its start, ready to be uploaded or copied
+
+        :return: The spill file
+        '''
+        self.spill_file.flush()
+        self.spill_file.seek(0)
+        return self.spill_file
+
+    def apply(self, event: dict, linked_data_ref: str) -> None:
+        '''
+        A function to set the linked data of a storylog event, referencing the chunk if it spilled
+
+        :param event: The storylog timeline event
+        :param linked_data_ref: The reference the chunk is stored under
+        :return: None
+        '''
+        event.pop('linked_data_ref', None)
+        event.pop('linked_data_count', None)
+        if self.spilled:
+            event['linked_data'] = []
+            event['linked_data_ref'] = linked_data_ref
+            event['linked_data_count'] = self.count
+        else:
+            event['linked_data'] = self.items
+
+    def close(self) -> None:
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
 def render_story_object(story_sheet: dict) -> dict:
     '''
     A function to render the story sheet
@@ -762,11 +1358,12 @@ def render_story_object(story_sheet: dict) -> dict:
     :param story_sheet: The story sheet to process
     :return: :dict:
     '''
-    summary_cell = find_cell_location(story_sheet, 'Summary')
-    rationale_cell = find_cell_location(story_sheet, 'Rationale')
-    story_cell = find_cell_location(story_sheet, 'Story')
-    standard_url_cell = find_cell_location(story_sheet, 'Standard URL')
-    standard_name_cell = find_cell_location(story_sheet, 'Standard Name')
+    header_index = HeaderIndex(story_sheet)
+    summary_cell = header_index.find('Summary')
+    rationale_cell = header_index.find('Rationale')
+    story_cell = header_index.find('Story')
+    standard_url_cell = header_index.find('Standard URL')
+    standard_name_cell = header_index.find('Standard Name')
 
     story = {}
     story['summary'] = story_sheet.cell(
@@ -790,9 +1387,10 @@ def render_timeline_object(time_line_sheet: dict, sheet_names: list, file_name:
     :param sheet_names: The names of the sheets
     :return: :dict:
     '''
-    time_cell = find_cell_location(time_line_sheet, 'Date/Time')
-    event_cell = find_cell_location(time_line_sheet, 'Event')
-    sheet_cell = find_cell_location(time_line_sheet, 'Sheet')
+    header_index = HeaderIndex(time_line_sheet)
+    time_cell = header_index.find('Date/Time')
+    event_cell = header_index.find('Event')
+    sheet_cell = header_index.find('Sheet')
 
     time_line = []
     false_sheets = []
@@ -826,184 +1424,181 @@ def render_timeline_object(time_line_sheet: dict, sheet_names: list, file_name:
 
 
             
+# standard information types that are extended with provenance paths, and the provenance category they take
+PROVENANCE_CATEGORIES = {
+    'Event.Record': 'event record',
+    'Record': 'record'
+}
+
+# cardinalities that make an element repeat
+REPEATING_CARDINALITIES = ('0...*', '1...*')
+
+
+def group_provenance(provenance_paths) -> dict:
+    '''
+    A function to group provenance paths by their category (first element) up front
+    so that each standard row is extended without rescanning the provenance list
+
+    :param provenance_paths: The provenance paths as lists of elements or dotted strings
+    :return: :dict: category -> list of dotted provenance suffixes
+    '''
+    grouped = {}
+    for line in provenance_paths or []:
+        line = line.split('.') if isinstance(line, str) else line
+        if len(line) > 1:
+            category = line[0].replace('[]', '')
+            grouped.setdefault(category, []).append('.'.join(line[1:]).lower())
+    return grouped
+
+
+def iter_standard_rows(standard_path: str):
+    '''
+    A generator that streams the element rows of a standard (or provenance) workbook in read-only mode
+
+    :param standard_path: the path to the standard
+    :return: Yields the (path, repeating, info type) of each row, where path is the list of lowercased
+             elements and repeating has a flag per element set for 0...* and 1...* cardinalities
+    '''
+    wb = openpyxl.load_workbook(standard_path, read_only=True, data_only=True)
+    try:
+        ws = wb[wb.sheetnames[0]]
+
+        # get row start and path column
+        header_index = HeaderIndex(ws)
+        name_title_cell = header_index.find('Name')
+        info_type_cell = header_index.find('Information Type')
+        cardinality_offset = 2
+        info_type_offset = info_type_cell[1] - name_title_cell[1]
+
+        rows = ws.iter_rows(min_row=name_title_cell[0] + 1,
+                            min_col=name_title_cell[1],
+                            max_col=info_type_cell[1],
+                            values_only=True)
+
+        # the indent of the second row is a single indent, so read two rows ahead
+        first_rows = list(itertools.islice(rows, 2))
+        second_line = str(first_rows[1][0]) if len(first_rows) > 1 and first_rows[1] else ''
+        single_indent = get_whitespace(second_line) or 1
+
+        path = []
+        repeating = []
+        previous_indent = 0
+
+        for row in itertools.chain(first_rows, rows):
+            if not row or row[0] is None:
+                continue
+
+            line = str(row[0])
+            cardinality = str(row[cardinality_offset]) if len(row) > cardinality_offset else 'None'
+            info_type = str(row[info_type_offset]) if len(row) > info_type_offset else 'None'
+
+            line_indent = int(get_whitespace(line) / single_indent)
+            stripped = line.replace('\\xa0\\xa0\\xa0\\xa0', '').strip().lower()
+
+            # track the path and which of its elements repeat
+            path = get_path(previous_indent, line_indent, path, stripped)
+            repeating = get_path(previous_indent, line_indent, repeating, cardinality in REPEATING_CARDINALITIES)
+            previous_indent = line_indent
+
+            yield path, repeating, info_type
+    finally:
+        wb.close()
+
+
+def parse_standard(standard_path: str, provenance_paths: list = None, export_provenance_paths: list = None) -> tuple:
+    '''
+    A function that streams a standard (or provenance) workbook in read-only mode and
+    returns its validation paths and export paths from a single pass.
+
+    Without provenance the validation paths are lists of elements (one per row) and the
+    export paths are dotted strings with a [] marker on every repeating (0...* / 1...*) element.
+    With provenance only Event.Record and Record rows produce paths, each extended with the
+    provenance paths of its category; export paths use the export form of the provenance if given.
+
+    :param standard_path: the path to the standard
+    :param provenance_paths: the provenance validation paths
+    :param export_provenance_paths: the provenance export paths (with [] markers)
+    :return: :tuple: (validation paths, export paths)
+    '''
+    # group the provenance by category once
+    provenance = group_provenance(provenance_paths)
+    export_provenance = group_provenance(export_provenance_paths) if export_provenance_paths else provenance
+
+    validation_paths = []
+    export_paths = []
+    for path, repeating, info_type in iter_standard_rows(standard_path):
+        str_path = '.'.join(path).replace('\'', '')
+        export_path = '.'.join(
+            f'{element}[]' if is_repeating else element
+            for element, is_repeating in zip(path, repeating)
+        ).replace('\'', '')
+
+        if provenance:
+            category = PROVENANCE_CATEGORIES.get(info_type)
+            if category:
+                validation_paths.extend(f'{str_path}.{line}' for line in provenance.get(category, []))
+                export_paths.extend(f'{export_path}.{line}' for line in export_provenance.get(category, []))
+        else:
+            validation_paths.append(path.copy())
+            export_paths.append(export_path)
+
+    return validation_paths, export_paths
+
+
 def get_standard_paths(standard_path: str, provenance_paths: list, for_export: bool = False):
     '''
     This is a function that extracts the paths from a standard in FHIR shorthand format
 
     :param standard_path: the path to the standard
+    :param provenance_paths: the provenance paths to extend record rows with
+    :param for_export: also list each row as a dotted path, with a [] marker if the row itself repeats
     :return: :list:
     '''
-    # load standard
-    wb = openpyxl.load_workbook(standard_path, data_only=True)
-    sheets = wb.sheetnames
-    ws = wb[sheets[0]]
-
-    # get row stard and path column
-    name_title_cell = find_cell_location(ws, 'Name')
-    info_type_cell = find_cell_location(ws, 'Information Type')
+    if not for_export:
+        validation_paths, export_paths = parse_standard(standard_path, provenance_paths)
+        return validation_paths
 
-    # get single_indent
-    single_indent = get_whitespace(
-        str(ws.cell(row=name_title_cell[0]+2, column=name_title_cell[1]).value))
-
-    # make path list
+    # each row's validation paths are followed by the row itself, as they always have been for export
+    provenance = group_provenance(provenance_paths)
     path_list = []
-    path = []
-    previous_indent = 0
-    for row in ws.iter_rows(name_title_cell[0]+1, ws.max_row, name_title_cell[1], info_type_cell[1]):
-        if row:
-            line = str(row[0].value)
-            if line != 'None':
-                info_type = str(row[-1].value)
-                cardinality = str(row[2].value)
-                line_indent = int(get_whitespace(line) / single_indent)
-                stripped = re.sub(
-                    re.escape('\\xa0\\xa0\\xa0\\xa0'), r'', line).strip().lower()
-                path = get_path(previous_indent, line_indent, path, stripped)
-                str_path = '.'.join(path.copy()).lower().replace('\'', '').lower()
-
-                if provenance_paths:
-                    with_provenance = []
-                    if info_type == 'Event.Record':
-                        for line in provenance_paths:
-                            if len(line) > 1:
-                                if line[0] == 'event record':
-                                    provenance_line = '.'.join(line[1:])
-                                    extended_path = f'{str_path}.{provenance_line}'.lower()
-                                    with_provenance.append(extended_path)
-                    elif info_type == 'Record':
-                        for line in provenance_paths:
-                            if len(line) > 1:
-                                if line[0] == 'record':
-                                    provenance_line = '.'.join(line[1:])
-                                    extended_path = f'{str_path}.{provenance_line}'.lower()
-                                    with_provenance.append(extended_path)
-
-                    [path_list.append(line) for line in with_provenance]
-                else:
-                    path_list.append(path.copy())
-                    
-                previous_indent = line_indent
-                
-                
-                
-                if for_export:
-                    if cardinality == '0...*' or cardinality == '1...*':
-                        path_list.append(f'{str_path}[]')
-                    else:    
-                        path_list.append(str_path)
+    for path, repeating, info_type in iter_standard_rows(standard_path):
+        str_path = '.'.join(path).replace('\'', '')
+        if provenance:
+            category = PROVENANCE_CATEGORIES.get(info_type)
+            if category:
+                path_list.extend(f'{str_path}.{line}' for line in provenance.get(category, []))
+        else:
+            path_list.append(path.copy())
+        path_list.append(f'{str_path}[]' if repeating[-1] else str_path)
 
     return path_list
 
 
 def export_standard(standard_path: str, 
                     provenance_path: str):
-    
-    # go over the provenance files
-    wb = openpyxl.load_workbook(provenance_path, read_only=True)
-    sheets = wb.sheetnames
-    ws = wb[sheets[0]]
-    
-    # get row stard and path column
-    name_title_cell = find_cell_location(ws, 'Name')
-    info_type_cell = find_cell_location(ws, 'Information Type')
-
-    # get single_indent
-    single_indent = get_whitespace(
-        str(ws.cell(row=name_title_cell[0]+2, column=name_title_cell[1]).value))
-    
-    provenance_paths = []
-    repeating_paths = []
-    path = []
-    previous_indent = 0
-    
-    for row in ws.iter_rows(name_title_cell[0]+1, 
-                            ws.max_row,
-                            name_title_cell[1], 
-                            info_type_cell[1]):
-        if row:
-            line = str(row[0].value)
-            if line != 'None':
-                cardinality = str(row[2].value)
-                line_indent = int(get_whitespace(line) / single_indent)
-                stripped = re.sub(
-                    re.escape('\\xa0\\xa0\\xa0\\xa0'), r'', line).strip()
-                path = get_path(previous_indent, line_indent, path, stripped)
-                dot_path = '.'.join(path.copy()).lower().replace('\'', '')
-                
-                if cardinality == '0...*' or cardinality == '1...*':
-                    repeating_paths.append(dot_path)
-                    
-                    real_path = find_lists(dot_path, repeating_paths)
-                    provenance_paths.append(real_path)
-                else:
-                    real_path = find_lists(dot_path, repeating_paths)
-                    provenance_paths.append(real_path)
-                    
-                previous_indent = line_indent
-                
-                
-                
-    # get standard paths
-    wb = openpyxl.load_workbook(standard_path, data_only=True)
-    sheets = wb.sheetnames
-    ws = wb[sheets[0]]
-    
-    # get row stard and path column
-    name_title_cell = find_cell_location(ws, 'Name')
-    info_type_cell = find_cell_location(ws, 'Information Type')
+    '''
+    A function to return the paths of a standard extended with provenance,
+    with [] markers on every repeating element
 
-    # get single_indent
-    single_indent = get_whitespace(
-        str(ws.cell(row=name_title_cell[0]+2, column=name_title_cell[1]).value))
-    
-    standard_paths =[]
-    repeating_paths = []
-    path = []
-    previous_indent = 0
-    for row in ws.iter_rows(name_title_cell[0]+1,
-                            ws.max_row,
-                            name_title_cell[1],
-                            info_type_cell[1]):
-        if row:
-            line = str(row[0].value)
-            if line != 'None':
-                info_type = str(row[-1].value)
-                cardinality = str(row[2].value)
-                line_indent = int(get_whitespace(line) / single_indent)
-                stripped = re.sub(
-                    re.escape('\\xa0\\xa0\\xa0\\xa0'), r'', line).strip()
-                path = get_path(previous_indent, line_indent, path, stripped)
-                dot_path = '.'.join(path.copy()).lower().replace('\'', '').lower()
-                
-                if cardinality == '0...*' or cardinality == '1...*':
-                    repeating_paths.append(dot_path)
-                    real_path = find_lists(dot_path, repeating_paths)
-                else:
-                    real_path = find_lists(dot_path, repeating_paths)
-
-                with_provenance = []
-                if info_type == 'Event.Record':
-                    for line in provenance_paths:
-                        if line.split('.')[0] == 'event record':
-                            provenance_line = '.'.join(line.split('.')[1:])
-                            extended_path = f'{real_path}.{provenance_line}'
-                            with_provenance.append(extended_path.lower())
-                elif info_type == 'Record':
-                    for line in provenance_paths:
-                        if line.split('.')[0] == 'record':
-                            provenance_line = '.'.join(line.split('.')[1:])
-                            extended_path = f'{real_path}.{provenance_line}'
-                            with_provenance.append(extended_path.lower())
-
-                [standard_paths.append(line) for line in with_provenance]
-                
-                previous_indent = line_indent
+    :param standard_path: the path to the standard
+    :param provenance_path: the path to the provenance workbook
+    :return: :list:
+    '''
+    provenance_paths, export_provenance_paths = parse_standard(provenance_path)
+    validation_paths, standard_paths = parse_standard(standard_path, provenance_paths, export_provenance_paths)
 
     return standard_paths
             
     
 def find_lists(original_path, list_of_paths):
+    '''
+    A function to mark the elements of a dotted path that are in a list of repeating paths with []
+    parse_standard marks repeating elements as it reads a standard, this is kept for other callers
+
+    :param original_path: The dotted path
+    :param list_of_paths: The repeating paths
+    :return: :str: The lowercased path with [] markers
+    '''
     original_path_arr = original_path.split('.')
     
     for path in list_of_paths:
@@ -1055,50 +1650,46 @@ def get_path(previous_indent: int, indent: int, path: list, stripped: str):
 
 
 # a function to validate the scenario paths
-def validate_scenario_paths(scenario_paths: list, standard_paths: list) -> list:
+def validate_scenario_paths(scenario_paths: list, standard_paths, report_prefix: bool = False) -> list:
     '''
     A function to validate the scenario paths
     Returns a list of false paths
     
     :param scenario_paths: The scenario paths to validate
-    :param standard_paths: The standard paths to validate against
+    :param standard_paths: The standard paths (or a StandardIndex) to validate against
+    :param report_prefix: Add the deepest part of each false path that exists in the standard
     '''
-    
-    # lowercase the standard paths
-    for index, element in enumerate(standard_paths):
-        standard_paths[index] = element.lower()
-    
+    standard_index = si.StandardIndex.coerce(standard_paths)
     
     false_paths = []
     for scenario_path in scenario_paths:
-        if isinstance(scenario_path[0], str):
-            joined = scenario_path[0]
-        else:
-            joined = '.'.join(scenario_path[0])
-        no_alias = re.sub(r'\[\d+\]', '', joined)
-        split_no_alias = no_alias.split('.')  
-        if no_alias not in standard_paths:
-            false_paths.append([split_no_alias, scenario_path[1]])
+        segments = si.split_path(scenario_path[0])
+        if segments not in standard_index:
+            false_path = [[si.strip_index(segment) for segment in segments], scenario_path[1]]
+            if report_prefix:
+                false_path.append(standard_index.deepest_prefix(segments))
+            false_paths.append(false_path)
             
     return false_paths
 
-def validate_storylog_paths(scenario_paths: list, standard_paths: list) -> list:
+def validate_storylog_paths(scenario_paths: list, standard_paths, report_prefix: bool = False) -> list:
     '''
     A function to validate the paths of a storylog
     
     :param scenario_paths: The scenario paths to validate
-    :param standard_paths: The standard paths to validate against
+    :param standard_paths: The standard paths (or a StandardIndex) to validate against
+    :param report_prefix: Return [path, deepest valid prefix] pairs instead of paths
     '''
-    # lowercase the standard paths
-    for index, element in enumerate(standard_paths):
-        standard_paths[index] = element.lower()
+    standard_index = si.StandardIndex.coerce(standard_paths)
         
     false_paths = []
     for element in scenario_paths:
         path = element['dataPath']
-        no_alias = re.sub(r'\[\d+\]', '', path)
-        if no_alias not in standard_paths:
-            false_paths.append(path)
+        if path not in standard_index:
+            if report_prefix:
+                false_paths.append([path, '.'.join(standard_index.deepest_prefix(path))])
+            else:
+                false_paths.append(path)
             
     return false_paths
     
@@ -1133,15 +1724,60 @@ def extract_data_from_storylog(story_log: dict):
     
     return story, timeline, scenarios
     
+def duplicate_key(path, value) -> tuple:
+    '''
+    A function to build the canonical hashable key of a path/value pair
+
+    :param path: The path as a dotted string or a list of elements
+    :param value: The example data value
+    :return: :tuple:
+    '''
+    segments = tuple(path.split('.')) if isinstance(path, str) else tuple(path)
+    try:
+        hash(value)
+    except TypeError:
+        value = repr(value)
+    return segments, value
+
+
+class DuplicateTracker:
+    '''
+    Tracks path/value pairs in a hash map so duplicates are found in linear time.
+    Each duplicate is recorded as [path, value, first row, duplicate row].
+    '''
+    def __init__(self):
+        self.first_rows = {}
+        self.duplicates = []
+
+    def add(self, path, value, row) -> bool:
+        '''
+        A function to record a path/value pair
+
+        :param path: The path as a dotted string or a list of elements
+        :param value: The example data value
+        :param row: The row (or position) the pair came from
+        :return: :bool: True if the pair has been seen before
+        '''
+        key = duplicate_key(path, value)
+        if key in self.first_rows:
+            self.duplicates.append([path, value, self.first_rows[key], row])
+            return True
+        self.first_rows[key] = row
+        return False
+
+
 def get_duplicates(scenario_paths: list) -> list:
-    duplicates = []
-    scenario_path_list = []
-    for path in scenario_paths:
-        if path in scenario_path_list:
-            duplicates.append(path)
-        scenario_path_list.append(path)
+    '''
+    A function to find the duplicated [path, value] pairs in a path list
+    
+    :param scenario_paths: The path list to check
+    :return: :list: [path, value, first position, duplicate position] for each duplicate
+    '''
+    tracker = DuplicateTracker()
+    for position, (path, value) in enumerate(scenario_paths):
+        tracker.add(path, value, position)
         
-    return duplicates
+    return tracker.duplicates
 
 def get_timeline_storylog_format(timeline_sheet, standard_name: str) -> dict:
     '''
@@ -1153,9 +1789,10 @@ def get_timeline_storylog_format(timeline_sheet, standard_name: str) -> dict:
     timeline = []
     
     # get the cell locations for the path and example data
-    time_cell = find_cell_location(timeline_sheet, 'Date/Time')
-    event_cell = find_cell_location(timeline_sheet, 'Event')
-    sheet_cell = find_cell_location(timeline_sheet, 'Sheet')
+    header_index = HeaderIndex(timeline_sheet)
+    time_cell = header_index.find('Date/Time')
+    event_cell = header_index.find('Event')
+    sheet_cell = header_index.find('Sheet')
     
     for row in timeline_sheet.iter_rows(time_cell[0]+1, timeline_sheet.max_row, time_cell[1], sheet_cell[1]):
         time = str(row[0].value)
@@ -1175,4 +1812,50 @@ def get_timeline_storylog_format(timeline_sheet, standard_name: str) -> dict:
             })
             
     return timeline
-            
\ No newline at end of file
+            
+
+# sheets of a personae workbook that are not scenario sheets
+PERSONAE_SUPPORT_SHEETS = ['story', 'time line', 'timeline', 'group aliases', 'path aliases']
+
+
+def compile_personae_workbook(workbook_bytes: bytes) -> dict:
+    '''
+    A function to parse a personae workbook into its storylog header, alias resolver and
+    the compiled scenario IR of every scenario sheet. Everything returned can be pickled,
+    so the CPU bound parse can run in another process and only the IR is sent back
+
+    :param workbook_bytes: The contents of the personae xlsx file
+    :return: :dict: With the storylog (without linked data), the standard name, the resolver
+             and the scenarios as a list of [sheet name, scenario IR]
+    '''
+    wb = openpyxl.load_workbook(filename=io.BytesIO(workbook_bytes), read_only=True)
+    try:
+        # get the story sheet and work out what standard it is
+        story_sheet = wb['Story']
+        story_standard = str(story_sheet['E2'].value)
+
+        storylog = {
+            'summary': str(story_sheet['A2'].value),
+            'rationale': str(story_sheet['B2'].value),
+            'story': str(story_sheet['C2'].value),
+            'standard_url': str(story_sheet['D2'].value),
+            'standard_name': str(story_sheet['E2'].value),
+            'timeline': get_timeline_storylog_format(wb['Time Line'], story_standard)
+        }
+
+        # one alias resolver is shared by every scenario sheet in the workbook
+        resolver = AliasResolver(wb['Path Aliases'], wb['Group Aliases'])
+
+        scenarios = []
+        for sheet in wb.sheetnames:
+            if sheet.lower() not in PERSONAE_SUPPORT_SHEETS:
+                scenarios.append([sheet, compile_scenario_sheet(wb[sheet])])
+    finally:
+        wb.close()
+
+    return {
+        'storylog': storylog,
+        'standard': story_standard,
+        'resolver': resolver,
+        'scenarios': scenarios
+    }
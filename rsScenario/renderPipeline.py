@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import gzip
+import threading
+import time
+import traceback
+
+import storageBackends as sb
+
+
+# outputs smaller than this are uploaded as they are, as gzip would save little and cost a decode
+GZIP_MIN_BYTES = 1024
+
+# content types worth compressing
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+
+def encode_output(data, content_type: str = None, min_bytes: int = GZIP_MIN_BYTES) -> tuple:
+    '''
+    A function to gzip a rendered output for upload when it is large enough and of a compressible type
+
+    :param data: The output as bytes or str
+    :param content_type: The content type of the output
+    :param min_bytes: The size below which the output is not compressed (None to never compress)
+    :return: :tuple: The data to upload and its content encoding (None if not compressed)
+    '''
+    data = sb.to_bytes(data)
+    if min_bytes is None or len(data) < min_bytes or not (content_type or '').startswith(COMPRESSIBLE_TYPES):
+        return data, None
+    # a fixed mtime keeps the bytes, and so the etag, the same for the same output
+    return gzip.compress(data, compresslevel=6, mtime=0), 'gzip'
+
+
+class PipelineError(Exception):
+    def __init__(self, failures):
+        self.failures = failures
+        self.message = f"Rendering failed for {len(failures)} outputs: " + ', '.join(f'{name} ({error})' for name, error in list(failures.items())[:10])
+        super().__init__(self.message)
+
+
+class RenderPipeline:
+    '''
+    Renders website outputs on a pool of workers and uploads them on another, so rendering,
+    uploading and the caller working out what to render all overlap.
+    A render job returns a list of (object name, data, content type) outputs, which are gzipped
+    (see encode_output) and uploaded as soon as the job finishes. At most max_in_flight jobs are rendering or uploading at once, and submit
+    blocks until one finishes, so rendered pages waiting to upload never pile up in memory.
+    Failed uploads are retried with backoff, and every failure is raised together by close.
+
+    :param storage: The storage backend to upload to
+    :param render_workers: The number of render jobs run at once
+    :param upload_workers: The number of uploads run at once
+    :param max_in_flight: The number of jobs submitted but not yet uploaded
+    :param gzip_min_bytes: The size below which outputs are not compressed (None to never compress)
+    '''
+    def __init__(self, storage, render_workers: int = 4, upload_workers: int = 16, max_in_flight: int = 64, gzip_min_bytes: int = GZIP_MIN_BYTES):
+        self.storage = storage
+        self.gzip_min_bytes = gzip_min_bytes
+        self.render_executor = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix='rsScenario-render')
+        self.upload_executor = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='rsScenario-upload')
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.summary = None
+        self.started = time.time()
+        self.stages = {
+            'render': {'objects': 0, 'bytes': 0, 'seconds': 0.0, 'jobs': 0},
+            'upload': {'objects': 0, 'bytes': 0, 'seconds': 0.0, 'retries': 0, 'compressed': 0}
+        }
+
+    def __enter__(self) -> 'RenderPipeline':
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        if exc_type is None:
+            self.summary = self.close()
+        else:
+            # the caller failed, stop without raising over its error
+            self.shutdown()
+
+    def submit(self, name: str, render) -> None:
+        '''
+        A function to queue a render job, waiting while max_in_flight jobs are unfinished
+
+        :param name: The name of the job, used in errors
+        :param render: A callable returning a list of (object name, data, content type) outputs
+        :return: None
+        '''
+        self.in_flight.acquire()
+        self.render_executor.submit(self.run_render, name, render)
+
+    def run_render(self, name: str, render) -> None:
+        started = time.time()
+        try:
+            outputs = [(output_name, sb.to_bytes(data), content_type) for output_name, data, content_type in render()]
+            rendered_bytes = sum(len(data) for output_name, data, content_type in outputs)
+            
+            # compress here so the upload workers only wait on the network
+            outputs = [(output_name, content_type) + encode_output(data, content_type, self.gzip_min_bytes) for output_name, data, content_type in outputs]
+        except Exception as e:
+            traceback.print_exc()
+            self.fail(name, e)
+            self.in_flight.release()
+            return
+
+        with self.lock:
+            stage = self.stages['render']
+            stage['jobs'] += 1
+            stage['objects'] += len(outputs)
+            stage['bytes'] += rendered_bytes
+            stage['seconds'] += time.time() - started
+
+        if not outputs:
+            self.in_flight.release()
+            return
+
+        # the job stays in flight until its last output is uploaded
+        remaining = [len(outputs)]
+        for output_name, content_type, data, content_encoding in outputs:
+            self.upload_executor.submit(self.run_upload, output_name, data, content_type, content_encoding, remaining)
+
+    def run_upload(self, output_name: str, data: bytes, content_type: str, content_encoding: str, remaining: list) -> None:
+        started = time.time()
+        try:
+            for attempt in range(sb.BULK_ATTEMPTS):
+                if attempt:
+                    time.sleep(sb.BULK_RETRY_DELAY * 2 ** (attempt - 1))
+                    with self.lock:
+                        self.stages['upload']['retries'] += 1
+                try:
+                    self.storage.put(output_name, data, content_type, content_encoding)
+                    break
+                except Exception as e:
+                    error = e
+            else:
+                self.fail(output_name, error)
+                return
+
+            with self.lock:
+                stage = self.stages['upload']
+                stage['objects'] += 1
+                stage['bytes'] += len(data)
+                stage['compressed'] += content_encoding is not None
+                stage['seconds'] += time.time() - started
+        finally:
+            with self.lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                self.in_flight.release()
+
+    def fail(self, name: str, error: Exception) -> None:
+        with self.lock:
+            self.failures[name] = error
+
+    def shutdown(self) -> None:
+        # renders are waited for first as they queue the uploads
+        self.render_executor.shutdown(wait=True)
+        self.upload_executor.shutdown(wait=True)
+
+    def close(self) -> dict:
+        '''
+        A function to wait for every job to render and upload, and print a summary of each stage
+        Closing with a with block keeps the summary in the summary attribute
+
+        :return: :dict: The objects, bytes and seconds of work of each stage, and the total seconds taken
+        '''
+        self.shutdown()
+        summary = self.stats()
+        for stage_name, stage in summary['stages'].items():
+            print(f"{stage_name}: {stage['objects']} objects, {stage['bytes']} bytes, {stage['seconds']:.2f}s of work")
+        print(f"Render pipeline finished in {summary['seconds']:.2f}s")
+
+        if self.failures:
+            raise PipelineError(self.failures)
+        return summary
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'stages': {stage_name: dict(stage) for stage_name, stage in self.stages.items()},
+                'seconds': time.time() - self.started
+            }
@@ -1,11 +1,21 @@
-from google.cloud import storage
-from jinja2 import Environment, FileSystemLoader
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timezone
 
+import functools
 import json
 import os
-import openpyxl
+import tempfile
 import excelProcessing as ep
+import standardIndex as si
+import caches
+import dependencyGraph as dg
+import buildManifest as bm
+import compileScheduler as cs
+import renderPipeline as rp
+import storageBackends as sb
+import sharedResources as shared
+from storageBackends import NotFound
 
 '''
 TODO MAIN:
@@ -17,6 +27,36 @@ TODO NOW:
 '''
 
 
+def personae_output_name(personae_name: str, kind: str) -> str:
+    '''
+    A function to return the name of a file made by validating a personae
+
+    :param personae_name: The personae file name, e.g. bob.xlsx
+    :param kind: The kind of output, e.g. falsepaths or storylog
+    :return: :str: The output file name, e.g. bob.falsepaths.json
+    '''
+    return f"{personae_name.rsplit('.', 1)[0]}.{kind}.json"
+
+
+class WebsiteCompile:
+    '''
+    A queued website compile. The project, site and storage backend are taken when the compile
+    is requested, so changing the tool's project before the compile runs does not change what is compiled
+
+    :param project_name: The project to compile
+    :param gcp_site: The site the project belongs to
+    :param storage: The storage backend the project is stored in
+    '''
+    def __init__(self, project_name: str, gcp_site: str, storage: sb.StorageBackend):
+        self.project_name = project_name
+        self.gcp_site = gcp_site
+        self.storage = storage
+
+    def __call__(self) -> dict:
+        project_tool = ScenarioTool(self.project_name, self.gcp_site, self.storage, synchronous_compile=True)
+        return project_tool.compile_website()
+
+
 class ScenarioTool:
     class MissingProvenanceError(Exception):
         def __init__(self, message, project):
@@ -48,61 +88,154 @@ class ScenarioTool:
             self.message = message
             super().__init__(self.message)
 
-    def __init__(self, project_name, gcp_site):
+    class RevalidationError(Exception):
+        def __init__(self, errors, project, touched):
+            message = f"Re-validation failed in {project} for: " + ', '.join(f'{personae} ({error})' for personae, error in errors.items())
+            self.message = message
+            self.errors = errors
+            self.touched = touched
+            super().__init__(self.message)
+
+    def __init__(self, project_name, gcp_site, storage_backend: sb.StorageBackend = None, revalidation_workers: int = 8, parse_processes: int = 0, compile_scheduler: cs.CompileScheduler = None, synchronous_compile: bool = False):
         self.project_name = project_name.lower()
         self.gcp_project = gcp_site
         self.validated = False
-        self.standard_dir = f'{gcp_site}/{project_name}/standards'
-        self.personae_dir = f'{gcp_site}/{project_name}/personae'
-        self.continuous_data_dir = f'{gcp_site}/{project_name}/continuous_data'
-        self.storage_client = storage.Client()
+        self.standard_dir = f'{gcp_site}/{self.project_name}/standards'
+        self.personae_dir = f'{gcp_site}/{self.project_name}/personae'
+        self.continuous_data_dir = f'{gcp_site}/{self.project_name}/continuous_data'
+        self.linked_data_dir = f'{gcp_site}/{self.project_name}/linked_data'
+        self.dependency_graph_path = f'{gcp_site}/{self.project_name}/dependencies.json'
+        self.build_manifest_path = f'{gcp_site}/{self.project_name}/build_manifest.json'
+        self.projects_manifest_path = f'{gcp_site}/projects.json'
         self.provenance = []
         
-        # initiate a template environment
-        this_file_dir = os.path.dirname(os.path.abspath(__file__))
-        parent_dir = this_file_dir[:this_file_dir.rfind('/')]
-        tempalte_path = os.path.join(parent_dir, 'templates')
-        self.template_env = Environment(loader=FileSystemLoader(tempalte_path))
+        # the template environment and storage client are shared by the process, so templates compile once
+        self.template_env = shared.template_env()
+        
+        # the gcp site bucket unless another storage backend is given
+        self.storage = storage_backend if storage_backend is not None else shared.storage_backend(self.gcp_project)
+        
+        # parsed standards are shared between projects through a content addressed cache
+        self.standard_cache = caches.StandardCache(storage=self.storage)
+        
+        # loaded standard path sets, checked against their blob generation
+        self.standards_cache = caches.StandardIndexCache()
+        
+        # set for the length of a revalidation pass so continuous data is downloaded once
+        self.continuous_data_cache = None
+        
+        # the personae re-validated by the last revalidation pass
+        self.revalidated = set()
         
-        self.bucket = self.storage_client.bucket(self.gcp_project)
+        # loaded from the project on first use
+        self.dependency_graph = None
+        
+        # revalidation concurrency, parse_processes of 0 parses workbooks on the revalidation threads
+        self.revalidation_workers = revalidation_workers
+        self.parse_processes = parse_processes
+        self.parse_executor = None
+        
+        # website compiles after saving or deleting a patient run in the background coalesced per project,
+        # on the process's shared scheduler unless another is given, or straight away with synchronous_compile
+        if synchronous_compile:
+            self.compile_scheduler = None
+        else:
+            self.compile_scheduler = compile_scheduler if compile_scheduler is not None else cs.default_scheduler()
+        self.compile_job_id = None
         
     def copy_project(self, project_name:str, new_project_name: str) -> None:
-        blobs = self.bucket.list_blobs(prefix=project_name)
-        for blob in blobs:
-            # Construct the destination object name
-            destination_blob_name = blob.name.replace(project_name, new_project_name, 1)
-
-            # Copy the blob to the new location
-            self.bucket.copy_blob(blob, self.bucket, destination_blob_name)
+        blobs = self.storage.list(prefix=project_name)
+        
+        # copy in concurrent batches, each destination is the name with the project replaced
+        copies = [(blob.name, blob.name.replace(project_name, new_project_name, 1)) for blob in blobs]
+        self.storage.copy_many(copies, progress=sb.print_progress(f'Copying {project_name}'))
         self.project_name = project_name
         
+        # the names are prefixes, the project is the last folder of the new one
+        self.update_projects_manifest(project_name=new_project_name.rstrip('/').split('/')[-1])
+        
         return
     
     def list_projects(self) -> list:
-        blobs = self.bucket.list_blobs(prefix=self.gcp_project)
-        folders = set()
-        for blob in blobs:
-            folder = blob.name.split('/')[1]      
-            folders.add(folder)
+        '''
+        A function to list the projects in the site
+        Lists the folders in the site folder rather than every object in every project
+        
+        :return: A sorted list of project names
+        '''
+        site_prefix = f'{self.gcp_project}/'
+        return [folder[len(site_prefix):-1] for folder in self.storage.list_prefixes(site_prefix)]
+    
+    def project_details(self) -> dict:
+        '''
+        A function to return the projects in the site with the details kept in the projects manifest
+        
+        :return: A dict of project names to their personae and standard counts and last update time (empty if not recorded yet)
+        '''
+        projects_manifest = self.load_projects_manifest()
+        
+        return {project: projects_manifest.get(project, {}) for project in self.list_projects()}
+    
+    def load_projects_manifest(self) -> dict:
+        try:
+            return json.loads(self.storage.get(self.projects_manifest_path))
+        except NotFound:
+            return {}
+        
+    def update_projects_manifest(self, deleted: bool = False, project_name: str = None) -> None:
+        '''
+        A function to record a project in the projects manifest after it changes
+        The manifest is only written if no one else has changed it since it was read, otherwise it is read and changed again
+        
+        :param deleted: Remove the project from the manifest
+        :param project_name: The project to record, the current project if not given
+        :return: None
+        '''
+        if project_name is None:
+            project_name, personae_dir, standard_dir = self.project_name, self.personae_dir, self.standard_dir
+        else:
+            personae_dir, standard_dir = f'{self.gcp_project}/{project_name}/personae', f'{self.gcp_project}/{project_name}/standards'
+        if not deleted:
+            details = {
+                'personae': len(self.personae_files(personae_dir)),
+                'standards': len([blob for blob in self.storage.list(prefix=f'{standard_dir}/') if blob.name.endswith('.xlsx')]),
+                'updated': datetime.now(timezone.utc).isoformat()
+            }
+        
+        def update(data):
+            projects_manifest = {} if data is None else json.loads(data)
+            if deleted:
+                projects_manifest.pop(project_name, None)
+            else:
+                projects_manifest[project_name] = details
+            return json.dumps(projects_manifest, sort_keys=True)
+        
+        sb.update_object(self.storage, self.projects_manifest_path, update, content_type='application/json')
         
-        return list(folders)
+        return
     
     def set_project(self, new_project_name: str) -> None:
         self.project_name = new_project_name
         self.standard_dir = f'{self.gcp_project}/{new_project_name}/standards'
         self.personae_dir = f'{self.gcp_project}/{new_project_name}/personae'
         self.continuous_data_dir = f'{self.gcp_project}/{new_project_name}/continuous_data'
+        self.linked_data_dir = f'{self.gcp_project}/{new_project_name}/linked_data'
+        self.dependency_graph_path = f'{self.gcp_project}/{new_project_name}/dependencies.json'
+        self.build_manifest_path = f'{self.gcp_project}/{new_project_name}/build_manifest.json'
+        self.dependency_graph = None
+        self.standards_cache.invalidate()
         
         return
     
     def del_project(self) -> None:
         # Delete all blobs in the project folder
-        blobs = self.bucket.list_blobs(prefix=f'{self.gcp_project}/{self.project_name}')
-        for blob in blobs:
-            blob.delete()
+        blobs = self.storage.list(prefix=f'{self.gcp_project}/{self.project_name}')
+        self.storage.delete_many([blob.name for blob in blobs], progress=sb.print_progress(f'Deleting {self.project_name}'))
+
+        self.update_projects_manifest(deleted=True)
 
         # Delete the project folder
-        self.bucket.delete_blob(f'{self.gcp_project}/{self.project_name}')
+        self.storage.delete(f'{self.gcp_project}/{self.project_name}')
         print(f"Project {self.project_name} deleted")
 
         # Reset project attributes
@@ -110,212 +243,211 @@ class ScenarioTool:
         self.standard_dir = None
         self.personae_dir = None
         self.continuous_data_dir = None
+        self.linked_data_dir = None
+        self.dependency_graph_path = None
+        self.dependency_graph = None
+        self.build_manifest_path = None
         self.validated = False
         self.provenance = []
 
         return
         
-    def upload_provenance(self, file_path: str) -> None:
+    def upload_provenance(self, file_path: str) -> set:
         '''
         A function to upload a provenance file to the personae directory
         Re-create all path lists
-        Re-validate personae
+        Re-validate the personae that use a standard
         
         :param file_path: The path to the provenance file to upload
-        :return: None
+        :return: The personae that were re-validated
         '''
         # get path list
-        provenance_paths = ep.get_standard_paths(file_path, [], False)
+        provenance_paths = self.standard_cache.get_or_parse(file_path, [])['validation_paths']
         provenance_paths_json_data = json.dumps(provenance_paths)
         self.provenance = provenance_paths
         
         # upload json string to provenance.json file
-        blob = self.bucket.blob(f'{self.standard_dir}/provenance.json')
-        blob.upload_from_string(provenance_paths_json_data)
+        self.storage.put(f'{self.standard_dir}/provenance.json', provenance_paths_json_data)
+        self.update_projects_manifest()
         print(f"File {file_path} uploaded to {self.standard_dir}")
         
-        # make path list json
-        standard_paths = ep.get_standard_paths(file_path, self.provenance, False)
-        
-        # save to the standarsds directory
-        file_name = file_name.replace('.xlsx', '.json')
-        standard_paths_json_data = json.dumps(standard_paths)
-        blob = self.bucket.blob(f'{self.standard_dir}/{file_name}')
-        blob.upload_from_string(standard_paths_json_data)
-        
-        # loop over personae and validate
-        # Get the list of blobs in the personae directory
-        blobs = self.bucket.list_blobs(prefix=self.personae_dir)
-
-        # Loop over each blob in the personae directory
-        for blob in blobs:
+        # re-create the path list of every standard with the new provenance
+        for standard_blob in self.storage.list(prefix=f'{self.standard_dir}/'):
+            if not standard_blob.name.endswith('.xlsx'):
+                continue
             
-            # Extract the file name from the blob
-            file_name = blob.name.split('/')[-1]
-            false_paths = self.validate_personae(file_name)
+            with tempfile.NamedTemporaryFile(suffix='.xlsx') as standard_file:
+                self.storage.download_to_file(standard_blob.name, standard_file)
+                standard_file.flush()
+                standard_paths = self.standard_cache.get_or_parse(standard_file.name, self.provenance)['validation_paths']
             
-            # save to a json file
-            false_paths_json_data = json.dumps(false_paths)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".falsepaths.json")}')
-            blob.upload_from_string(false_paths_json_data)
-
-        return
+            # save to the standarsds directory
+            self.save_standard_paths(standard_blob.name.split('/')[-1].replace('.xlsx', ''), standard_paths)
+        
+        # re-validate the personae built on the re-created standards
+        return self.revalidate_personae(self.load_dependency_graph().personae_using_provenance())
     
-    def upload_continuous_data(self, file_path: str) -> None:
+    def upload_continuous_data(self, file_path: str) -> set:
         '''
         A function to upload a continuous data file to the personae directory
+        Re-validate the personae that loop over it
         
         :param file_path: The path to the continuous data file to upload
-        :return: None
+        :return: The personae that were re-validated
         '''
         file_name = os.path.basename(file_path)
-        blob = self.bucket.blob(f'{self.continuous_data_dir}/{file_name}')
-        blob.upload_from_filename(file_path)
+        self.storage.put_file(f'{self.continuous_data_dir}/{file_name}', file_path)
+        self.update_projects_manifest()
         print(f"File {file_path} uploaded to {self.continuous_data_dir}")
         
-        return
+        return self.revalidate_personae(self.load_dependency_graph().personae_using_continuous_data(file_name))
     
-    def upload_patient(self, file_path: str) -> None:
+    def upload_patient(self, file_path: str) -> set:
         '''
         A function to upload a patient storylog to the personae directory
-        Re-validate personae
+        Re-validate the patient
         
         :param file_path: The path to the patient storylog to upload
-        :return: None
+        :return: The personae that were re-validated
         '''
         # upload file
         file_name = os.path.basename(file_path)
-        blob = self.bucket.blob(f'{self.personae_dir}/{file_name}')
-        blob.upload_from_filename(file_path)
+        self.storage.put_file(f'{self.personae_dir}/{file_name}', file_path)
+        self.update_projects_manifest()
         print(f"File {file_path} uploaded to {self.personae_dir}")
         
-        # loop over personae and validate
-        # Get the list of blobs in the personae directory
-        blobs = self.bucket.list_blobs(prefix=self.personae_dir)
-
-        # Loop over each blob in the personae directory
-        for blob in blobs:
-            
-            # Extract the file name from the blob
-            file_name = blob.name.split('/')[-1]
-            false_paths, storylog = self.validate_personae(file_name)
-            
-            # save to a json file
-            false_paths_json_data = json.dumps(false_paths)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".falsepaths.json")}')
-            blob.upload_from_string(false_paths_json_data)
-            
-            # save storylog
-            storylog_json_data = json.dumps(storylog)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".storylog.json")}')
-            blob.upload_from_string(storylog_json_data)
-            
+        # only the uploaded personae can have changed
+        touched = self.revalidate_personae({file_name})
+        
         print("Personae validated, storylogs created")
         
-        return
+        return touched
 
-    def upload_standard(self, file_path: str) -> None:
+    def upload_standard(self, file_path: str) -> set:
         '''
         A function to upload a standard to the standards directory
         Creates path list for standard
-        Re-validate personae
+        Re-validate the personae that use the standard
         
         :param file_path: The path to the standard xlsx file to upload
-        :return: None
+        :return: The personae that were re-validated
         '''
         if self.provenance == []:
             raise self.MissingProvenanceError(self.provenance, self.project_name)
         
         # upload file
         file_name = os.path.basename(file_path)
-        blob = self.bucket.blob(f'{self.standard_dir}/{file_name}')
-        blob.upload_from_filename(file_path)
+        self.storage.put_file(f'{self.standard_dir}/{file_name}', file_path)
+        self.update_projects_manifest()
         
-        # make path list json
-        standard_paths = ep.get_standard_paths(file_path, self.provenance, False)
+        # make path list json, skipping the parse if this standard has been seen before
+        standard_paths = self.standard_cache.get_or_parse(file_path, self.provenance)['validation_paths']
         
         # save to the standarsds directory
-        file_name = file_name.replace('.xlsx', '.json')
-        standard_paths_json_data = json.dumps(standard_paths)
-        blob = self.bucket.blob(f'{self.standard_dir}/{file_name}')
-        blob.upload_from_string(standard_paths_json_data)
-        
-        # loop over personae and validate
-        # Get the list of blobs in the personae directory
-        blobs = self.bucket.list_blobs(prefix=self.personae_dir)
-
-        # Loop over each blob in the personae directory
-        for blob in blobs:
-            
-            # Extract the file name from the blob
-            file_name = blob.name.split('/')[-1]
-            false_paths, storylog = self.validate_personae(file_name)
-            
-            # save to a json file
-            false_paths_json_data = json.dumps(false_paths)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".falsepaths.json")}')
-            blob.upload_from_string(false_paths_json_data)
-            
-            # save storylog
-            storylog_json_data = json.dumps(storylog)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".storylog.json")}')
-            blob.upload_from_string(storylog_json_data)
-            
+        self.save_standard_paths(file_name.replace('.xlsx', ''), standard_paths)
+        
+        # re-validate the personae that use this standard
+        touched = self.revalidate_personae(self.load_dependency_graph().personae_using_standard(file_name.replace('.xlsx', '')))
+        
         print(f"File {file_path} uploaded to {self.standard_dir}")
         print("Personae validated")
         
-        return
+        return touched
     
-    def delete_standard(self, standard_file_name: str) -> None:
+    def delete_standard(self, standard_file_name: str) -> set:
         '''
         A function to delete a standard from the standards directory
         Removes path list for standard
         
         :param standard_file_name: The name of the standard file to delete
-        :return: None
+        :return: The personae that were re-validated
         '''
-        blob = self.bucket.blob(f'{self.standard_dir}/{standard_file_name}')
-        blob.delete()
+        self.storage.delete(f'{self.standard_dir}/{standard_file_name}')
+        self.update_projects_manifest()
         print(f"File {standard_file_name} deleted from {self.standard_dir}")
         
-        # loop over personae and validate
-        # Get the list of blobs in the personae directory
-        blobs = self.bucket.list_blobs(prefix=self.personae_dir)
-
-        # Loop over each blob in the personae directory
-        for blob in blobs:
-            
-            # Extract the file name from the blob
-            file_name = blob.name.split('/')[-1]
-            false_paths, storylog = self.validate_personae(file_name)
-            
-            # save to a json file
-            false_paths_json_data = json.dumps(false_paths)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".falsepaths.json")}')
-            blob.upload_from_string(false_paths_json_data)
-
-            # save storylog
-            storylog_json_data = json.dumps(storylog)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".storylog.json")}')
-            blob.upload_from_string(storylog_json_data)
+        # remove the path lists
+        standard_name = standard_file_name.replace('.xlsx', '')
+        for extention in ('json', 'bin'):
+            try:
+                self.storage.delete(f'{self.standard_dir}/{standard_name}.{extention}')
+            except NotFound:
+                pass
+        self.standards_cache.invalidate(standard_name)
+        
+        # re-validate the personae that used this standard
+        dependency_graph = self.load_dependency_graph()
+        dependency_graph.remove_standard(standard_name)
+        touched = self.revalidate_personae(dependency_graph.personae_using_standard(standard_name))
 
         print("Personae validated")
         
+        return touched
+    
+    def save_standard_paths(self, standard_name: str, standard_paths: list) -> None:
+        '''
+        A function to save the path list of a standard as JSON and as a compiled binary alongside it
+        
+        :param standard_name: The name of the standard without extention
+        :param standard_paths: The path list for the standard
+        :return: None
+        '''
+        self.storage.put(f'{self.standard_dir}/{standard_name}.json', json.dumps(standard_paths), content_type='application/json')
+        self.storage.put(f'{self.standard_dir}/{standard_name}.bin', si.compile_standard(standard_paths), content_type='application/octet-stream')
+        
+        # every path list is built with the project provenance
+        self.load_dependency_graph().set_standard(standard_name)
+        self.standards_cache.invalidate(standard_name)
+        
         return
     
-    def standard_path_list(self, standard_name: str) -> list:
+    def standard_path_list(self, standard_name: str):
         '''
-        A function to return the path list for a given standard
+        A function to return the path set for a given standard
+        Standards are read through the standards cache, so each is loaded at most once per revalidation pass
         
         :param standard_name: The name of the standard to return the path list for without extention
-        :return: The path list for the given standard
+        :return: The CompiledStandardView or StandardIndex for the given standard
         '''
-        # get path list
-        blob = self.bucket.blob(f'{self.standard_dir}/{standard_name}.json')
-        standard_data_str = blob.download_as_string()
-        standard_list = json.loads(standard_data_str)
+        return self.standards_cache.get(standard_name, self.standard_version, self.load_standard)
+    
+    def standard_version(self, standard_name: str) -> tuple:
+        '''
+        A function to return the current version of a standard's path list, preferring the compiled binary
+        
+        :param standard_name: The name of the standard without extention
+        :return: A tuple of the blob name and its generation
+        '''
+        for extention in ('bin', 'json'):
+            blob = self.storage.stat(f'{self.standard_dir}/{standard_name}.{extention}')
+            if blob is not None:
+                return blob.name, blob.generation
+        
+        raise self.MissingStandardError(standard_name, self.project_name)
+    
+    def load_standard(self, standard_name: str, version: tuple):
+        '''
+        A function to load a standard's path list at a version
+        Returns a lazy, memory-mapped view of the compiled standard, or an index of the JSON list
+        
+        :param standard_name: The name of the standard without extention
+        :param version: The blob name and generation from standard_version
+        :return: The CompiledStandardView or StandardIndex for the given standard
+        '''
+        blob_name, generation = version
+        try:
+            if blob_name.endswith('.bin'):
+                # map the compiled standard without decoding it
+                with tempfile.NamedTemporaryFile(suffix='.bin') as standard_file:
+                    self.storage.download_to_file(blob_name, standard_file, generation)
+                    standard_file.flush()
+                    return si.open_compiled_standard(standard_file.name)
+            
+            standard_list = json.loads(self.storage.get(blob_name, generation))
+        except NotFound:
+            raise self.MissingStandardError(standard_name, self.project_name)
         
-        return standard_list
+        return si.StandardIndex(standard_list)
         
         
     def standards_list(self) -> list:
@@ -324,7 +456,7 @@ class ScenarioTool:
         
         :return: A list of standards in the standards directory
         '''
-        standard_fles = [blob.name for blob in self.bucket.list_blobs(prefix=f'{self.project_name}/standards/') if blob.name.endswith('.xlsx')]
+        standard_fles = [blob.name for blob in self.storage.list(prefix=f'{self.project_name}/standards/') if blob.name.endswith('.xlsx')]
         
         return standard_fles
     
@@ -334,89 +466,113 @@ class ScenarioTool:
         
         :return: A list of patients in the personae directory
         '''
-        standard_fles = [blob.name for blob in self.bucket.list_blobs(prefix=f'{self.project_name}/personae/')]
+        standard_fles = [blob.name for blob in self.storage.list(prefix=f'{self.project_name}/personae/')]
         
         return standard_fles
     
-    def patient(self, patient_name: str) -> dict:
+    def patient(self, patient_name: str, expand_linked_data: bool = False) -> dict:
         '''
         A function to return a patient storylog from the personae directory
+        Events with large linked data reference a jsonl chunk (linked_data_ref), read them with linked_data
         
         :param patient_name: The name of the patient to return the storylog for
+        :param expand_linked_data: Read referenced chunks back into the events
         :return: The storylog for the given patient
         '''
         # get patient
-        try:
-            blob = self.bucket.blob(f'{self.personae_dir}/{patient_name}.json')
-        except:
-            blob = self.bucket.blob(f'{self.personae_dir}/{patient_name}.xlsx')
-            
-        patient_str = blob.download_as_string()
+        patient_str = self.storage.get(f'{self.personae_dir}/{patient_name}.json')
         patient_json = json.loads(patient_str)
+        
+        if expand_linked_data:
+            for event in patient_json.get('timeline', []):
+                if event.get('linked_data_ref'):
+                    event['linked_data'] = list(self.linked_data(event))
+                    del event['linked_data_ref']
+                    event.pop('linked_data_count', None)
 
         return patient_json
     
-    def save_patient(self, patient_file: dict, patient_name: str) -> None:
+    def save_patient(self, patient_file: dict, patient_name: str) -> str:
         '''
         A function to save a patient storylog to the personae directory
-        Re-compiles website
+        Queues a compile of the website, or re-compiles it straight away with synchronous_compile
+        The personae that were re-validated are kept in revalidated
         
         :param patient_file: The patient storylog to save
         :param patient_name: The name of the patient storylog to save
-        :return: None
+        :return: The compile job id, None if the website was compiled straight away
         '''
         # upload patient file
         patient_string = json.dumps(patient_file)
-        blob = self.bucket.blob(f'{self.personae_dir}/{patient_name}.json')
-        blob.upload_from_string(patient_string)
+        self.storage.put(f'{self.personae_dir}/{patient_name}.json', patient_string)
+        self.update_projects_manifest()
         print(f"File {patient_name}.json uploaded to {self.personae_dir}")
         
         # validate patient
-        # loop over personae and validate
-        # Get the list of blobs in the personae directory
-        blobs = self.bucket.list_blobs(prefix=self.personae_dir)
-
-        # Loop over each blob in the personae directory
-        for blob in blobs:
-            
-            # Extract the file name from the blob
-            file_name = blob.name.split('/')[-1]
-            false_paths, storylog = self.validate_personae(file_name)
-            
-            # save to a json file
-            false_paths_json_data = json.dumps(false_paths)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".falsepaths.json")}')
-            blob.upload_from_string(false_paths_json_data)
-
-            # save storylog
-            storylog_json_data = json.dumps(storylog)
-            blob = self.bucket.blob(f'{self.personae_dir}/{file_name.replace(".xlsx", ".storylog.json")}')
-            blob.upload_from_string(storylog_json_data)
+        self.revalidate_personae({f'{patient_name}.json'})
 
         print("Personae validated")
         
         # re-compile website
-        self.compile_website()
-
-        return
+        return self.schedule_compile()
     
-    def del_patient(self, patient_name: str) -> None:
+    def del_patient(self, patient_name: str) -> str:
         '''
         A function to delete a patient storylog from the personae directory
-        Re-compiles website
+        Queues a compile of the website, or re-compiles it straight away with synchronous_compile
         
         :param patient_name: The name of the patient storylog to delete
-        :return: None
+        :return: The compile job id, None if the website was compiled straight away
         '''
         # delete patient file
-        blob = self.bucket.blob(f'{self.personae_dir}/{patient_name}.json')
-        blob.delete()
+        self.storage.delete(f'{self.personae_dir}/{patient_name}.json')
+        self.update_projects_manifest()
         print(f"File {patient_name}.json deleted from {self.personae_dir}")
         
+        # delete any linked data chunks
+        self.storage.delete_many([blob.name for blob in self.storage.list(prefix=f'{self.linked_data_dir}/{patient_name}/')])
+        
+        # forget its dependencies
+        dependency_graph = self.load_dependency_graph()
+        dependency_graph.remove_personae(f'{patient_name}.json')
+        self.save_dependency_graph()
+        
         # recompile website
-        self.compile_website()
+        return self.schedule_compile()
+    
+    def schedule_compile(self) -> str:
+        '''
+        A function to queue a compile of the website without waiting for it
+        Requests for the project close together are coalesced into one compile.
+        Compiles straight away if the tool was made with synchronous_compile
         
-        return
+        :return: The compile job id (see compile_status), None if the website was compiled straight away
+        '''
+        if self.compile_scheduler is None:
+            self.compile_website()
+            return None
+        
+        website_compile = WebsiteCompile(self.project_name, self.gcp_project, self.storage)
+        self.compile_job_id = self.compile_scheduler.submit(f'{self.gcp_project}/{self.project_name}', website_compile)
+        print(f"Website compile queued as job {self.compile_job_id}")
+        
+        return self.compile_job_id
+    
+    def compile_status(self, job_id: str = None, wait: bool = False, timeout: float = None) -> dict:
+        '''
+        A function to return the status of a queued website compile
+        
+        :param job_id: The compile job id, the last one queued by this tool if None
+        :param wait: Wait for the compile to finish
+        :param timeout: The most seconds to wait
+        :return: The job status (job_id, project, status, requests, summary, error and times), or None if unknown
+        '''
+        job_id = job_id or self.compile_job_id
+        if job_id is None or self.compile_scheduler is None:
+            return None
+        if wait:
+            return self.compile_scheduler.wait(job_id, timeout)
+        return self.compile_scheduler.status(job_id)
     
     def validate_personae(self, personae_name: str) -> dict:
         '''
@@ -426,13 +582,18 @@ class ScenarioTool:
         :return: A dictionary of scenario sheets and their false paths
         '''
         false_paths = {}
+        dependency_graph = self.load_dependency_graph()
         
         # open personae file
-        blob = self.bucket.blob(f'{self.personae_dir}/{personae_name}')
+        blob_name = f'{self.personae_dir}/{personae_name}'
         if personae_name.endswith('.json'):
-            personae_data_str = blob.download_as_string()
+            personae_data_str = self.storage.get(blob_name)
             personae_data = json.loads(personae_data_str)
             
+            # a json personae is already in storylog format
+            storylog = personae_data
+            dependency_graph.set_personae(personae_name, {event['standard'] for event in personae_data['timeline']}, [])
+            
             # get the timeline items
             for event in personae_data['timeline']:
                 event_standard = event['standard']
@@ -440,195 +601,247 @@ class ScenarioTool:
                 false_paths['sheet'] = []
                 
                 # check if there is linked data
-                if len(event_linked_data) != 0:
+                if len(event_linked_data) != 0 or event.get('linked_data_ref'):
                     
                     # find the standard path list
-                    try:
-                        blob = self.bucket.blob(f'{self.standard_dir}/{event_standard}.json')
-                    except:
-                        raise self.MissingStandardError(event_standard, self.project_name)
+                    standard_index = si.StandardIndex.coerce(self.standard_path_list(event_standard))
                     
-                    standard_data_str = blob.download_as_string()
-                    standard_data = json.loads(standard_data_str)
-                    
-                    for item in event_linked_data:
+                    for item in self.linked_data(event):
                         if len(item['dataPath']) != 0:
-                            if item['dataPath'] not in standard_data:
+                            if item['dataPath'] not in standard_index:
                                 false_paths['sheet'].append(item['dataPath'])
 
         elif personae_name.endswith('.xlsx'):
-            byte_stream = BytesIO()
-            blob.download_to_file(byte_stream)
-            byte_stream.seek(0)
-            wb = openpyxl.load_workbook(filename=byte_stream, read_only=True)
-            
-            # initiate storylog
-            storylog = {}
-            
-            # get the story sheet and work out what standard it is
-            story_sheet = wb['Story']
-            story_standard = str(story_sheet['E2'].value)
+            # parse the workbook into its storylog and compiled scenario sheets
+            compiled = self.compile_personae_workbook(self.storage.get(blob_name))
+            storylog = compiled['storylog']
+            story_standard = compiled['standard']
+            resolver = compiled['resolver']
             
-            # get timeline sheet
-            timeline_sheet = wb['Time Line']
-            
-            storylog['summary'] = str(story_sheet['A2'].value)
-            storylog['rationale'] = str(story_sheet['B2'].value)
-            storylog['story'] = str(story_sheet['C2'].value)
-            storylog['standard_url'] = str(story_sheet['D2'].value)
-            storylog['standard_name'] = str(story_sheet['E2'].value)
-            storylog['timeline'] = ep.get_timeline_storylog_format(timeline_sheet, story_standard)
+            # record dependencies before anything can fail, continuous data is added as it is opened
+            dependency_graph.set_personae(personae_name, {story_standard}, [])
             
             # get the standard path list
-            try:
-                blob = self.bucket.blob(f'{self.standard_dir}/{story_standard}.json')
-            except:
-                raise self.MissingStandardError(story_standard, self.project_name)
-        
-            standard_data_str = blob.download_as_string()
-            standard_data = json.loads(standard_data_str)
-            
-            # get the scenario sheets
-            scenario_sheets = [sheet for sheet in wb.sheetnames if sheet.lower() not in ['story', 'time line', 'timeline', 'group aliases', 'path aliases']]
+            standard_index = si.StandardIndex.coerce(self.standard_path_list(story_standard))
             
-            # get the group alias and path alias sheets
-            group_alias_sheet = wb['Group Aliases']
-            path_alias_sheet = wb['Path Aliases']
+            # linked data chunks are stored per personae
+            personae_base_name = personae_name.rsplit('.', 1)[0]
+            linked_data_refs = set()
             
             # loop over the scenario sheets
-            for sheet in scenario_sheets:
+            for sheet, scenario_ir in compiled['scenarios']:
                 false_paths[sheet] = []
-                scenario_sheet = wb[sheet]
-                
-                path_location = ep.find_cell_location(scenario_sheet, 'Data Path')
-                example_data_location = ep.find_cell_location(scenario_sheet, 'Example Data')
                 
-                path_list = []
-                in_loop = False
+                # stream the paths of the sheet, spilling very large events to disk
+                def continuous_data(csv_name, sheet=sheet):
+                    dependency_graph.add_continuous_data(personae_name, csv_name)
+                    return self.continuous_data(csv_name, personae_name, sheet)
                 
-                for row in scenario_sheet.iter_rows(min_row=path_location[0] + 1,
-                                        max_row=scenario_sheet.max_row,
-                                        min_col=path_location[1],
-                                        max_col=example_data_location[1]):
-                    
-                    # loop over rows expanding syntax
-                    if row[0].value:
-                        path = row[0].value.lower().strip()
-                        value = row[0].value
-                        
-                        # check if in a continuous data loop
-                        if in_loop:
-                            if path != '$loopend':
-                                continue
-                            elif path == '$loopend':
-                                in_loop = False
-                                continue
-                            
-                            # process group alias
-                            elif '$$' in path:
-                                group_alias_name = path.split('.')[-1].replace('$$', '').strip().lower()
-                                without_alias = '.'.join(path.split('.')[:-1])
-                                group_alias_paths = ep.expand_group_aliases(group_alias_sheet, group_alias_name)
-                                
-                                split_path = path.split('.')
-                                for index, element in enumerate(split_path[:-1]):
-                                    if element.startswith('$'):
-                                        if '[' in element:
-                                            element_no_index = element.split('[')[0]
-                                            element_index = element.split('[')[1].replace(']', '')
-                                            
-                                            expanded_value = ep.expand_path_alias(element_no_index, path_alias_sheet)
-                                            expanded_value = f'{expanded_value}[{element_index}]'
-                                        else:
-                                            expanded_value = ep.expand_path_alias(element, path_alias_sheet)
-                                        
-                                        # replace the element in the split path with the expanded value    
-                                        split_path[index] = expanded_value
-                                        
-                                # re-join the split path
-                                path = '.'.join(split_path)
-                                
-                                # add the group alias paths to the path list
-                                for alias_path in group_alias_paths:
-                                    with_group_alias = f'{path.split("$$")[0]}{alias_path[0]}'
-                                    path_list.append([with_group_alias.split('.'), alias_path[1]])
-                                                
-                            # handle continuous data loop
-                            elif '$loop' in path:
-                                
-                                # set in loop to true
-                                in_loop = True
-                                
-                                # get csv name from path and download from GCP storage
-                                csv_name = path.replace('$loop', '').strip().lower()
-                                try:
-                                    blob = self.bucket.blob(f'{self.continuous_data_dir}/{csv_name}')
-                                except:
-                                    raise self.MissingContinuousDataError(csv_name, self.project_name, personae_name, sheet)
-
-                                csv_data_str = blob.download_as_string()
-                                csv_data = csv_data_str.decode('utf-8').split('\n')
-                                
-                                loop_start = row[0].row
-                                loop_lines = ep.get_loop_lines(scenario_sheet, loop_start, path_location[1], example_data_location[1])
-                                
-                                # expand loop lines
-                                expanded_loop_lines = expand_loop_lines(loop_lines, csv_data, path_alias_sheet, group_alias_sheet)
-                                
-                                # append to path list
-                                [path_list.append([arr[0].split('.'), arr[1]]) for arr in expanded_loop_lines]
-                                
-                            # handle path alias
-                            elif '$' in path:
-                                split_path = path.split('.')
-                                
-                                # loop over the split path if there is a $ find the expanded value and replace
-                                for index, element in enumerate(split_path):
-                                    if element.startswith('$'):
-                                        if '[' in element:
-                                            element_no_index = element.split('[')[0]
-                                            element_index = element.split('[')[1].replace(']', '')
-                                            expanded_value = ep.expand_path_alias(element_no_index, path_alias_sheet)
-                                            expanded_value = f'{expanded_value}[{element_index}]'
-                                        else:
-                                            expanded_value = ep.expand_path_alias(element, path_alias_sheet)
-                                            
-                                        # replace the element in the split path with the expanded value
-                                        split_path[index] = expanded_value
-                                        
-                                path_list.append([split_path, value])
-                                
-                            else:
-                                path_list.append([path.split('.'), value])
-                                
-                # find event in timeline and add path data to it
-                for event in storylog['timeline']:
-                    if event['event'] == sheet:
-                        # get pathlist in correct format
-                        new_path_list = []
-                        for path in path_list:
-                            new_path_list.append({
-                                'dataPath': path[0],
-                                'exampleData': path[1]
-                            })
-                        
-                        event['linked_data'] = new_path_list
+                linked_data = ep.LinkedDataWriter()
+                try:
+                    for segments, value, row in ep.iter_scenario_ir(scenario_ir, resolver, continuous_data):
+                        linked_data.add(segments, value)
                         
-                # validate paths and make storylog
-                
-                for path in path_list:
-                    if path[0] not in standard_data:
-                        false_paths[sheet].append(path[0])
+                        # validate paths
+                        if segments not in standard_index:
+                            false_paths[sheet].append(segments)
                     
+                    linked_data_ref = f'{personae_base_name}/{sheet}.jsonl'
+                    if linked_data.spilled:
+                        self.storage.put_stream(f'{self.linked_data_dir}/{linked_data_ref}', linked_data.rewind(), content_type='application/x-ndjson')
+                        linked_data_refs.add(linked_data_ref)
+                    
+                    # find event in timeline and add path data to it
+                    for event in storylog['timeline']:
+                        if event['event'] == sheet:
+                            linked_data.apply(event, linked_data_ref)
+                finally:
+                    linked_data.close()
+            
+            # remove chunks left by events that are no longer large or no longer exist
+            stale_chunks = [blob.name for blob in self.storage.list(prefix=f'{self.linked_data_dir}/{personae_base_name}/')
+                            if blob.name[len(self.linked_data_dir) + 1:] not in linked_data_refs]
+            self.storage.delete_many(stale_chunks)
         
         return false_paths, storylog
     
-    def render_story(self, personae_name, personae_story_data: dict) -> None:
+    def linked_data(self, event: dict):
         '''
-        A function to render a personae story
+        A generator over the linked data of a storylog event
+        Chunks referenced by linked_data_ref are streamed from the linked data directory
         
-        :param personae_story_data: The name of the personae to render the story for
-        :return: The rendered story
+        :param event: The storylog timeline event
+        :return: Yields the linked data items
+        '''
+        def open_chunk(linked_data_ref):
+            return self.storage.open(f'{self.linked_data_dir}/{linked_data_ref}')
+        
+        return ep.iter_linked_data(event, open_chunk)
+    
+    def personae_files(self, personae_dir: str = None) -> list:
+        '''
+        A function to return the personae file names, skipping the false path and storylog files made by validation
+        
+        :param personae_dir: The personae folder, the current project's if not given
+        :return: A list of personae file names
+        '''
+        personae_files = []
+        for blob in self.storage.list(prefix=f'{personae_dir or self.personae_dir}/'):
+            file_name = blob.name.split('/')[-1]
+            if file_name.endswith('.xlsx') or (file_name.endswith('.json') and not file_name.endswith(('.falsepaths.json', '.storylog.json'))):
+                personae_files.append(file_name)
+        
+        return personae_files
+    
+    def load_dependency_graph(self) -> dg.DependencyGraph:
+        '''
+        A function to return the dependency graph of the project, loading it on first use
+        
+        :return: The DependencyGraph
+        '''
+        if self.dependency_graph is None:
+            try:
+                graph_json = self.storage.get(self.dependency_graph_path)
+                self.dependency_graph = dg.DependencyGraph.from_json(graph_json)
+            except NotFound:
+                self.dependency_graph = dg.DependencyGraph()
+        
+        return self.dependency_graph
+    
+    def save_dependency_graph(self) -> None:
+        '''
+        A function to save the changes made to the dependency graph
+        The changes are applied to the graph as it is saved now, so changes saved by another process since
+        it was loaded are kept, and the graph is only written if no one else has saved it in between
+        
+        :return: None
+        '''
+        dependency_graph = self.load_dependency_graph()
+        
+        def update(data):
+            saved = dg.DependencyGraph() if data is None else dg.DependencyGraph.from_json(data)
+            return dependency_graph.rebase(saved).to_json()
+        
+        graph_json = sb.update_object(self.storage, self.dependency_graph_path, update, content_type='application/json')
+        self.dependency_graph = dg.DependencyGraph.from_json(graph_json)
+        
+        return
+    
+    def compile_personae_workbook(self, workbook_bytes: bytes) -> dict:
+        '''
+        A function to parse a personae workbook, in the parse process pool when a revalidation pass has one
+        
+        :param workbook_bytes: The contents of the personae xlsx file
+        :return: The compiled workbook (see excelProcessing.compile_personae_workbook)
+        '''
+        if self.parse_executor is not None:
+            return self.parse_executor.submit(ep.compile_personae_workbook, workbook_bytes).result()
+        return ep.compile_personae_workbook(workbook_bytes)
+    
+    def revalidate_one(self, personae_name: str) -> None:
+        '''
+        A function to re-validate one personae and save its false paths and storylog
+        
+        :param personae_name: The personae file name
+        :return: None
+        '''
+        false_paths, storylog = self.validate_personae(personae_name)
+        
+        # save to a json file
+        false_paths_json_data = json.dumps(false_paths)
+        self.storage.put(f'{self.personae_dir}/{personae_output_name(personae_name, "falsepaths")}', false_paths_json_data)
+        
+        # save storylog
+        storylog_json_data = json.dumps(storylog)
+        self.storage.put(f'{self.personae_dir}/{personae_output_name(personae_name, "storylog")}', storylog_json_data)
+        
+        return
+    
+    def revalidate_personae(self, personae_names: set = None) -> set:
+        '''
+        A function to re-validate personae and save their false paths and storylogs
+        Personae the dependency graph has no record of are always included
+        Personae are re-validated concurrently on revalidation_workers threads, with workbook parsing in
+        parse_processes processes when set. A failing personae does not stop the others, the failures are
+        raised together as a RevalidationError once the pass is finished
+        Continuous data is cached for the whole pass so a csv shared by several sheets or personae is downloaded once
+        The personae re-validated are also kept in revalidated
+        
+        :param personae_names: The personae affected by a change, or None to re-validate every personae
+        :return: The personae that were re-validated
+        '''
+        personae_files = self.personae_files()
+        dependency_graph = self.load_dependency_graph()
+        if personae_names is None:
+            touched = set(personae_files)
+        else:
+            touched = dependency_graph.affected_personae(personae_files, personae_names)
+        
+        # forget personae that have been removed
+        for personae_name in dependency_graph.personae_names() - set(personae_files):
+            dependency_graph.remove_personae(personae_name)
+        
+        errors = {}
+        self.continuous_data_cache = caches.ContinuousDataCache()
+        self.standards_cache.begin_pass()
+        if self.parse_processes and len(touched) > 1:
+            self.parse_executor = ProcessPoolExecutor(max_workers=self.parse_processes)
+        try:
+            # the thread pool bounds the number of personae in flight
+            with ThreadPoolExecutor(max_workers=self.revalidation_workers) as executor:
+                futures = {personae_name: executor.submit(self.revalidate_one, personae_name) for personae_name in touched}
+                
+                # collect in name order so the outcome does not depend on completion order
+                for personae_name in sorted(futures):
+                    try:
+                        futures[personae_name].result()
+                    except Exception as e:
+                        errors[personae_name] = f'{type(e).__name__}: {e}'
+        finally:
+            if self.parse_executor is not None:
+                self.parse_executor.shutdown()
+                self.parse_executor = None
+            self.save_dependency_graph()
+            self.standards_cache.end_pass()
+            print(f"Continuous data cache: {self.continuous_data_cache.stats()}, standards cache: {self.standards_cache.stats()}")
+            self.continuous_data_cache = None
+        
+        self.revalidated = touched
+        print(f"Re-validated {len(touched)} personae: {sorted(touched)}")
+        
+        if errors:
+            raise self.RevalidationError(errors, self.project_name, touched)
+        
+        return touched
+    
+    def continuous_data(self, csv_name: str, personae_name: str = None, sheet: str = None):
+        '''
+        A generator that streams the csv rows of a continuous data file from the bucket
+        During a revalidation pass the file is read through the continuous data cache
+        
+        :param csv_name: The name of the csv file in the continuous data directory
+        :param personae_name: The personae that references the file, for error reporting
+        :param sheet: The sheet that references the file, for error reporting
+        :return: Yields the csv rows
+        '''
+        blob_name = f'{self.continuous_data_dir}/{csv_name}'
+        try:
+            if self.continuous_data_cache is not None:
+                csv_stream = BytesIO(self.continuous_data_cache.get(self.storage, blob_name))
+                yield from ep.iter_continuous_data(csv_stream)
+            else:
+                with self.storage.open(blob_name) as csv_stream:
+                    yield from ep.iter_continuous_data(csv_stream)
+        except NotFound:
+            raise self.MissingContinuousDataError(csv_name, self.project_name, personae_name, sheet)
+    
+    def story_outputs(self, personae_name, personae_story_data: dict) -> list:
+        '''
+        A function to render a personae story without uploading it
+        
+        :param personae_name: The name of the personae to render the story for
+        :param personae_story_data: The story of the personae
+        :return: A list of the (object name, rendered page, content type) to upload
         '''
         # get personae story template
         template = self.template_env.get_template('story.html')
@@ -636,9 +849,79 @@ class ScenarioTool:
         # render story
         output = template.render(personae_story_data)
         
+        return [(f'{self.project_name}/website/Stories/{personae_name}_story.html', output, 'text/html')]
+    
+    def log_outputs(self, personae_name, personae_timeline_data: dict) -> list:
+        '''
+        A function to render a personae timeline without uploading it
+        
+        :param personae_name: The name of the personae to render the timeline for
+        :param personae_timeline_data: The data of the personae to render the timeline for
+        :return: A list of the (object name, rendered page, content type) to upload
+        '''
+        # get personae timeline template
+        template = self.template_env.get_template('timeline.html')
+        
+        # render timeline
+        output = template.render(personae_timeline_data)
+        
+        return [(f'{self.project_name}/website/Timelines/{personae_name}_log.html', output, 'text/html')]
+    
+    def data_outputs(self, personae_name, personae_data: dict, scenario_event_name) -> list:
+        '''
+        A function to render a personae data in the different types of style without uploading it
+        
+        :param personae_name: The name of the personae to render the data for
+        :param personae_data: The data of the personae to render the data for
+        :param scenario_event_name: The name of the scenario event to render the data for
+        :return: A list of the (object name, rendered page, content type) to upload
+        '''
+        data_dir = f'{self.project_name}/website/data/{personae_name}'
+        
+        # get tree view template and render
+        template = self.template_env.get_template('tree_view_template.jinja')
+        tree_output = template.render(personae_data)
+        
+        # get rendered view template and render
+        template = self.template_env.get_template('json_render.jinja')
+        render_output = template.render(personae_data)
+        
+        # just upload JSON data to JSON folder
+        json_data = json.dumps(personae_data)
+        
+        return [
+            (f'{data_dir}/tree/{scenario_event_name}.html', tree_output, 'text/html'),
+            (f'{data_dir}/render/{scenario_event_name}.html', render_output, 'text/html'),
+            (f'{data_dir}/json/{scenario_event_name}.json', json_data, 'application/json')
+        ]
+    
+    def event_outputs(self, personae_name, event: dict) -> list:
+        '''
+        A function to build the data of a storylog event and render it without uploading it
+        
+        :param personae_name: The name of the personae the event belongs to
+        :param event: The storylog timeline event
+        :return: A list of the (object name, rendered page, content type) to upload
+        '''
+        # get data in correct format, streaming spilled chunks
+        paths = []
+        for item in self.linked_data(event):
+            paths.append([item['dataPath'].split('.'), item['exampleData']])
+            
+        # get the paths into an object
+        personae_data_object = ep.build_object(paths)
+        
+        return self.data_outputs(personae_name, personae_data_object, event['event'])
+    
+    def render_story(self, personae_name, personae_story_data: dict) -> None:
+        '''
+        A function to render a personae story
+        
+        :param personae_story_data: The name of the personae to render the story for
+        :return: None
+        '''
         # save to website directory on storage bucket
-        blob = self.bucket.blob(f'{self.project_name}/website/Stories/{personae_name}_story.html')
-        blob.upload_from_string(output)
+        self.put_outputs(self.story_outputs(personae_name, personae_story_data))
         
         print(f"{personae_name} story rendered")
         
@@ -652,15 +935,8 @@ class ScenarioTool:
         :param personae_timeline_data: The data of the personae to render the timeline for
         :return: None
         '''
-        # get personae timeline template
-        template = self.template_env.get_template('timeline.html')
-        
-        # render timeline
-        output = template.render(personae_timeline_data)
-        
         # save to website directory on storage bucket
-        blob = self.bucket.blob(f'{self.project_name}/website/Timelines/{personae_name}_log.html')
-        blob.upload_from_string(output)
+        self.put_outputs(self.log_outputs(personae_name, personae_timeline_data))
         
         print(f"{personae_name} timeline rendered")
         
@@ -676,185 +952,157 @@ class ScenarioTool:
         :param scenario_event_name: The name of the scenario event to render the data for
         :return: None
         '''
-        # get tree view template and render
-        template = self.template_env.get_template('tree_view_template.jinja')
-        output = template.render(personae_data)
-        blob = self.bucket.blob(f'{self.project_name}/website/data/{personae_name}/tree/{scenario_event_name}.html')
-        blob.upload_from_string(output)
+        self.put_outputs(self.data_outputs(personae_name, personae_data, scenario_event_name))
         
-        # get rendered view template and render
-        template = self.template_env.get_template('json_render.jinja')
-        output = template.render(personae_data)
-        blob = self.bucket.blob(f'{self.project_name}/website/data/{personae_name}/render/{scenario_event_name}.html')
-        blob.upload_from_string(output)
+        return
+    
+    def put_outputs(self, outputs: list) -> None:
+        '''
+        A function to upload rendered outputs, gzipping the large ones
         
-        # just upload JSON data to JSON folder
-        json_data = json.dumps(personae_data)
-        blob = self.bucket.blob(f'{self.project_name}/website/data/{personae_name}/json/{scenario_event_name}.json')
-        blob.upload_from_string(json_data)
+        :param outputs: A list of (object name, rendered page, content type)
+        :return: None
+        '''
+        for output_name, output, content_type in outputs:
+            data, content_encoding = rp.encode_output(output, content_type)
+            self.storage.put(output_name, data, content_type, content_encoding)
         
         return
         
 
-    def compile_website(self) -> None:
+    def load_build_manifest(self) -> bm.BuildManifest:
+        try:
+            return bm.BuildManifest.from_json(self.storage.get(self.build_manifest_path))
+        except NotFound:
+            return bm.BuildManifest()
+        
+    def save_build_manifest(self, manifest: bm.BuildManifest) -> None:
+        self.storage.put(self.build_manifest_path, manifest.to_json(), content_type='application/json')
+        
+        return
+    
+    def template_digest(self, template_name: str) -> str:
+        source, file_name, uptodate = self.template_env.loader.get_source(self.template_env, template_name)
+        return bm.input_digest(template_name, source)
+    
+    def compile_website(self, full: bool = False) -> dict:
         '''
         A function to compile the website
-        Will re-render all templates and save them to the website directory
+        Only re-renders and uploads the outputs whose inputs (storylog data, template and
+        static asset) changed since the last compile, as recorded in the build manifest,
+        and deletes the outputs that are no longer made
         
-        :return: None
+        :param full: Re-render and copy everything, ignoring the build manifest
+        :return: :dict: The number of outputs rendered, copied, kept and deleted, and the objects, bytes and seconds of each render pipeline stage
         '''
-        # get the list of personae
-        personae_list = [blob.name for blob in self.bucket.list_blobs(prefix=f'{self.project_name}/personae/') if blob.name.endswith('.storylog.json')]
+        website_dir = f'{self.project_name}/website'
+        manifest = bm.BuildManifest() if full else self.load_build_manifest()
+        summary = {'rendered': 0, 'copied': 0, 'kept': 0, 'deleted': 0}
         
-        # clear the websirte directory and re-create from website contents folder
-        blobs = self.bucket.list_blobs(prefix=f'{self.project_name}/website/')
-        for blob in blobs:
-            blob.delete()
-            
-        # get the list of files in the website contents folder
-        blobs = self.bucket.list_blobs(prefix=f'{self.project_name}/website_contents/')
+        # an output missing from the website is rebuilt whatever the manifest says
+        existing = {blob.name for blob in self.storage.list(prefix=f'{website_dir}/') if not blob.name.endswith('/')}
+        built = set()
+        
+        def is_current(output_name, digest):
+            built.add(output_name)
+            if output_name in existing and manifest.is_current(output_name, digest):
+                summary['kept'] += 1
+                return True
+            manifest.set_output(output_name, digest)
+            return False
+        
+        # copy the website contents that changed since they were last copied
+        blobs = self.storage.list(prefix=f'{self.project_name}/website_contents/')
+        copies = []
         for blob in blobs:
-            # Construct the destination object name
             destination_blob_name = blob.name.replace('website_contents', 'website', 1)
-
-            # Copy the blob to the new location
-            self.bucket.copy_blob(blob, self.bucket, destination_blob_name)
+            if not is_current(destination_blob_name, bm.input_digest(blob.name, blob.generation)):
+                copies.append((blob.name, destination_blob_name))
+        summary['copied'] = self.storage.copy_many(copies, progress=sb.print_progress('Copying website contents'))
+        
+        # get the list of personae
+        personae_list = [blob for blob in self.storage.list(prefix=f'{self.project_name}/personae/') if blob.name.endswith('.storylog.json')]
+        if personae_list:
+            templates = {template_name: self.template_digest(template_name) for template_name in ('story.html', 'timeline.html', 'tree_view_template.jinja', 'json_render.jinja')}
+        
+        # pages render on a worker pool and upload while the next personae is read
+        with rp.RenderPipeline(self.storage) as pipeline:
             
-        # loop over personae
-        for personae in personae_list:
+            # loop over personae
+            for personae in personae_list:
             
-            # get personae data
-            blob = self.bucket.blob(personae)
-            personae_data_str = blob.download_as_string()
-            personae_data = json.loads(personae_data_str)
+                # get personae name
+                personae_name = personae.name.split('/')[-1].replace('.json', '')
             
-            # get personae name
-            personae_name = personae.split('/')[-1].replace('.json', '')
+                # skip the personae without reading it if its storylog and the templates are unchanged
+                source_digest = bm.input_digest(personae.generation, templates)
+                output_names = manifest.source_outputs(personae.name, source_digest)
+                if output_names is not None and existing.issuperset(output_names):
+                    built.update(output_names)
+                    summary['kept'] += len(output_names)
+                    continue
+                built_before = set(built)
             
-            # get personae story
-            personae_story = personae_data['story']
+                # get personae data
+                personae_data_str = self.storage.get(personae.name)
+                personae_data = json.loads(personae_data_str)
             
-            # get personae timeline
-            storylog_timeline = personae_data['timeline']
-            timeline = []
-            for event in storylog_timeline:
-                timeline.append({
-                    'time': event['time'],
-                    'event': event['event'],
-                    'sheet': event['sheet']
-                })
+                # get personae story
+                personae_story = personae_data['story']
             
-            # render story and timeline
-            self.render_story(personae_name, personae_story)
-            self.render_log(personae_name, timeline) # need to get timeline in correct format or changet the template
+                # get personae timeline
+                storylog_timeline = personae_data['timeline']
+                timeline = []
+                for event in storylog_timeline:
+                    timeline.append({
+                        'time': event['time'],
+                        'event': event['event'],
+                        'sheet': event['sheet']
+                    })
             
-            # loop over timeline
-            for event in storylog_timeline:
-                if event['linked_data'] != []:
+                # render story and timeline
+                if not is_current(f'{website_dir}/Stories/{personae_name}_story.html', bm.input_digest(templates['story.html'], personae_story)):
+                    pipeline.submit(f'{personae_name} story', functools.partial(self.story_outputs, personae_name, personae_story))
+                    summary['rendered'] += 1
+                if not is_current(f'{website_dir}/Timelines/{personae_name}_log.html', bm.input_digest(templates['timeline.html'], timeline)):
+                    pipeline.submit(f'{personae_name} timeline', functools.partial(self.log_outputs, personae_name, timeline)) # need to get timeline in correct format or changet the template
+                    summary['rendered'] += 1
+            
+                # loop over timeline
+                for event in storylog_timeline:
+                    if event['linked_data'] != [] or event.get('linked_data_ref'):
 
-                    # get the event name
-                    event_name = event['event']
+                        # get the event name
+                        event_name = event['event']
                     
-                    # get the event data
-                    event_data = event['linked_data']
+                        # spilled linked data is identified by its chunk generation rather than read
+                        if event.get('linked_data_ref'):
+                            data_digest = bm.input_digest(event['linked_data_ref'], self.storage.generation(f"{self.linked_data_dir}/{event['linked_data_ref']}"))
+                        else:
+                            data_digest = bm.input_digest(event['linked_data'])
                     
-                    # get data in correct format
-                    paths = []
-                    for item in event_data:
-                        paths.append(item['dataPath'].split('.'), item['exampleData'])
-                        
-                    # get the paths into an object
-                    personae_data_object = ep.create_object(paths)
+                        data_dir = f'{website_dir}/data/{personae_name}'
+                        stale = [
+                            not is_current(f'{data_dir}/tree/{event_name}.html', bm.input_digest(templates['tree_view_template.jinja'], data_digest)),
+                            not is_current(f'{data_dir}/render/{event_name}.html', bm.input_digest(templates['json_render.jinja'], data_digest)),
+                            not is_current(f'{data_dir}/json/{event_name}.json', data_digest)
+                        ]
+                        if not any(stale):
+                            continue
                     
-                    # render data
-                    self.render_data(personae_name, personae_data_object, event_name)
+                        # render data
+                        pipeline.submit(f'{personae_name} {event_name}', functools.partial(self.event_outputs, personae_name, event))
+                        summary['rendered'] += 3
             
-        return
-
-def expand_loop_lines(loop_lines: list,
-                      csv_data: list,
-                      path_alias_sheet: openpyxl.worksheet.worksheet.Worksheet,
-                      group_alias_sheet: openpyxl.worksheet.worksheet.Worksheet):
-    '''
-    A function to expand a list of loop lines
-    
-    :param loop_lines: The lines to expand
-    :param csv_data: The csv data to loop over
-    :param path_alias_sheet: The path alias sheet
-    :param group_alias_sheet: The group alias sheet
-    :return: The expanded loop lines
-    '''
-    path_list = []
-    
-    for index, continuous_data_arr in enumerate(csv_data):
-        # loop over loop_lines
-        for loop_lines_arr in loop_lines:
-            path = loop_lines_arr[0]
-            value = loop_lines_arr[1]
-            
-            # apply index to path
-            path = path.replace('%', str(index))
-            
-            # check value isnt a reference
-            if str(value).startswith('#'):
-                
-                # get index of value from continuous data 
-                value_index = int(value.replace('#',''))
-                
-                # sort the csv file into array
-                value = str(continuous_data_arr[value_index])
-                
-                # if digit then convert to int
-                if value.isdigit():
-                    value = int(value)
-                else:
-                    value = value.lower().strip()
-            
-            # check for group alias
-            if path.split('.')[-1].startswith('$$'):
-                group_alias_name = path.split('.')[-1].replace('$$', '').strip().lower()
-                group_alias_paths = ep.expand_group_aliases(group_alias_sheet, group_alias_name)
-
-                for alias_path in group_alias_paths:
-                    if len(path.split('.')[:-1]) != 0:
-                        path_array = '.'.join([path.split('.')[:-1], alias_path[0]]).split('.')
-                    else:
-                        path_array = alias_path[0].split('.')
-
-                    path_value = alias_path[1]
-
-                    # check for path aliases
-                    for index, element in enumerate(path_array):
-                        if element.startswith('$'):
-
-                            # expand path alias
-                            expanded = ep.expand_path_alias(element, path_alias_sheet)
-
-                            # replace the element with the expanded value
-                            path_array[index] = expanded
-
-                    path_list.append(['.'.join(path_array), path_value])
-
-            # check for path alias
-            if '$' in path:
-                
-                # get split path
-                split_path = path.split('.')
-                
-                # loop over the split path if there is a $ find the expanded value and replace
-                for index, element in enumerate(split_path):
-                    if element.startswith('$'):
-                        # get the expanded value
-                        expanded_value = ep.expand_path_alias(element, path_alias_sheet)
-                        
-                        # replace the element with the expanded value
-                        split_path[index] = expanded_value
-
-                # add to path list
-                path_list.append(['.'.join(split_path), value])
-            
-            else:
-                # add to path list
-                path_list.append([path, value])
-                
-    return path_list
\ No newline at end of file
+                manifest.set_source(personae.name, source_digest, built - built_before)
+        summary['stages'] = pipeline.summary['stages']
+        
+        # delete the outputs that are no longer made
+        orphans = sorted(existing - built)
+        summary['deleted'] = self.storage.delete_many(orphans, progress=sb.print_progress('Deleting old website files'))
+        
+        manifest.retain([personae.name for personae in personae_list], built)
+        self.save_build_manifest(manifest)
+        print(f"Website compiled: {summary['rendered']} rendered, {summary['copied']} copied, {summary['kept']} unchanged, {summary['deleted']} deleted")
+        
+        return summary
@@ -0,0 +1,129 @@
+from jinja2 import ChoiceLoader, Environment, FileSystemLoader, ModuleLoader, TemplateNotFound
+
+import hashlib
+import json
+import os
+import threading
+
+import storageBackends as sb
+
+
+# the templates folder next to the package
+this_file_dir = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_DIR = os.path.join(this_file_dir[:this_file_dir.rfind('/')], 'templates')
+
+# the file written by compileTemplates next to the compiled modules, holding the digest of each template's source
+COMPILED_TEMPLATE_MANIFEST = 'templates.json'
+
+# one of each per process, made on first use
+lock = threading.Lock()
+client = None
+storage_backends = {}
+template_envs = {}
+
+
+def storage_client():
+    '''
+    A function to return the Google Cloud Storage client shared by the process
+    The client keeps its credentials and its HTTP session, so connections are reused across requests
+
+    :return: The storage client
+    '''
+    global client
+    with lock:
+        if client is None:
+            from google.cloud import storage
+            client = storage.Client()
+        return client
+
+
+def storage_backend(bucket_name: str) -> sb.GCSBackend:
+    '''
+    A function to return the storage backend of a bucket, shared by the process
+
+    :param bucket_name: The name of the bucket
+    :return: The GCSBackend
+    '''
+    shared_client = storage_client()
+    with lock:
+        if bucket_name not in storage_backends:
+            storage_backends[bucket_name] = sb.GCSBackend(bucket_name, shared_client)
+        return storage_backends[bucket_name]
+
+
+def compiled_template_path(template_path: str) -> str:
+    return f'{os.path.normpath(template_path)}_compiled'
+
+
+def source_digest(source: str) -> str:
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+class PrecompiledLoader(ModuleLoader):
+    '''
+    Loads templates from the modules made by compileTemplates, so they are not compiled at runtime.
+    A template whose source has changed since it was compiled is reported as not found, so the
+    FileSystemLoader after this one in the environment compiles it from source instead.
+    Sources are still read from the template folder for anything that asks for them.
+
+    :param compiled_path: The folder of compiled template modules
+    :param template_path: The template folder they were compiled from
+    '''
+    def __init__(self, compiled_path: str, template_path: str):
+        super().__init__(compiled_path)
+        self.source_loader = FileSystemLoader(template_path)
+        with open(os.path.join(compiled_path, COMPILED_TEMPLATE_MANIFEST)) as f:
+            self.digests = json.load(f)
+
+    def get_source(self, environment, template):
+        return self.source_loader.get_source(environment, template)
+
+    def list_templates(self) -> list:
+        return self.source_loader.list_templates()
+
+    def load(self, environment, name, globals=None):
+        source, file_name, uptodate = self.source_loader.get_source(environment, name)
+        if self.digests.get(name) != source_digest(source):
+            raise TemplateNotFound(name)
+        return super().load(environment, name, globals)
+
+
+def template_loader(template_path: str):
+    '''
+    A function to return the loader for a template folder, preferring templates precompiled by compileTemplates
+
+    :param template_path: The path to the template folder
+    :return: The jinja2 loader
+    '''
+    compiled_path = compiled_template_path(template_path)
+    if not os.path.isfile(os.path.join(compiled_path, COMPILED_TEMPLATE_MANIFEST)):
+        return FileSystemLoader(template_path)
+    return ChoiceLoader([PrecompiledLoader(compiled_path, template_path), FileSystemLoader(template_path)])
+
+
+def template_env(template_path: str = TEMPLATE_DIR) -> Environment:
+    '''
+    A function to return the template environment of a folder, shared by the process
+    Templates precompiled by compileTemplates are loaded from their modules, any others are
+    compiled the first time they are used, and then all are served from the environment's cache
+
+    :param template_path: The path to the template folder
+    :return: The jinja2 template environment
+    '''
+    with lock:
+        if template_path not in template_envs:
+            template_envs[template_path] = Environment(loader=template_loader(template_path))
+        return template_envs[template_path]
+
+
+def reset() -> None:
+    '''
+    A function to drop the shared client, storage backends and template environments, e.g. after forking
+
+    :return: None
+    '''
+    global client
+    with lock:
+        client = None
+        storage_backends.clear()
+        template_envs.clear()
@@ -0,0 +1,306 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+
+# key used in a trie node to mark that a complete standard path ends there
+TERMINAL = None
+
+
+def strip_index(segment: str) -> str:
+    '''
+    A function to remove trailing [n] indexes from a path segment
+
+    :param segment: The path segment, e.g. 'name[2]'
+    :return: :str: The segment without its indexes, e.g. 'name'
+    '''
+    while segment.endswith(']'):
+        open_bracket = segment.rfind('[')
+        if open_bracket == -1 or not segment[open_bracket + 1:-1].isdigit():
+            break
+        segment = segment[:open_bracket]
+    return segment
+
+
+def split_path(path) -> list:
+    '''
+    A function to turn a dotted path or a list of segments into a list of segments
+
+    :param path: The path as a dotted string or a list of segments
+    :return: :list: The path segments
+    '''
+    if isinstance(path, str):
+        return path.split('.')
+    return list(path)
+
+
+class StandardIndex:
+    '''
+    A segment trie of the paths in a standard.
+    Membership is answered in O(path depth) instead of scanning the whole standard list.
+    Paths may be given as dotted strings or as segment lists, and [n] indexes in
+    looked up paths are ignored.
+
+    :param standard_paths: The standard paths to index
+    '''
+    def __init__(self, standard_paths=()):
+        self.root = {}
+        self.size = 0
+
+        for path in standard_paths:
+            self.add(path)
+
+    @classmethod
+    def coerce(cls, standard_paths) -> 'StandardIndex':
+        '''
+        A function to return an index for standard paths, building one if a list is given
+
+        :param standard_paths: A StandardIndex or a list of standard paths
+        :return: :StandardIndex:
+        '''
+        if isinstance(standard_paths, (StandardIndex, CompiledStandardView)):
+            return standard_paths
+        return cls(standard_paths)
+
+    def add(self, path) -> None:
+        '''
+        A function to add a standard path to the index. Standard paths are lowercased
+
+        :param path: The path as a dotted string or a list of segments
+        :return: None
+        '''
+        node = self.root
+        for segment in split_path(path):
+            segment = sys.intern(segment.lower())
+            child = node.get(segment)
+            if child is None:
+                child = node[segment] = {}
+            node = child
+
+        if TERMINAL not in node:
+            node[TERMINAL] = True
+            self.size += 1
+
+    def walk(self, path) -> tuple:
+        '''
+        A function to follow a path down the trie as far as it matches
+
+        :param path: The path as a dotted string or a list of segments
+        :return: :tuple: The number of matched segments and the last matched node
+        '''
+        node = self.root
+        depth = 0
+        for segment in split_path(path):
+            child = node.get(strip_index(segment))
+            if child is None:
+                break
+            node = child
+            depth += 1
+        return depth, node
+
+    def __contains__(self, path) -> bool:
+        segments = split_path(path)
+        depth, node = self.walk(segments)
+        return depth == len(segments) and TERMINAL in node
+
+    def __len__(self) -> int:
+        return self.size
+
+    def deepest_prefix(self, path) -> list:
+        '''
+        A function to return the longest leading part of a path that exists in the standard.
+        For a false path this shows where it stops matching the standard
+
+        :param path: The path as a dotted string or a list of segments
+        :return: :list: The matching leading segments, without indexes
+        '''
+        segments = split_path(path)
+        depth, node = self.walk(segments)
+        return [strip_index(segment) for segment in segments[:depth]]
+
+
+# compiled standard binary layout (all integers little endian unsigned 32 bit):
+#   header         magic, version, segment count (S), path count (P)
+#   string offsets S + 1 byte offsets into the string table
+#   path offsets   P + 1 offsets into the path data, counted in segment ids
+#   string table   the sorted, de-duplicated utf-8 segments back to back
+#   path data      each path as a run of segment ids, paths sorted by id sequence
+COMPILED_MAGIC = b'RSSI'
+COMPILED_VERSION = 1
+COMPILED_HEADER = struct.Struct('<4sIII')
+
+
+def compile_standard(standard_paths) -> bytes:
+    '''
+    A function to compile a list of standard paths into the binary format read by CompiledStandardView.
+    Paths are lowercased as they are when added to a StandardIndex
+
+    :param standard_paths: The standard paths as dotted strings or lists of segments
+    :return: :bytes:
+    '''
+    paths = {tuple(segment.lower() for segment in split_path(path)) for path in standard_paths}
+    segments = sorted({segment for path in paths for segment in path})
+    segment_ids = {segment: index for index, segment in enumerate(segments)}
+
+    # ids follow string order, so sorting by id sequence sorts the paths lexicographically
+    id_paths = sorted(tuple(segment_ids[segment] for segment in path) for path in paths)
+
+    string_offsets = array('I', [0])
+    string_table = bytearray()
+    for segment in segments:
+        string_table += segment.encode('utf-8')
+        string_offsets.append(len(string_table))
+
+    path_offsets = array('I', [0])
+    path_data = array('I')
+    for id_path in id_paths:
+        path_data.extend(id_path)
+        path_offsets.append(len(path_data))
+
+    if sys.byteorder != 'little':
+        for values in (string_offsets, path_offsets, path_data):
+            values.byteswap()
+
+    return b''.join([
+        COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, len(segments), len(id_paths)),
+        string_offsets.tobytes(),
+        path_offsets.tobytes(),
+        path_data.tobytes(),
+        bytes(string_table)
+    ])
+
+
+def uint_view(buffer, start: int, count: int):
+    '''
+    A function to view count unsigned 32 bit integers of a buffer without copying where possible
+
+    :param buffer: The buffer (bytes or mmap)
+    :param start: The byte offset of the first integer
+    :param count: The number of integers
+    :return: A sequence of ints
+    '''
+    view = memoryview(buffer)[start:start + count * 4]
+    if sys.byteorder == 'little':
+        return view.cast('I')
+    values = array('I', view.tobytes())
+    values.byteswap()
+    return values
+
+
+class CompiledStandardView:
+    '''
+    A read only view over a compiled standard (see compile_standard).
+    Membership is answered by binary search over the string table and the sorted paths,
+    so the standard can be memory-mapped and queried without decoding it into Python lists.
+    Supports the same lookups as StandardIndex.
+
+    :param buffer: The compiled standard as bytes or an mmap
+    '''
+    def __init__(self, buffer):
+        magic, version, segment_count, path_count = COMPILED_HEADER.unpack_from(buffer, 0)
+        if magic != COMPILED_MAGIC or version != COMPILED_VERSION:
+            raise ValueError('Not a compiled standard')
+
+        self.buffer = buffer
+        self.segment_count = segment_count
+        self.path_count = path_count
+
+        position = COMPILED_HEADER.size
+        self.string_offsets = uint_view(buffer, position, segment_count + 1)
+        position += (segment_count + 1) * 4
+        self.path_offsets = uint_view(buffer, position, path_count + 1)
+        position += (path_count + 1) * 4
+        path_data_length = self.path_offsets[path_count]
+        self.path_data = uint_view(buffer, position, path_data_length)
+        position += path_data_length * 4
+        self.string_table = memoryview(buffer)[position:]
+
+    def segment(self, segment_id: int) -> str:
+        return str(self.string_table[self.string_offsets[segment_id]:self.string_offsets[segment_id + 1]], 'utf-8')
+
+    def segment_id(self, segment: str) -> int:
+        '''
+        A function to find the id of a segment in the string table
+
+        :param segment: The segment to look up
+        :return: :int: The id, or -1 if the segment is not in the standard
+        '''
+        low, high = 0, self.segment_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.segment(middle) < segment:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.segment_count and self.segment(low) == segment:
+            return low
+        return -1
+
+    def path_ids(self, index: int):
+        return self.path_data[self.path_offsets[index]:self.path_offsets[index + 1]]
+
+    def lower_bound(self, ids: list) -> int:
+        low, high = 0, self.path_count
+        while low < high:
+            middle = (low + high) // 2
+            if list(self.path_ids(middle)) < ids:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup_ids(self, path) -> list:
+        ids = []
+        for segment in split_path(path):
+            segment_id = self.segment_id(strip_index(segment))
+            if segment_id == -1:
+                break
+            ids.append(segment_id)
+        return ids
+
+    def __contains__(self, path) -> bool:
+        segments = split_path(path)
+        ids = self.lookup_ids(segments)
+        if len(ids) != len(segments):
+            return False
+        index = self.lower_bound(ids)
+        return index < self.path_count and list(self.path_ids(index)) == ids
+
+    def __len__(self) -> int:
+        return self.path_count
+
+    def __iter__(self):
+        for index in range(self.path_count):
+            yield [self.segment(segment_id) for segment_id in self.path_ids(index)]
+
+    def deepest_prefix(self, path) -> list:
+        '''
+        A function to return the longest leading part of a path that exists in the standard
+
+        :param path: The path as a dotted string or a list of segments
+        :return: :list: The matching leading segments, without indexes
+        '''
+        ids = self.lookup_ids(path)
+        while ids:
+            # a prefix exists if the first path sorted at or after it starts with it
+            index = self.lower_bound(ids)
+            if index < self.path_count and list(self.path_ids(index)[:len(ids)]) == ids:
+                break
+            ids.pop()
+        return [self.segment(segment_id) for segment_id in ids]
+
+
+def open_compiled_standard(file_path: str) -> CompiledStandardView:
+    '''
+    A function to memory-map a compiled standard file
+
+    :param file_path: The path to the compiled standard
+    :return: :CompiledStandardView:
+    '''
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError('Not a compiled standard')
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return CompiledStandardView(buffer)
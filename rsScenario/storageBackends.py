@@ -0,0 +1,615 @@
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import gzip
+import io
+import itertools
+import os
+import random
+import tempfile
+import threading
+import time
+from stat import S_ISREG
+
+
+class NotFound(Exception):
+    def __init__(self, name):
+        self.name = name
+        self.message = f"{name} not found"
+        super().__init__(self.message)
+
+
+class PreconditionFailed(Exception):
+    def __init__(self, name):
+        self.name = name
+        self.message = f"{name} was changed by another writer"
+        super().__init__(self.message)
+
+
+class BulkOperationError(Exception):
+    def __init__(self, description, failures):
+        self.failures = failures
+        self.message = f"{description} failed for {len(failures)} objects: " + ', '.join(f'{name} ({error})' for name, error in list(failures.items())[:10])
+        super().__init__(self.message)
+
+
+# bulk operations send this many requests per batch, with this many batches in flight
+BULK_BATCH_SIZE = 100
+BULK_WORKERS = 8
+
+# attempts per object, waiting BULK_RETRY_DELAY seconds doubled on each retry
+BULK_ATTEMPTS = 3
+BULK_RETRY_DELAY = 0.5
+
+# attempts of a read-modify-write before giving up to other writers
+UPDATE_ATTEMPTS = 10
+
+
+def print_progress(description: str, every: int = 500):
+    '''
+    A function to make a progress callback for bulk operations that prints every so many objects
+
+    :param description: What is being done, e.g. Copying project
+    :param every: The number of objects between prints
+    :return: A callable taking the done and total counts
+    '''
+    printed = [0]
+
+    def progress(done: int, total: int) -> None:
+        # batches finish out of order, so print when a new multiple of every is passed
+        if done == total or done // every > printed[0] // every:
+            printed[0] = done
+            print(f"{description}: {done}/{total}")
+    return progress
+
+
+# what list and stat return for an object, generation changes whenever the object is rewritten
+ObjectInfo = namedtuple('ObjectInfo', ['name', 'size', 'generation', 'updated'])
+
+
+class StorageBackend(ABC):
+    '''
+    The storage interface used by ScenarioTool. Objects are addressed by '/' separated names
+    as they are in a bucket, and every backend raises NotFound for a missing object.
+    Backends implement get, put, stat, list, copy and delete, the rest have defaults built on those.
+    A backend missing any of them cannot be created.
+    '''
+    @abstractmethod
+    def get(self, name: str, generation=None) -> bytes:
+        '''
+        A function to return the contents of an object
+
+        :param name: The object name
+        :param generation: The generation to read, or None for the current one
+        :return: :bytes:
+        '''
+        raise NotImplementedError
+
+    @abstractmethod
+    def put(self, name: str, data, content_type: str = None, content_encoding: str = None, if_generation_match=None) -> None:
+        '''
+        A function to create or replace an object
+
+        :param name: The object name
+        :param data: The contents as bytes or str
+        :param content_type: The content type to store with the object
+        :param content_encoding: The encoding the contents are in (e.g. gzip), readers get the decoded contents
+        :param if_generation_match: Only write if this is the current generation (0 if the object must not exist), else raise PreconditionFailed
+        :return: None
+        '''
+        raise NotImplementedError
+
+    @abstractmethod
+    def stat(self, name: str) -> ObjectInfo:
+        '''
+        A function to return the size and generation of an object
+
+        :param name: The object name
+        :return: The ObjectInfo, or None if the object does not exist
+        '''
+        raise NotImplementedError
+
+    @abstractmethod
+    def list(self, prefix: str = ''):
+        '''
+        A function to list the objects whose names start with a prefix, in name order
+
+        :param prefix: The name prefix
+        :return: An iterable of ObjectInfo
+        '''
+        raise NotImplementedError
+
+    def list_prefixes(self, prefix: str = '') -> list:
+        '''
+        A function to list the folders directly under a prefix, without listing the objects in them
+
+        :param prefix: The folder prefix, ending in /
+        :return: :list: The folder prefixes (each ending in /) in name order
+        '''
+        prefixes = set()
+        for info in self.list(prefix):
+            folder, delimiter, rest = info.name[len(prefix):].partition('/')
+            if delimiter:
+                prefixes.add(f'{prefix}{folder}/')
+        return sorted(prefixes)
+
+    @abstractmethod
+    def copy(self, name: str, new_name: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, name: str) -> None:
+        raise NotImplementedError
+
+    def generation(self, name: str):
+        info = self.stat(name)
+        return None if info is None else info.generation
+
+    def exists(self, name: str) -> bool:
+        return self.stat(name) is not None
+
+    def put_file(self, name: str, file_path: str, content_type: str = None) -> None:
+        with open(file_path, 'rb') as f:
+            self.put(name, f.read(), content_type)
+
+    def put_stream(self, name: str, stream, content_type: str = None) -> None:
+        self.put(name, stream.read(), content_type)
+
+    def download_to_file(self, name: str, file, generation=None) -> None:
+        file.write(self.get(name, generation))
+
+    def open(self, name: str):
+        '''
+        A function to open an object for streaming reads
+
+        :param name: The object name
+        :return: A binary stream, usable as a context manager
+        '''
+        return io.BytesIO(self.get(name))
+
+    def url(self, name: str) -> str:
+        return name
+
+    def delete_batch(self, names: list) -> dict:
+        '''
+        A function to delete a batch of objects. Objects that are already gone count as deleted
+
+        :param names: The object names
+        :return: :dict: The names that failed and their errors
+        '''
+        failures = {}
+        for name in names:
+            try:
+                self.delete(name)
+            except NotFound:
+                pass
+            except Exception as e:
+                failures[name] = e
+        return failures
+
+    def copy_batch(self, pairs: list) -> dict:
+        '''
+        A function to copy a batch of objects
+
+        :param pairs: The source and destination names
+        :return: :dict: The source names that failed and their errors
+        '''
+        failures = {}
+        for name, new_name in pairs:
+            try:
+                self.copy(name, new_name)
+            except Exception as e:
+                failures[name] = e
+        return failures
+
+    def delete_many(self, names, progress=None, workers: int = BULK_WORKERS, batch_size: int = BULK_BATCH_SIZE) -> int:
+        '''
+        A function to delete many objects in concurrent batches, retrying failures
+
+        :param names: The object names
+        :param progress: A callable taking the done and total counts, called as batches finish
+        :param workers: The number of batches in flight
+        :param batch_size: The number of objects per batch
+        :return: :int: The number of objects deleted
+        '''
+        return run_bulk(self.delete_batch, [name for name in names], lambda name: name, 'Delete', progress, workers, batch_size)
+
+    def copy_many(self, pairs, progress=None, workers: int = BULK_WORKERS, batch_size: int = BULK_BATCH_SIZE) -> int:
+        '''
+        A function to copy many objects in concurrent batches, retrying failures
+
+        :param pairs: The source and destination names
+        :param progress: A callable taking the done and total counts, called as batches finish
+        :param workers: The number of batches in flight
+        :param batch_size: The number of objects per batch
+        :return: :int: The number of objects copied
+        '''
+        return run_bulk(self.copy_batch, [tuple(pair) for pair in pairs], lambda pair: pair[0], 'Copy', progress, workers, batch_size)
+
+
+def run_bulk(run_batch, items: list, item_name, description: str, progress, workers: int, batch_size: int) -> int:
+    '''
+    A function to run a batched operation over many items on a thread pool.
+    Failed items are retried with backoff in later batches, and anything still failing after
+    BULK_ATTEMPTS is raised together as a BulkOperationError once every other item is done
+
+    :param run_batch: A callable running one batch and returning the failures keyed by item name
+    :param items: The items
+    :param item_name: A callable returning the name of an item
+    :param description: The name of the operation for errors
+    :param progress: A callable taking the done and total counts, or None
+    :param workers: The number of batches in flight
+    :param batch_size: The number of items per batch
+    :return: :int: The number of items done
+    '''
+    total = len(items)
+    done = 0
+    failures = {}
+    lock = threading.Lock()
+
+    def run(batch: list) -> None:
+        nonlocal done
+        for attempt in range(BULK_ATTEMPTS):
+            if attempt:
+                time.sleep(BULK_RETRY_DELAY * 2 ** (attempt - 1))
+            errors = run_batch(batch)
+            with lock:
+                done += len(batch) - len(errors)
+                if progress is not None:
+                    progress(done, total)
+            batch = [item for item in batch if item_name(item) in errors]
+            if not batch:
+                return
+        with lock:
+            for item in batch:
+                failures[item_name(item)] = errors[item_name(item)]
+
+    batches = [items[start:start + batch_size] for start in range(0, total, batch_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run, batches))
+
+    if failures:
+        raise BulkOperationError(description, failures)
+    return done
+
+
+def generation_of(info: ObjectInfo):
+    # 0 stands for a missing object, as in gcs preconditions
+    return 0 if info is None else info.generation
+
+
+def update_object(storage: StorageBackend, name: str, update, content_type: str = None, attempts: int = UPDATE_ATTEMPTS) -> bytes:
+    '''
+    A function to read an object, change it and write it back only if no other writer has replaced it
+    in between, reading and changing it again if one has
+
+    :param storage: The storage backend
+    :param name: The object name
+    :param update: A callable taking the current contents (None if the object does not exist) and returning the new contents
+    :param content_type: The content type to store with the object
+    :param attempts: The number of times to try before raising PreconditionFailed
+    :return: :bytes: The contents written
+    '''
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(random.uniform(0, BULK_RETRY_DELAY * 2 ** min(attempt - 1, 4)))
+        info = storage.stat(name)
+        try:
+            data = None if info is None else storage.get(name, generation=info.generation)
+        except NotFound:
+            # replaced or deleted since the stat
+            continue
+        new_data = to_bytes(update(data))
+        try:
+            storage.put(name, new_data, content_type, if_generation_match=generation_of(info))
+            return new_data
+        except PreconditionFailed:
+            pass
+    raise PreconditionFailed(name)
+
+
+def to_bytes(data) -> bytes:
+    return data.encode('utf-8') if isinstance(data, str) else bytes(data)
+
+
+def decode(data, content_encoding: str = None) -> bytes:
+    # for backends that cannot record an encoding, so store the decoded contents
+    data = to_bytes(data)
+    return gzip.decompress(data) if content_encoding == 'gzip' else data
+
+
+class InMemoryBackend(StorageBackend):
+    '''
+    A storage backend that keeps every object in a dict, for tests and offline benchmarks
+    '''
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.generations = itertools.count(1)
+
+    def get(self, name: str, generation=None) -> bytes:
+        with self.lock:
+            entry = self.objects.get(name)
+        if entry is None or (generation is not None and entry[1].generation != generation):
+            raise NotFound(name)
+        return entry[0]
+
+    def put(self, name: str, data, content_type: str = None, content_encoding: str = None, if_generation_match=None) -> None:
+        data = decode(data, content_encoding)
+        with self.lock:
+            if if_generation_match is not None and generation_of(self.objects.get(name, (None, None))[1]) != if_generation_match:
+                raise PreconditionFailed(name)
+            self.objects[name] = (data, ObjectInfo(name, len(data), next(self.generations), datetime.now(timezone.utc)))
+
+    def stat(self, name: str) -> ObjectInfo:
+        with self.lock:
+            entry = self.objects.get(name)
+        return None if entry is None else entry[1]
+
+    def list(self, prefix: str = ''):
+        with self.lock:
+            infos = [entry[1] for name, entry in self.objects.items() if name.startswith(prefix)]
+        return sorted(infos, key=lambda info: info.name)
+
+    def copy(self, name: str, new_name: str) -> None:
+        self.put(new_name, self.get(name))
+
+    def delete(self, name: str) -> None:
+        with self.lock:
+            if self.objects.pop(name, None) is None:
+                raise NotFound(name)
+
+    def url(self, name: str) -> str:
+        return f'memory://{name}'
+
+
+# file that stands in for an object whose name ends in '/', e.g. a folder placeholder
+DIRECTORY_MARKER = '.rsdir'
+
+
+class LocalDirectoryBackend(StorageBackend):
+    '''
+    A storage backend that keeps objects as files under a local directory, so a project can be
+    validated and compiled at disk speed. Writes are atomic and the generation of an object is
+    taken from the inode, modification time and size of its file, which all change on a rewrite.
+
+    :param root: The directory to keep objects in
+    '''
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        
+        # conditional writes check and replace under this lock, so they only exclude writers in this process
+        self.lock = threading.Lock()
+
+    def path(self, name: str) -> str:
+        if name.endswith('/') or name == '':
+            name = name + DIRECTORY_MARKER
+        path = os.path.abspath(os.path.join(self.root, *name.split('/')))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Object name '{name}' is outside the storage root")
+        return path
+
+    def name(self, path: str) -> str:
+        name = os.path.relpath(path, self.root).replace(os.sep, '/')
+        if name == DIRECTORY_MARKER or name.endswith('/' + DIRECTORY_MARKER):
+            name = name[:-len(DIRECTORY_MARKER)]
+        return name
+
+    def info(self, name: str, stat) -> ObjectInfo:
+        return ObjectInfo(name, stat.st_size, f'{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}', datetime.fromtimestamp(stat.st_mtime, timezone.utc))
+
+    def get(self, name: str, generation=None) -> bytes:
+        try:
+            with open(self.path(name), 'rb') as f:
+                if generation is not None and self.info(name, os.fstat(f.fileno())).generation != generation:
+                    raise NotFound(name)
+                return f.read()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise NotFound(name)
+
+    def put(self, name: str, data, content_type: str = None, content_encoding: str = None, if_generation_match=None) -> None:
+        stream = io.BytesIO(decode(data, content_encoding))
+        if if_generation_match is None:
+            self.put_stream(name, stream, content_type)
+            return
+        with self.lock:
+            if generation_of(self.stat(name)) != if_generation_match:
+                raise PreconditionFailed(name)
+            self.put_stream(name, stream, content_type)
+
+    def put_stream(self, name: str, stream, content_type: str = None) -> None:
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file first so readers never see a partial object
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(to_bytes(chunk))
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_file(self, name: str, file_path: str, content_type: str = None) -> None:
+        with open(file_path, 'rb') as f:
+            self.put_stream(name, f, content_type)
+
+    def stat(self, name: str) -> ObjectInfo:
+        try:
+            stat = os.stat(self.path(name))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        # a directory holds other objects, it is not an object itself
+        return self.info(name, stat) if S_ISREG(stat.st_mode) else None
+
+    def list(self, prefix: str = ''):
+        # only walk the deepest directory the prefix names
+        base = os.path.join(self.root, *prefix.split('/')[:-1])
+        infos = []
+        for directory, dirs, files in os.walk(base):
+            for file_name in files:
+                if file_name.startswith('.tmp-'):
+                    continue
+                path = os.path.join(directory, file_name)
+                name = self.name(path)
+                if name.startswith(prefix):
+                    try:
+                        infos.append(self.info(name, os.stat(path)))
+                    except FileNotFoundError:
+                        pass
+        return sorted(infos, key=lambda info: info.name)
+
+    def holds_objects(self, directory: str) -> bool:
+        # deleting objects leaves their directories behind, which are not folders in object storage
+        for path, dirs, files in os.walk(directory):
+            if any(not file_name.startswith('.tmp-') for file_name in files):
+                return True
+        return False
+
+    def list_prefixes(self, prefix: str = '') -> list:
+        base = os.path.join(self.root, *prefix.split('/')[:-1])
+        try:
+            entries = [entry.name for entry in os.scandir(base) if entry.is_dir() and self.holds_objects(entry.path)]
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        folder_start = prefix.split('/')[-1]
+        return sorted(f'{prefix[:len(prefix) - len(folder_start)]}{entry}/' for entry in entries if entry.startswith(folder_start))
+
+    def copy(self, name: str, new_name: str) -> None:
+        try:
+            f = open(self.path(name), 'rb')
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise NotFound(name)
+        with f:
+            self.put_stream(new_name, f)
+
+    def delete(self, name: str) -> None:
+        try:
+            os.remove(self.path(name))
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise NotFound(name)
+
+    @contextmanager
+    def open(self, name: str):
+        try:
+            f = open(self.path(name), 'rb')
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise NotFound(name)
+        with f:
+            yield f
+
+    def url(self, name: str) -> str:
+        return os.path.join(self.root, *name.split('/'))
+
+
+class GCSBackend(StorageBackend):
+    '''
+    A storage backend over a Google Cloud Storage bucket
+
+    :param bucket_name: The name of the bucket
+    :param client: A storage client, one is created if not given
+    '''
+    def __init__(self, bucket_name: str, client=None):
+        from google.cloud import storage
+        from google.cloud.exceptions import NotFound as GCSNotFound
+        from google.api_core.exceptions import PreconditionFailed as GCSPreconditionFailed
+
+        self.not_found = GCSNotFound
+        self.precondition_failed = GCSPreconditionFailed
+        self.client = client or storage.Client()
+        self.bucket_name = bucket_name
+        self.bucket = self.client.bucket(bucket_name)
+
+    @contextmanager
+    def translate_not_found(self, name: str):
+        try:
+            yield
+        except self.not_found:
+            raise NotFound(name)
+
+    def info(self, blob) -> ObjectInfo:
+        return ObjectInfo(blob.name, blob.size, blob.generation, blob.updated)
+
+    def get(self, name: str, generation=None) -> bytes:
+        with self.translate_not_found(name):
+            return self.bucket.blob(name, generation=generation).download_as_bytes()
+
+    def put(self, name: str, data, content_type: str = None, content_encoding: str = None, if_generation_match=None) -> None:
+        # gcs serves the object with its content encoding, or decodes it for clients that do not accept it
+        blob = self.bucket.blob(name)
+        blob.content_encoding = content_encoding
+        try:
+            blob.upload_from_string(data, content_type=content_type or 'text/plain', if_generation_match=if_generation_match)
+        except self.precondition_failed:
+            raise PreconditionFailed(name)
+
+    def put_file(self, name: str, file_path: str, content_type: str = None) -> None:
+        self.bucket.blob(name).upload_from_filename(file_path, content_type=content_type)
+
+    def put_stream(self, name: str, stream, content_type: str = None) -> None:
+        self.bucket.blob(name).upload_from_file(stream, content_type=content_type)
+
+    def download_to_file(self, name: str, file, generation=None) -> None:
+        with self.translate_not_found(name):
+            self.bucket.blob(name, generation=generation).download_to_file(file)
+
+    def stat(self, name: str) -> ObjectInfo:
+        blob = self.bucket.get_blob(name)
+        return None if blob is None else self.info(blob)
+
+    def list(self, prefix: str = ''):
+        return (self.info(blob) for blob in self.bucket.list_blobs(prefix=prefix))
+
+    def list_prefixes(self, prefix: str = '') -> list:
+        # a delimited listing returns the folders instead of the objects in them
+        blobs = self.bucket.list_blobs(prefix=prefix, delimiter='/')
+        for page in blobs.pages:
+            pass
+        return sorted(blobs.prefixes)
+
+    def copy(self, name: str, new_name: str) -> None:
+        with self.translate_not_found(name):
+            self.bucket.copy_blob(self.bucket.blob(name), self.bucket, new_name)
+
+    def delete(self, name: str) -> None:
+        with self.translate_not_found(name):
+            self.bucket.delete_blob(name)
+
+    @contextmanager
+    def open(self, name: str):
+        # reads are lazy, so a missing blob can surface inside the with block
+        with self.translate_not_found(name):
+            with self.bucket.blob(name).open('rb') as stream:
+                yield stream
+
+    def url(self, name: str) -> str:
+        return f'gs://{self.bucket_name}/{name}'
+
+    def delete_batch(self, names: list) -> dict:
+        # send the whole batch as one batched request, falling back to single requests to find what failed
+        try:
+            with self.client.batch():
+                for name in names:
+                    self.bucket.delete_blob(name)
+            return {}
+        except Exception:
+            return super().delete_batch(names)
+
+    def copy_batch(self, pairs: list) -> dict:
+        try:
+            with self.client.batch():
+                for name, new_name in pairs:
+                    self.bucket.copy_blob(self.bucket.blob(name), self.bucket, new_name)
+            return {}
+        except Exception:
+            return super().copy_batch(pairs)
@@ -1,7 +1,11 @@
 import json
 import os
 import shutil
-from google.cloud import storage
+import storageBackends as sb
+import sharedResources as shared
+
+# the bucket the site helpers use when no storage backend is given
+DEFAULT_BUCKET = 'sites.ramseysystems.co.uk'
 
 def clear_dir(folder_path: str):
     if not folder_path.startswith('/tmp'):
@@ -53,13 +57,13 @@ def clear_and_replace(src_dir, dest_dir):
 
 def template_env(template_path):
     '''
-    A function to create a jinja2 template environment
+    A function to return the jinja2 template environment of a template folder
+    The environment is shared by the process so each template is only compiled once
     
     :param template_path: The path to the template folder
     :return: The jinja2 template environment
     '''
-    from jinja2 import Environment, FileSystemLoader
-    return Environment(loader=FileSystemLoader(template_path))
+    return shared.template_env(template_path)
 
 
 def render_template(template_name: str, data: dict, save_dir: str, name: str = None) -> None:
@@ -75,10 +79,9 @@ def render_template(template_name: str, data: dict, save_dir: str, name: str = N
     ## test code
     this_file_dir = os.path.dirname(os.path.abspath(__file__))
     parent_dir = this_file_dir[:this_file_dir.rfind('/')]
-    tempalte_path = os.path.join(parent_dir, 'templates')
     full_save_dir = os.path.join(parent_dir, save_dir)
     
-    template = template_env(tempalte_path).get_template(template_name)
+    template = template_env(shared.TEMPLATE_DIR).get_template(template_name)
     
     if name:
         output = template.render(data=data, name=name)
@@ -123,10 +126,16 @@ def load_obj_from_file(load_path):
         obj = json.load(f)
     return obj
 
-def upload_tree_to_gcs(source_dir, destination_prefix=''):
-    # Set up Google Cloud Storage client
-    client = storage.Client()
-    bucket = client.bucket('sites.ramseysystems.co.uk')
+def upload_tree_to_gcs(source_dir, destination_prefix='', storage_backend: sb.StorageBackend = None):
+    '''
+    A function to upload a directory tree to storage, skipping build and package files
+    
+    :param source_dir: The local directory to upload
+    :param destination_prefix: The prefix to upload the tree under
+    :param storage_backend: The storage to upload to, the site bucket if None
+    :return: None
+    '''
+    storage = storage_backend if storage_backend is not None else shared.storage_backend(DEFAULT_BUCKET)
     
     # Walk through the source directory and upload files
     for root, dirs, files in os.walk(source_dir):
@@ -150,40 +159,37 @@ def upload_tree_to_gcs(source_dir, destination_prefix=''):
             local_path = os.path.join(root, file)
             remote_path = os.path.join(destination_prefix, os.path.relpath(local_path, source_dir))
             
-            blob = bucket.blob(remote_path)
-            blob.upload_from_filename(local_path)
+            storage.put_file(remote_path, local_path)
             
-            print(f'Uploaded: {local_path} -> gs://sites.ramseysystems.co.uk/{remote_path}')
+            print(f'Uploaded: {local_path} -> {storage.url(remote_path)}')
             
         for dir in dirs:
             local_path = os.path.join(root, dir)
             remote_path = os.path.join(destination_prefix, os.path.relpath(local_path, source_dir))
             
-            blob = bucket.blob(os.path.join(remote_path, ''))  # Create a "dummy" directory blob
-            blob.upload_from_string('')
+            storage.put(os.path.join(remote_path, ''), '')  # Create a "dummy" directory blob
             
-            print(f'Uploaded directory: {local_path} -> gs://sites.ramseysystems.co.uk/{remote_path}/')
+            print(f'Uploaded directory: {local_path} -> {storage.url(remote_path)}/')
             
-def clear_storage_bucket(folder_path):
-    # Initialize the GCS client
-    client = storage.Client()
-
-    # Get the bucket
-    bucket = client.get_bucket('sites.ramseysystems.co.uk')
+def clear_storage_bucket(folder_path, storage_backend: sb.StorageBackend = None):
+    '''
+    A function to delete everything in a storage folder and leave an empty folder placeholder
+    
+    :param folder_path: The folder prefix to clear
+    :param storage_backend: The storage to clear, the site bucket if None
+    :return: None
+    '''
+    storage = storage_backend if storage_backend is not None else shared.storage_backend(DEFAULT_BUCKET)
 
     # List objects in the specified folder
-    objects_to_delete = bucket.list_blobs(prefix=folder_path)
+    objects_to_delete = list(storage.list(prefix=folder_path))
 
-    # Delete each object in the folder
-    for blob in objects_to_delete:
-        blob.delete()
+    # Delete the objects in concurrent batches
+    storage.delete_many([blob.name for blob in objects_to_delete], progress=sb.print_progress(f'Clearing {folder_path}'))
 
-    print(f"All objects in '{folder_path}' folder of 'sites.ramseysystems.co.uk' bucket have been deleted.")
+    print(f"All objects in '{storage.url(folder_path)}' have been deleted.")
 
-    # Check if the folder is empty
-    if not bucket.list_blobs(prefix=folder_path).max_results:
-        # Create the folder blob
-        folder_blob = bucket.blob(folder_path)
-        folder_blob.upload_from_string("")  # Upload an empty string to create the folder
+    # Create the folder blob
+    storage.put(folder_path, "")  # Upload an empty string to create the folder
 
-        print(f"Folder '{folder_path}' created in 'sites.ramseysystems.co.uk' bucket.")
\ No newline at end of file
+    print(f"Folder '{storage.url(folder_path)}' created.")
\ No newline at end of file
@@ -0,0 +1,36 @@
+import importlib
+import importlib.abc
+import importlib.util
+import os
+import sys
+
+# the package modules import each other by flat name (import storageBackends as sb), so the
+# package folder goes on the path, and rsScenario.<name> is loaded as that same flat module so
+# the tests and the code share one copy of each module (and of its exception classes)
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rsScenario')
+sys.path.append(PACKAGE_DIR)
+
+
+class FlatModuleLoader(importlib.abc.Loader):
+    def __init__(self, module):
+        self.module = module
+
+    def create_module(self, spec):
+        return self.module
+
+    def exec_module(self, module):
+        pass
+
+
+class FlatModuleFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        package, dot, name = fullname.partition('.')
+        # rsScenario.rsScenario would clash with the package name, so it is imported normally
+        if package != 'rsScenario' or not dot or '.' in name or name == 'rsScenario':
+            return None
+        if not os.path.isfile(os.path.join(PACKAGE_DIR, f'{name}.py')):
+            return None
+        return importlib.util.spec_from_loader(fullname, FlatModuleLoader(importlib.import_module(name)))
+
+
+sys.meta_path.insert(0, FlatModuleFinder())
@@ -0,0 +1,36 @@
+from rsScenario.buildManifest import BuildManifest, input_digest
+
+import unittest
+
+class TestBuildManifest(unittest.TestCase):
+    def test_input_digest(self):
+
+        # test that digests follow the inputs and not their key order
+        self.assertEqual(input_digest('story.html', {'a': 1, 'b': 2}), input_digest('story.html', {'b': 2, 'a': 1}))
+        self.assertNotEqual(input_digest('story.html', {'a': 1}), input_digest('story.html', {'a': 2}))
+        self.assertNotEqual(input_digest('ab', 'c'), input_digest('a', 'bc'))
+        
+    def test_source_outputs(self):
+
+        # test that a source's outputs are only returned while it is unchanged
+        manifest = BuildManifest()
+        manifest.set_source('bob.storylog.json', 'v1', ['website/Stories/bob_story.html'])
+        self.assertEqual(manifest.source_outputs('bob.storylog.json', 'v1'), ['website/Stories/bob_story.html'])
+        self.assertIsNone(manifest.source_outputs('bob.storylog.json', 'v2'))
+        self.assertIsNone(manifest.source_outputs('amy.storylog.json', 'v1'))
+        
+    def test_retain_and_round_trip(self):
+
+        # test that removed sources and outputs are forgotten and the rest load back the same
+        manifest = BuildManifest()
+        manifest.set_output('website/a.html', 'x')
+        manifest.set_output('website/b.html', 'y')
+        manifest.set_source('bob.storylog.json', 'v1', ['website/a.html'])
+        manifest.set_source('amy.storylog.json', 'v1', ['website/b.html'])
+        manifest.retain(['bob.storylog.json'], ['website/a.html'])
+        
+        loaded = BuildManifest.from_json(manifest.to_json())
+        self.assertEqual(loaded.outputs, {'website/a.html': 'x'})
+        self.assertEqual(list(loaded.sources), ['bob.storylog.json'])
+        self.assertTrue(loaded.is_current('website/a.html', 'x'))
+        self.assertFalse(loaded.is_current('website/b.html', 'y'))
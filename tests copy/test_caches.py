@@ -0,0 +1,270 @@
+from rsScenario.caches import StandardCache, ContinuousDataCache, StandardIndexCache
+from rsScenario.storageBackends import InMemoryBackend, NotFound
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+class CountingBackend(InMemoryBackend):
+    '''
+    An InMemoryBackend that counts downloads, optionally taking a while over each
+    '''
+    def __init__(self, delay: float = 0):
+        super().__init__()
+        self.delay = delay
+        self.downloads = []
+
+    def get(self, name, generation=None):
+        self.downloads.append(name)
+        time.sleep(self.delay)
+        return super().get(name, generation)
+
+class TestStandardCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, 'cache')
+        self.storage = InMemoryBackend()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_file(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_key(self):
+
+        # test that the key follows the workbook bytes and the provenance paths
+        standard = self.make_file('standard.xlsx', b'workbook')
+        same = self.make_file('same.xlsx', b'workbook')
+        other = self.make_file('other.xlsx', b'other workbook')
+        key = StandardCache.key(standard, ['Event.time'])
+        self.assertEqual(StandardCache.key(same, ['Event.time']), key)
+        self.assertNotEqual(StandardCache.key(standard, ['Event.date']), key)
+        self.assertNotEqual(StandardCache.key(standard, []), key)
+        self.assertNotEqual(StandardCache.key(other, ['Event.time']), key)
+
+    def test_bucket_entries_are_promoted(self):
+
+        # test that an entry only in the bucket is returned and copied to the local tier
+        StandardCache(self.cache_dir, self.storage).put('k1', {'validation_paths': ['a']})
+        other_cache = StandardCache(os.path.join(self.directory.name, 'other'), self.storage)
+        self.assertFalse(os.path.exists(other_cache.local_path('k1')))
+        self.assertEqual(other_cache.get('k1'), {'validation_paths': ['a']})
+        self.assertTrue(os.path.exists(other_cache.local_path('k1')))
+
+        # the local copy is used once the bucket entry is gone
+        self.storage.delete(other_cache.blob_name('k1'))
+        self.assertEqual(other_cache.get('k1'), {'validation_paths': ['a']})
+        self.assertIsNone(other_cache.get('k2'))
+
+    def test_corrupt_entry_is_a_miss(self):
+
+        # test that a truncated local entry is removed and reported as a miss
+        cache = StandardCache(self.cache_dir)
+        cache.put('k1', {'validation_paths': ['a']})
+        with open(cache.local_path('k1'), 'wb') as f:
+            f.write(b'{"validation_pa')
+        self.assertIsNone(cache.get('k1'))
+        self.assertFalse(os.path.exists(cache.local_path('k1')))
+
+        cache.put('k1', {'validation_paths': ['b']})
+        self.assertEqual(cache.get('k1'), {'validation_paths': ['b']})
+
+    def test_local_eviction(self):
+
+        # test that the least recently used local entries are evicted first
+        cache = StandardCache(self.cache_dir, max_bytes=100)
+        for number, key in enumerate(['k1', 'k2', 'k3']):
+            cache.put(key, {'paths': 'x' * 20})
+            os.utime(cache.local_path(key), (1000 + number, 1000 + number))
+
+        # reading k1 makes k2 the least recently used
+        cache.get('k1')
+        cache.put('k4', {'paths': 'x' * 20})
+        self.assertIsNone(cache.get('k2'))
+        for key in ['k1', 'k3', 'k4']:
+            self.assertIsNotNone(cache.get(key))
+
+    def test_bucket_eviction(self):
+
+        # test that the oldest bucket entries are evicted past max_bucket_bytes
+        cache = StandardCache(self.cache_dir, self.storage, max_bucket_bytes=70)
+        for key in ['k1', 'k2', 'k3']:
+            cache.put(key, {'paths': 'x' * 20})
+        self.assertEqual([info.name for info in self.storage.list('_cache/standards/')], ['_cache/standards/k2.json', '_cache/standards/k3.json'])
+
+    def test_concurrent_writers(self):
+
+        # test that writers of the same key do not clash over a temporary file
+        cache = StandardCache(self.cache_dir)
+        errors = []
+
+        def write(number):
+            try:
+                for attempt in range(50):
+                    cache.write_local('k1', f'{{"writer": {number}}}'.encode('utf-8'))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertIn(cache.get('k1')['writer'], range(4))
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.startswith('.tmp-')], [])
+
+
+class TestContinuousDataCache(unittest.TestCase):
+    def setUp(self):
+        self.storage = CountingBackend()
+        for name in ['a.csv', 'b.csv', 'c.csv']:
+            self.storage.put(name, name[0] * 4)
+            
+    def test_hits(self):
+
+        # test that a cached blob is not downloaded again and a missing one raises NotFound
+        cache = ContinuousDataCache()
+        self.assertEqual(cache.get(self.storage, 'a.csv'), b'aaaa')
+        self.assertEqual(cache.get(self.storage, 'a.csv'), b'aaaa')
+        self.assertEqual(self.storage.downloads, ['a.csv'])
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'entries': 1, 'bytes': 4})
+        with self.assertRaises(NotFound):
+            cache.get(self.storage, 'missing.csv')
+            
+    def test_lru_eviction(self):
+
+        # test that the least recently used blob is evicted once max_bytes is passed
+        cache = ContinuousDataCache(max_bytes=8)
+        cache.get(self.storage, 'a.csv')
+        cache.get(self.storage, 'b.csv')
+        cache.get(self.storage, 'a.csv')
+        cache.get(self.storage, 'c.csv')
+        self.assertEqual(cache.stats()['bytes'], 8)
+        
+        # b was evicted, a was kept
+        cache.get(self.storage, 'a.csv')
+        cache.get(self.storage, 'b.csv')
+        self.assertEqual(self.storage.downloads, ['a.csv', 'b.csv', 'c.csv', 'b.csv'])
+        
+    def test_replaced_blob(self):
+
+        # test that a replaced blob is downloaded again and its old generation dropped
+        cache = ContinuousDataCache()
+        cache.get(self.storage, 'a.csv')
+        self.storage.put('a.csv', 'new a')
+        self.assertEqual(cache.get(self.storage, 'a.csv'), b'new a')
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 2, 'entries': 1, 'bytes': 5})
+        
+    def test_oversize_blob(self):
+
+        # test that a blob larger than the cache is returned but not cached
+        cache = ContinuousDataCache(max_bytes=3)
+        self.assertEqual(cache.get(self.storage, 'a.csv'), b'aaaa')
+        self.assertEqual(cache.get(self.storage, 'a.csv'), b'aaaa')
+        self.assertEqual(self.storage.downloads, ['a.csv', 'a.csv'])
+        self.assertEqual(cache.stats()['entries'], 0)
+        
+    def test_single_download(self):
+
+        # test that threads asking for the same blob at once share one download
+        storage = CountingBackend(delay=0.1)
+        storage.put('a.csv', 'aaaa')
+        cache = ContinuousDataCache()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(storage, 'a.csv'))) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [b'aaaa'] * 8)
+        self.assertEqual(storage.downloads, ['a.csv'])
+        self.assertEqual(cache.stats()['misses'], 1)
+        
+    def test_failed_download(self):
+
+        # test that a failed download is not cached and leaves nothing for later requests to wait on
+        cache = ContinuousDataCache()
+        storage = CountingBackend()
+        storage.put('a.csv', 'aaaa')
+        generation = storage.generation('a.csv')
+        storage.stat = lambda name: storage.list(name)[0]._replace(generation=generation + 1)
+        with self.assertRaises(NotFound):
+            cache.get(storage, 'a.csv')
+        self.assertEqual(cache.loading, {})
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+class TestStandardIndexCache(unittest.TestCase):
+    def setUp(self):
+        self.versions = {'diabetes': 1, 'asthma': 1}
+        self.version_checks = []
+        self.loads = []
+        self.cache = StandardIndexCache()
+        
+    def current_version(self, standard_name):
+        self.version_checks.append(standard_name)
+        return self.versions[standard_name]
+    
+    def load(self, standard_name, version):
+        self.loads.append((standard_name, version))
+        return {f'{standard_name}-{version}'}
+    
+    def get(self, standard_name):
+        return self.cache.get(standard_name, self.current_version, self.load)
+    
+    def test_pass_reuse(self):
+
+        # test that a standard's version is checked once per pass
+        self.cache.begin_pass()
+        for attempt in range(3):
+            self.assertEqual(self.get('diabetes'), {'diabetes-1'})
+        self.get('asthma')
+        self.assertEqual(self.version_checks, ['diabetes', 'asthma'])
+        self.assertEqual(self.loads, [('diabetes', 1), ('asthma', 1)])
+        self.cache.end_pass()
+        
+        # the next pass checks again and reloads only what changed
+        self.versions['diabetes'] = 2
+        self.cache.begin_pass()
+        self.assertEqual(self.get('diabetes'), {'diabetes-2'})
+        self.get('diabetes')
+        self.get('asthma')
+        self.cache.end_pass()
+        self.assertEqual(self.version_checks, ['diabetes', 'asthma', 'diabetes', 'asthma'])
+        self.assertEqual(self.loads, [('diabetes', 1), ('asthma', 1), ('diabetes', 2)])
+        self.assertEqual(self.cache.stats(), {'hits': 4, 'misses': 3, 'entries': 2})
+        
+    def test_outside_pass(self):
+
+        # test that outside a pass the version is checked every time and a new version is loaded
+        self.get('diabetes')
+        self.get('diabetes')
+        self.versions['diabetes'] = 2
+        self.assertEqual(self.get('diabetes'), {'diabetes-2'})
+        self.assertEqual(self.version_checks, ['diabetes'] * 3)
+        self.assertEqual(self.loads, [('diabetes', 1), ('diabetes', 2)])
+        
+    def test_invalidate(self):
+
+        # test that invalidated standards are loaded again, even within a pass
+        self.cache.begin_pass()
+        self.get('diabetes')
+        self.get('asthma')
+        self.cache.invalidate('diabetes')
+        self.get('diabetes')
+        self.get('asthma')
+        self.assertEqual(self.loads, [('diabetes', 1), ('asthma', 1), ('diabetes', 1)])
+        
+        self.cache.invalidate()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.get('asthma')
+        self.cache.end_pass()
+        self.assertEqual(self.loads[-1], ('asthma', 1))
+        self.assertEqual(len(self.loads), 4)
@@ -0,0 +1,43 @@
+from rsScenario.compileScheduler import CompileScheduler
+
+import unittest
+
+class TestCompileScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = CompileScheduler(debounce=0.1)
+        self.runs = []
+        
+    def compile(self, number, error=None):
+        def run():
+            self.runs.append(number)
+            if error is not None:
+                raise error
+            return {'number': number}
+        return run
+        
+    def test_burst_is_coalesced(self):
+
+        # test that requests for a project close together make one compile with the latest request
+        first = self.scheduler.submit('site/bob', self.compile(1))
+        second = self.scheduler.submit('site/bob', self.compile(2))
+        other = self.scheduler.submit('site/amy', self.compile(3))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(self.scheduler.status(first)['requests'], 2)
+        
+        self.assertEqual(self.scheduler.wait(first, timeout=5)['summary'], {'number': 2})
+        self.assertEqual(self.scheduler.wait(other, timeout=5)['status'], 'done')
+        self.assertEqual(sorted(self.runs), [2, 3])
+        
+    def test_failed_compile(self):
+
+        # test that a failed compile is reported and later compiles still run
+        failed = self.scheduler.submit('site/bob', self.compile(1, ValueError('bad template')))
+        status = self.scheduler.wait(failed, timeout=5)
+        self.assertEqual(status['status'], 'failed')
+        self.assertEqual(status['error'], 'ValueError: bad template')
+        
+        queued = self.scheduler.submit('site/bob', self.compile(2))
+        self.scheduler.flush(timeout=5)
+        self.assertEqual(self.scheduler.status(queued)['status'], 'done')
+        self.assertIsNone(self.scheduler.status('unknown'))
@@ -0,0 +1,55 @@
+from rsScenario.dependencyGraph import DependencyGraph
+
+import unittest
+
+class TestDependencyGraph(unittest.TestCase):
+    def make_graph(self):
+        graph = DependencyGraph()
+        graph.set_personae('bob.xlsx', ['diabetes'], ['glucose.csv'])
+        graph.set_personae('alice.xlsx', ['asthma'], [])
+        graph.set_standard('diabetes')
+        graph.set_standard('asthma')
+        return graph
+        
+    def test_affected_personae(self):
+
+        # test that each change only reaches the personae that use it
+        graph = self.make_graph()
+        self.assertEqual(graph.personae_using_standard('diabetes'), {'bob.xlsx'})
+        self.assertEqual(graph.personae_using_continuous_data('glucose.csv'), {'bob.xlsx'})
+        self.assertEqual(graph.personae_using_continuous_data('other.csv'), set())
+        self.assertEqual(graph.personae_using_provenance(), {'bob.xlsx', 'alice.xlsx'})
+        
+    def test_unknown_personae_are_included(self):
+
+        # test that personae without a record are revalidated and removed personae are not
+        graph = self.make_graph()
+        existing = ['alice.xlsx', 'carol.json']
+        self.assertEqual(graph.affected_personae(existing, graph.personae_using_standard('diabetes')), {'carol.json'})
+        
+    def test_json_round_trip(self):
+
+        # test that a saved graph loads back the same
+        graph = self.make_graph()
+        loaded = DependencyGraph.from_json(graph.to_json())
+        self.assertEqual(loaded.personae, graph.personae)
+        self.assertEqual(loaded.standards, graph.standards)
+        
+    def test_rebase(self):
+
+        # test that only the changes made since loading are applied to a newer saved graph
+        graph = DependencyGraph.from_json(self.make_graph().to_json())
+        graph.set_personae('carol.xlsx', ['asthma'], [])
+        graph.remove_personae('alice.xlsx')
+        graph.remove_standard('asthma')
+        
+        saved = self.make_graph()
+        saved.set_personae('bob.xlsx', ['diabetes'], ['insulin.csv'])
+        saved.set_personae('dave.xlsx', ['diabetes'], [])
+        saved.set_standard('copd')
+        
+        rebased = graph.rebase(saved)
+        self.assertEqual(sorted(rebased.personae), ['bob.xlsx', 'carol.xlsx', 'dave.xlsx'])
+        self.assertEqual(rebased.personae['bob.xlsx']['continuous_data'], {'insulin.csv'})
+        self.assertEqual(sorted(rebased.standards), ['copd', 'diabetes'])
+        self.assertEqual(sorted(saved.personae), ['alice.xlsx', 'bob.xlsx', 'dave.xlsx'])
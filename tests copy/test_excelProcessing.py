@@ -0,0 +1,423 @@
+from rsScenario import excelProcessing as ep
+
+from datetime import date, datetime, time
+
+import io
+import json
+import openpyxl
+import os
+import random
+import tempfile
+import unittest
+
+class TestBuildObject(unittest.TestCase):
+    def assert_same_as_create_object(self, paths):
+        self.assertEqual(ep.build_object(paths), ep.create_object(paths))
+        
+    def test_simple_paths(self):
+
+        # test nested objects and leaf values
+        self.assert_same_as_create_object([
+            [['patient', 'name', 'given'], 'bob'],
+            [['patient', 'name', 'family'], 'smith'],
+            [['patient', 'age'], 42],
+            [['encounter', 'date'], None]
+        ])
+        
+    def test_indexed_paths(self):
+
+        # test that [n] elements become lists in first-seen order
+        self.assert_same_as_create_object([
+            [['obs[2]', 'value'], 1],
+            [['obs[1]', 'value'], 2],
+            [['obs[2]', 'code'], 'a'],
+            [['patient', 'alias[0]'], 'x'],
+            [['patient', 'alias[1]'], 'y'],
+            [['patient', 'tag[]'], 'z'],
+            [['patient', 'tag[*]', 'code'], 'w']
+        ])
+        
+    def test_random_paths(self):
+
+        # test randomly generated well formed path lists
+        generator = random.Random(1234)
+        for _ in range(50):
+            seen = set()
+            paths = []
+            for _ in range(generator.randint(1, 60)):
+                depth = generator.randint(1, 5)
+                path = tuple(
+                    generator.choice(['a', 'b', 'c']) + generator.choice(['', '', '[0]', '[1]'])
+                    for _ in range(depth)
+                )
+                
+                # skip paths that would clash with a path already in the list
+                if any(path[:len(other)] == other or other[:len(path)] == path for other in seen):
+                    continue
+                seen.add(path)
+                paths.append([list(path), generator.randint(0, 9)])
+                
+            self.assert_same_as_create_object(paths)
+
+
+class TestHeaderIndex(unittest.TestCase):
+    def make_sheet(self, rows):
+        sheet = openpyxl.Workbook().active
+        sheet.title = 'Events'
+        for row in rows:
+            sheet.append(row)
+        return sheet
+        
+    def test_find(self):
+
+        # test that headings are found ignoring case and spaces, the first occurrence winning
+        sheet = self.make_sheet([
+            ['Story', None, ' Path '],
+            [None, 'Value', 'path']
+        ])
+        self.assertEqual(ep.find_cell_location(sheet, 'story'), (1, 1))
+        self.assertEqual(ep.find_cell_location(sheet, 'PATH'), (1, 3))
+        self.assertEqual(ep.find_cell_location(sheet, 'value '), (2, 2))
+        
+        # each read indexes the sheet again, so a heading written since is found
+        sheet.cell(row=1, column=2).value = 'Value'
+        self.assertEqual(ep.find_cell_location(sheet, 'value'), (1, 2))
+        
+    def test_missing_heading(self):
+
+        # test that a missing heading raises MissingHeadingsError naming the sheet
+        sheet = self.make_sheet([['Story']])
+        with self.assertRaises(ep.MissingHeadingsError) as context:
+            ep.find_cell_location(sheet, 'path')
+        self.assertIn('Events', context.exception.message)
+        
+    def test_band_limit(self):
+
+        # test that headings below the header band are found and no rows are added past the end of the sheet
+        sheet = self.make_sheet([[None]] * 4 + [['Late']] + [[None]] * 2 + [['Later', 'Late']])
+        index = ep.HeaderIndex(sheet, band_rows=5)
+        self.assertEqual(index.locations, {'late': (5, 1)})
+        self.assertEqual(index.find('later'), (8, 1))
+        self.assertEqual(index.find('late'), (5, 1))
+        with self.assertRaises(ep.MissingHeadingsError):
+            index.find('latest')
+        self.assertEqual(sheet.max_row, 8)
+            
+        short_sheet = self.make_sheet([['Story'], ['Path']])
+        with self.assertRaises(ep.MissingHeadingsError):
+            ep.HeaderIndex(short_sheet).find('value')
+        self.assertEqual(short_sheet.max_row, 2)
+
+
+class TestAliasResolver(unittest.TestCase):
+    def setUp(self):
+        wb = openpyxl.Workbook()
+        self.path_alias_sheet = wb.active
+        self.path_alias_sheet.title = 'Path Aliases'
+        for row in [
+            ['Path Alias Name', 'Value'],
+            ['$pat', 'patient.demographics'],
+            ['$nm', '$pat.name'],
+            ['$given', '$nm.given'],
+            ['$pat', 'ignored'],
+            ['$c1', '$c2.x'],
+            ['$c2', '$c1']
+        ]:
+            self.path_alias_sheet.append(row)
+            
+        self.group_alias_sheet = wb.create_sheet('Group Aliases')
+        for row in [
+            ['Group Alias Name', 'Path', 'Value'],
+            ['Addr', 'address.line', '1 Road'],
+            ['addr', 'address.postcode', 'AB1']
+        ]:
+            self.group_alias_sheet.append(row)
+        self.resolver = ep.AliasResolver(self.path_alias_sheet, self.group_alias_sheet)
+        
+    def test_nested_aliases(self):
+
+        # test that aliases made of other aliases expand fully, the first definition winning
+        self.assertEqual(self.resolver.expand_path_alias('$pat'), 'patient.demographics')
+        self.assertEqual(self.resolver.expand_path_alias('$given'), 'patient.demographics.name.given')
+        self.assertEqual(self.resolver.expand_split_path(['$nm', 'family']), ['patient.demographics.name', 'family'])
+        self.assertEqual(ep.expand_path_alias('$nm', self.path_alias_sheet), 'patient.demographics.name')
+        
+    def test_indexed_aliases(self):
+
+        # test that an index on an alias is kept on the end of its expansion
+        self.assertEqual(self.resolver.expand_path_alias('$pat[2]'), 'patient.demographics[2]')
+        self.assertEqual(self.resolver.expand_path_alias('$nm[0]'), 'patient.demographics.name[0]')
+        self.assertEqual(self.resolver.expand_split_path(['$nm[1]', 'given']), ['patient.demographics.name[1]', 'given'])
+        
+    def test_circular_aliases(self):
+
+        # test that aliases expanding to themselves are reported, every time they are expanded
+        for attempt in range(2):
+            with self.assertRaises(ep.CircularAliasError):
+                self.resolver.expand_path_alias('$c1')
+        self.assertEqual(self.resolver.expand_path_alias('$nm'), 'patient.demographics.name')
+        
+    def test_missing_aliases(self):
+
+        # test that unknown aliases raise their missing alias errors
+        with self.assertRaises(ep.MissingPathAliasError):
+            self.resolver.expand_path_alias('$missing')
+        with self.assertRaises(ep.MissingGroupAliasError):
+            self.resolver.expand_group_aliases('missing')
+            
+    def test_group_aliases(self):
+
+        # test that group aliases expand to their pairs without exposing the loaded alias
+        expected = (('address.line', '1 road'), ('address.postcode', 'ab1'))
+        self.assertEqual(self.resolver.expand_group_aliases('addr'), expected)
+        self.assertIsInstance(self.resolver.expand_group_aliases('addr'), tuple)
+        self.assertEqual(ep.expand_group_aliases(self.group_alias_sheet, 'addr'), expected)
+
+
+class TestDuplicates(unittest.TestCase):
+    def test_get_duplicates(self):
+
+        # test that both positions of each duplicate are reported
+        paths = [
+            [['a', 'b'], 1],
+            [['a', 'c'], 1],
+            [['a', 'b'], 2],
+            [['a', 'b'], 1],
+            [['a', 'c'], 1]
+        ]
+        self.assertEqual(ep.get_duplicates(paths), [
+            [['a', 'b'], 1, 0, 3],
+            [['a', 'c'], 1, 1, 4]
+        ])
+        
+    def test_tracker_keys(self):
+
+        # test that dotted and split paths share a key and unhashable values are handled
+        tracker = ep.DuplicateTracker()
+        self.assertFalse(tracker.add('a.b', [1], 2))
+        self.assertTrue(tracker.add(['a', 'b'], [1], 9))
+        self.assertEqual(tracker.duplicates, [[['a', 'b'], [1], 2, 9]])
+
+
+class FakeResolver(ep.AliasResolver):
+    def __init__(self):
+        super().__init__()
+        self.path_aliases = {'$obs': 'patient.observation', '$vital': '$obs.vital'}
+        self.group_aliases = {'bp': [['systolic', '120'], ['$vital.diastolic', '80']]}
+
+
+class TestColumnarLoops(unittest.TestCase):
+    def assert_same_as_iter_loop_lines(self, loop_lines, rows):
+        expected = list(ep.iter_loop_lines(loop_lines, rows, FakeResolver()))
+        for chunk_rows in [1, 3, ep.LOOP_CHUNK_ROWS]:
+            columnar = list(ep.iter_loop_lines_columnar(loop_lines, rows, FakeResolver(), chunk_rows))
+            self.assertEqual(columnar, expected)
+            self.assertEqual([type(value) for _, value in columnar], [type(value) for _, value in expected])
+            
+    def test_matches_iter_loop_lines(self):
+
+        # test plain, aliased, indexed and group alias loop lines
+        loop_lines = [
+            ['event[%].time', '#0'],
+            ['$obs[%].value', '#1'],
+            ['$vital.reading[%].code', '#2'],
+            ['event[%].note', 'constant'],
+            ['event[%].$$bp', None],
+            ['$$bp', None],
+            ['series.count', '#1']
+        ]
+        rows = [
+            ['2020-01-01', '72', ' High '],
+            ['2020-01-02', '7.5', 'LOW'],
+            ['2020-01-03', '', '0012'],
+            ['2020-01-04', '99999999999999999999999', 'x']
+        ]
+        self.assert_same_as_iter_loop_lines(loop_lines, rows)
+        
+    def test_row_dependent_alias_falls_back(self):
+
+        # test that aliases which depend on the row index still expand
+        resolver = FakeResolver()
+        resolver.path_aliases['$obs0'] = 'first'
+        resolver.path_aliases['$obs1'] = 'second'
+        expected = list(ep.iter_loop_lines([['$obs%.value', '#0']], [['1'], ['2']], resolver))
+        self.assertEqual(expected, [['first.value', 1], ['second.value', 2]])
+        self.assertEqual(list(ep.iter_loop_lines_columnar([['$obs%.value', '#0']], [['1'], ['2']], resolver)), expected)
+        
+class TestScenarioIR(unittest.TestCase):
+    def make_sheet(self):
+        sheet = openpyxl.Workbook().active
+        sheet.title = 'Scenario'
+        for row in [
+            ['Data Path', 'Example Data'],
+            ['Patient.Name.Given', 'Bob'],
+            ['$obs.code', 123],
+            [None, 'skipped'],
+            ['patient.$$bp', None],
+            ['$loop readings.csv', None],
+            ['reading[%].value', '#0'],
+            ['$loopend', None],
+            ['patient.born', datetime(1980, 1, 2, 3, 4)],
+            ['patient.seen', date(2020, 5, 6)],
+            ['patient.at', time(7, 8, 9)]
+        ]:
+            sheet.append(row)
+        return sheet
+        
+    def evaluate(self, scenario_ir):
+        return ep.evaluate_scenario_ir(scenario_ir, FakeResolver(), lambda csv_name: [['1'], ['2']])
+        
+    def test_compile_and_evaluate(self):
+
+        # test that the compiled sheet evaluates to the paths and object the sheet describes
+        paths = self.evaluate(ep.compile_scenario_sheet(self.make_sheet()))
+        self.assertEqual(paths, [
+            [['patient', 'name', 'given'], 'Bob'],
+            [['patient', 'observation', 'code'], 123],
+            [['patient', 'systolic'], '120'],
+            [['patient', 'patient', 'observation', 'vital', 'diastolic'], '80'],
+            [['reading[0]', 'value'], 1],
+            [['reading[1]', 'value'], 2],
+            [['patient', 'born'], datetime(1980, 1, 2, 3, 4)],
+            [['patient', 'seen'], date(2020, 5, 6)],
+            [['patient', 'at'], time(7, 8, 9)]
+        ])
+        self.assertEqual(ep.build_object(paths), ep.create_object(paths))
+        
+    def test_unclosed_loop(self):
+
+        # test that a $loop without a $loopend is reported
+        sheet = self.make_sheet()
+        sheet.delete_rows(8)
+        with self.assertRaises(ep.ExcelProcessingError):
+            ep.compile_scenario_sheet(sheet)
+            
+    def test_json_round_trip(self):
+
+        # test that a compiled sheet, with its dates and times, survives being cached as JSON
+        scenario_ir = ep.compile_scenario_sheet(self.make_sheet())
+        loaded = ep.scenario_ir_from_json(ep.scenario_ir_to_json(scenario_ir))
+        self.assertEqual(loaded, scenario_ir)
+        self.assertEqual(self.evaluate(loaded), self.evaluate(scenario_ir))
+        
+        with self.assertRaises(ep.ExcelProcessingError):
+            ep.scenario_ir_from_json(ep.scenario_ir_to_json(dict(scenario_ir, version=0)))
+            
+    def test_encode_ir_value(self):
+
+        # test that each date and time type is tagged and decoded back to the same type
+        for value in [datetime(1980, 1, 2, 3, 4, 5), date(1980, 1, 2), time(3, 4, 5)]:
+            decoded = ep.decode_ir_value(ep.encode_ir_value(value))
+            self.assertEqual(decoded, value)
+            self.assertIs(type(decoded), type(value))
+        self.assertEqual(ep.decode_ir_value({'a': 1}), {'a': 1})
+        with self.assertRaises(TypeError):
+            ep.encode_ir_value(object())
+
+
+class TestLinkedData(unittest.TestCase):
+    def test_small_events_are_embedded(self):
+
+        # test that linked data under the threshold stays in the storylog
+        writer = ep.LinkedDataWriter(spill_items=2)
+        writer.add(['patient', 'name'], 'bob')
+        event = {'event': 'sheet', 'linked_data': []}
+        writer.apply(event, 'bob/sheet.jsonl')
+        writer.close()
+        self.assertEqual(event, {'event': 'sheet', 'linked_data': [{'dataPath': 'patient.name', 'exampleData': 'bob'}]})
+        
+    def test_large_events_are_spilled(self):
+
+        # test that linked data over the threshold is referenced and reads back in order
+        writer = ep.LinkedDataWriter(spill_items=2)
+        for index in range(5):
+            writer.add(['reading[%d]' % index, 'value'], index)
+        self.assertTrue(writer.spilled)
+        chunk = writer.rewind().read()
+        event = {'event': 'sheet', 'linked_data': []}
+        writer.apply(event, 'bob/sheet.jsonl')
+        writer.close()
+        self.assertEqual(event['linked_data'], [])
+        self.assertEqual(event['linked_data_ref'], 'bob/sheet.jsonl')
+        self.assertEqual(event['linked_data_count'], 5)
+        
+        items = list(ep.iter_linked_data(event, lambda ref: io.BytesIO(chunk)))
+        self.assertEqual(items, [{'dataPath': 'reading[%d].value' % index, 'exampleData': index} for index in range(5)])
+        
+    def test_paths_file_format(self):
+
+        # test that paths written one at a time match the whole list written with json.dump
+        paths = [[['patient', 'name'], 'bob'], [['patient', 'born'], date(2000, 1, 2)], [['reading', 'value'], 1.5]]
+        f = io.StringIO()
+        json.dump(paths, f, indent=4, cls=ep.CustomEncoder, default=ep.serialize_datetime)
+        written = '[\n    ' + ',\n    '.join(ep.encode_path_item(segments, value) for segments, value in paths) + '\n]'
+        self.assertEqual(written, f.getvalue())
+
+
+class TestParseStandard(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.standard_path = self.make_standard('standard.xlsx', [
+            ['Event', None, '1...1', 'Event.Record'],
+            ['    Time', None, '0...1', 'Element'],
+            ['    Reading', None, '0...*', 'Element'],
+            ['        Value', None, '1...1', 'Element'],
+            ['Patient', None, '1...*', 'Record']
+        ])
+        self.provenance_path = self.make_standard('provenance.xlsx', [
+            ['Event Record', None, '1...1', 'Category'],
+            ['    Author', None, '0...*', 'Element'],
+            ['Record', None, '1...1', 'Category'],
+            ['    Source', None, '1...1', 'Element']
+        ])
+        
+    def tearDown(self):
+        self.directory.cleanup()
+        
+    def make_standard(self, name, rows):
+        path = os.path.join(self.directory.name, name)
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.append(['Title'])
+        ws.append([])
+        ws.append(['Name', 'Description', 'Cardinality', 'Information Type'])
+        for row in rows:
+            ws.append(row)
+        wb.save(path)
+        return path
+        
+    def test_paths(self):
+
+        # test the validation paths and the [] markers on repeating elements of the export paths
+        validation_paths, export_paths = ep.parse_standard(self.standard_path)
+        self.assertEqual(validation_paths, [['event'], ['event', 'time'], ['event', 'reading'], ['event', 'reading', 'value'], ['patient']])
+        self.assertEqual(export_paths, ['event', 'event.time', 'event.reading[]', 'event.reading[].value', 'patient[]'])
+        
+    def test_provenance_paths(self):
+
+        # test that record rows are extended with the provenance of their category
+        provenance_paths, export_provenance_paths = ep.parse_standard(self.provenance_path)
+        self.assertEqual(export_provenance_paths, ['event record', 'event record.author[]', 'record', 'record.source'])
+        
+        validation_paths, export_paths = ep.parse_standard(self.standard_path, provenance_paths, export_provenance_paths)
+        self.assertEqual(validation_paths, ['event.author', 'patient.source'])
+        self.assertEqual(export_paths, ['event.author[]', 'patient[].source'])
+        self.assertEqual(ep.export_standard(self.standard_path, self.provenance_path), export_paths)
+        
+    def test_get_standard_paths_for_export(self):
+
+        # test that each row's validation paths are followed by the row itself, marked only if it repeats
+        self.assertEqual(ep.get_standard_paths(self.standard_path, [], True), [
+            ['event'], 'event', ['event', 'time'], 'event.time', ['event', 'reading'], 'event.reading[]',
+            ['event', 'reading', 'value'], 'event.reading.value', ['patient'], 'patient[]'
+        ])
+        
+        provenance_paths = ep.get_standard_paths(self.provenance_path, [])
+        self.assertEqual(ep.get_standard_paths(self.standard_path, provenance_paths, True), [
+            'event.author', 'event', 'event.time', 'event.reading[]', 'event.reading.value', 'patient.source', 'patient[]'
+        ])
+        
+    def test_find_lists(self):
+
+        # test that elements named in the repeating paths are marked
+        self.assertEqual(ep.find_lists('Event.Reading.Value', ['Reading']), 'event.reading[].value')
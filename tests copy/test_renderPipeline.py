@@ -0,0 +1,94 @@
+from rsScenario.renderPipeline import RenderPipeline, PipelineError
+from rsScenario.storageBackends import InMemoryBackend
+from rsScenario import storageBackends
+
+import threading
+import time
+import unittest
+
+class TestRenderPipeline(unittest.TestCase):
+    def setUp(self):
+        self.storage = InMemoryBackend()
+        retry_delay, storageBackends.BULK_RETRY_DELAY = storageBackends.BULK_RETRY_DELAY, 0
+        self.addCleanup(setattr, storageBackends, 'BULK_RETRY_DELAY', retry_delay)
+        
+    def test_render_and_upload(self):
+
+        # test that every output is uploaded and counted, with no more jobs in flight than allowed
+        rendering = []
+        most_rendering = [0]
+        lock = threading.Lock()
+        
+        def render(number):
+            with lock:
+                rendering.append(number)
+                most_rendering[0] = max(most_rendering[0], len(rendering))
+            time.sleep(0.01)
+            with lock:
+                rendering.remove(number)
+            return [(f'website/{number}.html', f'page {number}', 'text/html'), (f'website/{number}.json', '{}', 'application/json')]
+        
+        with RenderPipeline(self.storage, render_workers=4, upload_workers=4, max_in_flight=2) as pipeline:
+            for number in range(10):
+                pipeline.submit(str(number), lambda number=number: render(number))
+        
+        self.assertLessEqual(most_rendering[0], 2)
+        self.assertEqual(self.storage.get('website/7.html'), b'page 7')
+        self.assertEqual(len(self.storage.list('website/')), 20)
+        self.assertEqual(pipeline.summary['stages']['render']['jobs'], 10)
+        self.assertEqual(pipeline.summary['stages']['upload']['objects'], 20)
+        self.assertEqual(pipeline.summary['stages']['upload']['bytes'], 10 * 6 + 10 * 2)
+        
+    def test_retry_and_failures(self):
+
+        # test that uploads are retried and failed renders and uploads are raised together
+        put = self.storage.put
+        attempts = {}
+        
+        def flaky_put(name, data, content_type=None, content_encoding=None):
+            attempts[name] = attempts.get(name, 0) + 1
+            if name == 'website/bad.html' or attempts[name] == 1:
+                raise ConnectionError(name)
+            put(name, data, content_type, content_encoding)
+        
+        def broken_render():
+            raise ValueError('bad data')
+        
+        self.storage.put = flaky_put
+        pipeline = RenderPipeline(self.storage)
+        pipeline.submit('good', lambda: [('website/good.html', 'good', 'text/html')])
+        pipeline.submit('bad', lambda: [('website/bad.html', 'bad', 'text/html')])
+        pipeline.submit('broken', broken_render)
+        with self.assertRaises(PipelineError) as context:
+            pipeline.close()
+        
+        self.assertEqual(sorted(context.exception.failures), ['broken', 'website/bad.html'])
+        self.assertEqual(self.storage.get('website/good.html'), b'good')
+        self.assertEqual(pipeline.stats()['stages']['upload']['retries'], 1 + storageBackends.BULK_ATTEMPTS - 1)
+        
+    def test_large_outputs_are_gzipped(self):
+
+        # test that large text outputs are uploaded gzipped and small or binary ones are not
+        uploads = {}
+        put = self.storage.put
+        
+        def recording_put(name, data, content_type=None, content_encoding=None):
+            uploads[name] = (len(data), content_type, content_encoding)
+            put(name, data, content_type, content_encoding)
+        
+        self.storage.put = recording_put
+        page = '<li>' * 1000
+        with RenderPipeline(self.storage) as pipeline:
+            pipeline.submit('pages', lambda: [
+                ('website/big.html', page, 'text/html'),
+                ('website/small.html', '<li>', 'text/html'),
+                ('website/big.png', page, 'image/png')
+            ])
+        
+        self.assertEqual(uploads['website/big.html'][1:], ('text/html', 'gzip'))
+        self.assertLess(uploads['website/big.html'][0], len(page) // 10)
+        self.assertEqual(uploads['website/small.html'], (4, 'text/html', None))
+        self.assertEqual(uploads['website/big.png'], (len(page), 'image/png', None))
+        self.assertEqual(self.storage.get('website/big.html'), page.encode('utf-8'))
+        self.assertEqual(pipeline.summary['stages']['upload']['compressed'], 1)
+        self.assertLess(pipeline.summary['stages']['upload']['bytes'], pipeline.summary['stages']['render']['bytes'])
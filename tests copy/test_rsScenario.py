@@ -1,39 +1,56 @@
-from rsScenario import rsScenario
-from google.cloud import storage
+from rsScenario.rsScenario import ScenarioTool
+from rsScenario import storageBackends
 
 import pytest
+import tempfile
 import unittest
 import jinja2
 
 class TestScenarioTool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = storageBackends.LocalDirectoryBackend(self.directory.name)
+        
+    def tearDown(self):
+        self.directory.cleanup()
+        
     def test_init(self):
 
         # test that the init function works
-        test_scenario = rsScenario("Diabetes", "sites.ramseysystems")
+        test_scenario = ScenarioTool("Diabetes", "sites.ramseysystems", self.storage)
         self.assertEqual(test_scenario.project_name, "diabetes")
         self.assertEqual(test_scenario.gcp_project, "sites.ramseysystems")
         self.assertEqual(test_scenario.validated, False)
         self.assertEqual(test_scenario.standard_dir, "sites.ramseysystems/diabetes/standards")
         self.assertEqual(test_scenario.personae_dir, "sites.ramseysystems/diabetes/personae")
         self.assertEqual(test_scenario.continuous_data_dir, "sites.ramseysystems/diabetes/continuous_data")
-        self.assertEqual(test_scenario.storage_client, storage.Client())
+        self.assertEqual(test_scenario.build_manifest_path, "sites.ramseysystems/diabetes/build_manifest.json")
+        self.assertIs(test_scenario.storage, self.storage)
         self.assertEqual(test_scenario.provenance, [])
         self.assertIsInstance(test_scenario.template_env, jinja2.Environment) # how do i test this is right. Do i check the class type?
-        self.assertEqual(test_scenario.bucket, test_scenario.storage_client.get_bucket("sites.ramseysystems"))
+        
+    def test_init_with_backend(self):
+
+        # test that a storage backend can be given instead of the gcp bucket
+        storage = storageBackends.InMemoryBackend()
+        test_scenario = ScenarioTool("Diabetes", "sites.ramseysystems", storage)
+        self.assertIs(test_scenario.storage, storage)
         
     def test_copy_project(self):
 
         # test that the copy_project function works
-        test_scenario = rsScenario("Diabetes", "sites.ramseysystems")
-        test_scenario.copy_project("Diabetes", "new_diabetes")
+        self.storage.put("diabetes/standards/", "")
+        self.storage.put("diabetes/standards/standard.xlsx", "standard")
+        self.storage.put("diabetes/personae/bob.json", "{}")
+        test_scenario = ScenarioTool("Diabetes", "sites.ramseysystems", self.storage)
+        test_scenario.copy_project("diabetes", "new_diabetes")
         
-        # go on to the GCP bucket and check that the new project has been created
-        new_dir_blob = test_scenario.bucket.blob("new_diabetes/standards/")
-        self.assertEqual(new_dir_blob.exists(), True)
+        # check that the new project has been created
+        self.assertEqual(test_scenario.storage.exists("new_diabetes/standards/"), True)
         
         # check the contents of the new project
-        original_blobs = test_scenario.bucket.list_blobs(prefix="diabetes/")
-        new_blobs = test_scenario.bucket.list_blobs(prefix="new_diabetes/")
+        original_blobs = list(test_scenario.storage.list(prefix="diabetes/"))
+        new_blobs = list(test_scenario.storage.list(prefix="new_diabetes/"))
         
         # check they are the same length
         self.assertEqual(len(list(original_blobs)), len(list(new_blobs)))
@@ -43,23 +60,25 @@ class TestScenarioTool(unittest.TestCase):
 
         # Ckeck the content and their sizes are the same
         for filename in original_files:
-            new_filename = filename.replace("Diabetes", "new_diabetes")
+            new_filename = filename.replace("diabetes", "new_diabetes", 1)
             self.assertTrue(new_filename in new_files)
             self.assertEqual(original_files[filename], new_files[new_filename])
             
     def test_list_projects(self):
 
         # test that the list_projects function works
-        test_scenario = rsScenario("Diabetes", "sites.ramseysystems")
+        self.storage.put("sites.ramseysystems/diabetes/standards/", "")
+        test_scenario = ScenarioTool("Diabetes", "sites.ramseysystems", self.storage)
         projects = test_scenario.list_projects()
         self.assertEqual(projects, ["diabetes"])
         
     def test_set_project(self):
 
         # test that the set_project function works
-        test_scenario = rsScenario("Diabetes", "sites.ramseysystems")
+        test_scenario = ScenarioTool("Diabetes", "sites.ramseysystems", self.storage)
         test_scenario.set_project("new_diabetes")
         self.assertEqual(test_scenario.project_name, "new_diabetes")
+        self.assertEqual(test_scenario.build_manifest_path, "sites.ramseysystems/new_diabetes/build_manifest.json")
         
     def test_del_project(self):
         pass
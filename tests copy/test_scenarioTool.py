@@ -0,0 +1,222 @@
+from rsScenario.rsScenario import ScenarioTool
+from rsScenario.compileScheduler import CompileScheduler, QUEUED, DONE, default_scheduler
+from rsScenario.storageBackends import InMemoryBackend
+
+import io
+import json
+import openpyxl
+import unittest
+
+class InterruptedBackend(InMemoryBackend):
+    '''
+    An InMemoryBackend where another writer replaces an object right after it is first read
+    '''
+    def __init__(self, name, data):
+        super().__init__()
+        self.interrupt = (name, data)
+
+    def get(self, name, generation=None):
+        data = super().get(name, generation)
+        if self.interrupt is not None and name == self.interrupt[0]:
+            interrupt, self.interrupt = self.interrupt, None
+            self.put(*interrupt)
+        return data
+
+class TestProjectsManifest(unittest.TestCase):
+    def test_list_projects_in_site(self):
+
+        # test that only the folders of the site are projects and their details come from the manifest
+        storage = InMemoryBackend()
+        storage.put("sites.ramseysystems/asthma/personae/bob.json", "{}")
+        storage.put("sites.ramseysystems/diabetes/standards/", "")
+        storage.put("sites.ramseysystems.co.uk/other/personae/amy.json", "{}")
+        test_scenario = ScenarioTool("Diabetes", "sites.ramseysystems", storage)
+        self.assertEqual(test_scenario.list_projects(), ["asthma", "diabetes"])
+
+        test_scenario.update_projects_manifest()
+        details = test_scenario.project_details()
+        self.assertEqual(details["asthma"], {})
+        self.assertEqual(details["diabetes"]["personae"], 0)
+        self.assertEqual(details["diabetes"]["standards"], 0)
+        self.assertEqual(test_scenario.list_projects(), ["asthma", "diabetes"])
+
+    def test_concurrent_update(self):
+
+        # test that a project recorded by another writer between the read and the write is kept
+        storage = InterruptedBackend("sites.ramseysystems/projects.json", json.dumps({"asthma": {"personae": 1}}))
+        storage.put("sites.ramseysystems/projects.json", "{}")
+        test_scenario = ScenarioTool("diabetes", "sites.ramseysystems", storage)
+        test_scenario.update_projects_manifest()
+
+        projects_manifest = test_scenario.load_projects_manifest()
+        self.assertEqual(sorted(projects_manifest), ["asthma", "diabetes"])
+        self.assertEqual(projects_manifest["asthma"], {"personae": 1})
+
+        test_scenario.update_projects_manifest(deleted=True)
+        self.assertEqual(sorted(test_scenario.load_projects_manifest()), ["asthma"])
+
+    def test_copy_project_is_recorded(self):
+
+        # test that a copied project is added to the projects manifest
+        storage = InMemoryBackend()
+        storage.put("sites.ramseysystems/diabetes/personae/bob.json", "{}")
+        storage.put("sites.ramseysystems/diabetes/standards/standard.xlsx", "")
+        test_scenario = ScenarioTool("diabetes", "sites.ramseysystems", storage)
+        test_scenario.copy_project("sites.ramseysystems/diabetes", "sites.ramseysystems/asthma")
+        self.assertEqual(storage.get("sites.ramseysystems/asthma/personae/bob.json"), b"{}")
+
+        details = test_scenario.project_details()
+        self.assertEqual(details["asthma"]["personae"], 1)
+        self.assertEqual(details["asthma"]["standards"], 1)
+
+
+class TestDependencyGraph(unittest.TestCase):
+    def test_concurrent_saves(self):
+
+        # test that graphs changed by two tools at once both keep their changes
+        storage = InMemoryBackend()
+        first = ScenarioTool("diabetes", "sites.ramseysystems", storage)
+        second = ScenarioTool("diabetes", "sites.ramseysystems", storage)
+        first.load_dependency_graph().set_personae("bob.xlsx", ["diabetes"], [])
+        second.load_dependency_graph().set_personae("alice.xlsx", ["diabetes"], [])
+        first.save_dependency_graph()
+        second.save_dependency_graph()
+        self.assertEqual(sorted(second.load_dependency_graph().personae), ["alice.xlsx", "bob.xlsx"])
+        
+        first.load_dependency_graph().remove_personae("bob.xlsx")
+        first.save_dependency_graph()
+        third = ScenarioTool("diabetes", "sites.ramseysystems", storage)
+        self.assertEqual(sorted(third.load_dependency_graph().personae), ["alice.xlsx"])
+        
+    def test_save_between_read_and_write(self):
+
+        # test that a graph saved after this save has read it is read again and kept
+        graph_path = "sites.ramseysystems/diabetes/dependencies.json"
+        storage = InterruptedBackend(graph_path, json.dumps({"personae": {"alice.xlsx": {"standards": ["asthma"]}}}))
+        storage.put(graph_path, json.dumps({"personae": {}}))
+        test_scenario = ScenarioTool("diabetes", "sites.ramseysystems", storage)
+        test_scenario.load_dependency_graph().set_personae("bob.xlsx", ["diabetes"], [])
+        test_scenario.save_dependency_graph()
+        
+        saved = json.loads(storage.get(graph_path))
+        self.assertEqual(sorted(saved["personae"]), ["alice.xlsx", "bob.xlsx"])
+
+
+def personae_workbook(given_name):
+    '''
+    A function to build a personae workbook with one scenario sheet that loops over data.csv
+    '''
+    wb = openpyxl.Workbook()
+    story = wb.active
+    story.title = "Story"
+    story.append(["Summary", "Rationale", "Story", "Standard URL", "Standard Name"])
+    story.append(["summary", "rationale", "story", "url", "diabetes"])
+    timeline = wb.create_sheet("Time Line")
+    timeline.append(["Date/Time", "Event", "Sheet"])
+    timeline.append(["2020", "Admit", "Admit"])
+    wb.create_sheet("Path Aliases").append(["Path Alias Name", "Value"])
+    wb.create_sheet("Group Aliases").append(["Group Alias Name", "Path", "Value"])
+    scenario = wb.create_sheet("Admit")
+    scenario.append(["Data Path", "Example Data"])
+    scenario.append(["patient.name.given", given_name])
+    scenario.append(["$loop data.csv", None])
+    scenario.append(["obs[%].value", "#1"])
+    scenario.append(["$loopend", None])
+    scenario.append(["patient.unknown", "x"])
+    workbook_bytes = io.BytesIO()
+    wb.save(workbook_bytes)
+    return workbook_bytes.getvalue()
+
+class TestRevalidation(unittest.TestCase):
+    def test_broken_personae(self):
+
+        # test that broken personae are reported together and the rest of the pass still completes
+        storage = InMemoryBackend()
+        personae_dir = "sites.ramseysystems/diabetes/personae"
+        storage.put(f"{personae_dir}/good.json", json.dumps({"timeline": [{"standard": "diabetes", "linked_data": []}]}))
+        storage.put(f"{personae_dir}/broken.json", "{not json")
+        storage.put(f"{personae_dir}/broken.xlsx", "not a workbook")
+        
+        for workers in [1, 4]:
+            test_scenario = ScenarioTool("diabetes", "sites.ramseysystems", storage, revalidation_workers=workers)
+            with self.assertRaises(ScenarioTool.RevalidationError) as context:
+                test_scenario.revalidate_personae()
+            self.assertEqual(sorted(context.exception.errors), ["broken.json", "broken.xlsx"])
+            self.assertEqual(context.exception.touched, {"good.json", "broken.json", "broken.xlsx"})
+            
+            self.assertEqual(json.loads(storage.get(f"{personae_dir}/good.falsepaths.json")), {"sheet": []})
+            self.assertEqual(json.loads(storage.get(f"{personae_dir}/good.storylog.json"))["timeline"][0]["standard"], "diabetes")
+            self.assertIn("good.json", test_scenario.load_dependency_graph().personae)
+            self.assertIsNone(test_scenario.continuous_data_cache)
+            storage.delete(f"{personae_dir}/good.storylog.json")
+
+    def test_parse_processes(self):
+
+        # test that parsing workbooks in a process pool gives the same results as parsing on the threads
+        storage = InMemoryBackend()
+        personae_dir = "sites.ramseysystems/diabetes/personae"
+        storage.put("sites.ramseysystems/diabetes/continuous_data/data.csv", "time,value\n1,5\n2,6\n")
+        for given_name in ["bob", "alice", "carol"]:
+            storage.put(f"{personae_dir}/{given_name}.xlsx", personae_workbook(given_name))
+        
+        results = {}
+        for parse_processes in [0, 2]:
+            test_scenario = ScenarioTool("diabetes", "sites.ramseysystems", storage, revalidation_workers=2, parse_processes=parse_processes)
+            test_scenario.save_standard_paths("diabetes", ["patient.name.given", "obs.value"])
+            self.assertEqual(test_scenario.revalidate_personae(), {"bob.xlsx", "alice.xlsx", "carol.xlsx"})
+            self.assertIsNone(test_scenario.parse_executor)
+            
+            outputs = sorted(info.name for info in storage.list(f"{personae_dir}/") if not info.name.endswith(".xlsx"))
+            results[parse_processes] = {name: storage.get(name) for name in outputs}
+            for name in outputs:
+                storage.delete(name)
+            
+            dependency_graph = test_scenario.load_dependency_graph()
+            self.assertEqual(dependency_graph.personae_using_continuous_data("data.csv"), {"bob.xlsx", "alice.xlsx", "carol.xlsx"})
+            self.assertEqual(dependency_graph.personae_using_standard("diabetes"), {"bob.xlsx", "alice.xlsx", "carol.xlsx"})
+        
+        self.assertEqual(len(results[0]), 6)
+        self.assertEqual(results[2], results[0])
+        self.assertEqual(json.loads(results[0][f"{personae_dir}/bob.falsepaths.json"]), {"Admit": [["patient", "unknown"]]})
+
+
+class TestPatients(unittest.TestCase):
+    def test_save_and_delete_return_the_compile_job(self):
+
+        # test that saving and deleting a patient both return the queued compile job
+        storage = InMemoryBackend()
+        scheduler = CompileScheduler(debounce=60)
+        test_scenario = ScenarioTool("diabetes", "sites.ramseysystems", storage, compile_scheduler=scheduler)
+        
+        job_id = test_scenario.save_patient({"timeline": []}, "bob")
+        self.assertEqual(test_scenario.revalidated, {"bob.json"})
+        self.assertEqual(test_scenario.compile_status(job_id)["status"], QUEUED)
+        
+        # the delete is coalesced into the queued compile
+        self.assertEqual(test_scenario.del_patient("bob"), job_id)
+        self.assertEqual(test_scenario.compile_status()["requests"], 2)
+        self.assertNotIn("bob.json", test_scenario.load_dependency_graph().personae)
+
+    def test_default_scheduler(self):
+
+        # test that compiles are queued on the shared scheduler unless synchronous_compile is set
+        storage = InMemoryBackend()
+        self.assertIs(ScenarioTool("diabetes", "sites.ramseysystems", storage).compile_scheduler, default_scheduler())
+        
+        test_scenario = ScenarioTool("diabetes", "sites.ramseysystems", storage, synchronous_compile=True)
+        self.assertIsNone(test_scenario.save_patient({"timeline": []}, "bob"))
+        self.assertIsNotNone(storage.stat("sites.ramseysystems/diabetes/build_manifest.json"))
+        self.assertIsNone(test_scenario.compile_status())
+        
+    def test_queued_compile_keeps_its_project(self):
+
+        # test that a queued compile is for the project it was requested for, whatever the tool changes to after
+        storage = InMemoryBackend()
+        scheduler = CompileScheduler(debounce=60)
+        test_scenario = ScenarioTool("diabetes", "sites.ramseysystems", storage, compile_scheduler=scheduler)
+        job_id = test_scenario.schedule_compile()
+        test_scenario.project_name = "asthma"
+        scheduler.flush(timeout=5)
+        
+        self.assertEqual(test_scenario.compile_status(job_id)["status"], DONE)
+        self.assertEqual([info.name for info in storage.list("sites.ramseysystems/")], ["sites.ramseysystems/diabetes/build_manifest.json"])
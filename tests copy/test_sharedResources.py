@@ -0,0 +1,65 @@
+from rsScenario import sharedResources
+from rsScenario.compileTemplates import compile_templates
+
+import os
+import tempfile
+import unittest
+
+class TestSharedResources(unittest.TestCase):
+    def test_template_env_is_shared(self):
+
+        # test that one environment is made per template folder and templates compile once
+        with tempfile.TemporaryDirectory() as template_path:
+            with open(f'{template_path}/hello.html', 'w') as f:
+                f.write('Hello {{ name }}')
+            env = sharedResources.template_env(template_path)
+            self.assertIs(sharedResources.template_env(template_path), env)
+            self.assertIsNot(sharedResources.template_env(), env)
+            
+            template = env.get_template('hello.html')
+            self.assertIs(sharedResources.template_env(template_path).get_template('hello.html'), template)
+            self.assertEqual(template.render(name='Bob'), 'Hello Bob')
+            
+            sharedResources.reset()
+            self.assertIsNot(sharedResources.template_env(template_path), env)
+            
+    def test_precompiled_templates(self):
+
+        # test that compiled templates are loaded from their modules until their source changes
+        with tempfile.TemporaryDirectory() as folder:
+            template_path = f'{folder}/templates'
+            os.mkdir(template_path)
+            with open(f'{template_path}/story.html', 'w') as f:
+                f.write('Story of {{ name }}')
+            self.assertEqual(compile_templates(template_path), ['story.html'])
+            
+            sharedResources.reset()
+            template = sharedResources.template_env(template_path).get_template('story.html')
+            self.assertTrue(template.filename.startswith(f'{template_path}_compiled'))
+            self.assertEqual(template.render(name='Bob'), 'Story of Bob')
+            
+            with open(f'{template_path}/story.html', 'w') as f:
+                f.write('The story of {{ name }}')
+            sharedResources.reset()
+            template = sharedResources.template_env(template_path).get_template('story.html')
+            self.assertEqual(template.filename, f'{template_path}/story.html')
+            self.assertEqual(template.render(name='Bob'), 'The story of Bob')
+
+    def test_rebuild_swaps_atomically(self):
+
+        # test that a rebuild replaces the compiled folder in one step and removes the old builds
+        with tempfile.TemporaryDirectory() as folder:
+            template_path = f'{folder}/templates'
+            compiled_path = f'{template_path}_compiled'
+            os.mkdir(template_path)
+            with open(f'{template_path}/story.html', 'w') as f:
+                f.write('Story of {{ name }}')
+            
+            # a compiled folder from before builds were symlinked is replaced too
+            os.mkdir(compiled_path)
+            os.mkdir(f'{compiled_path}.build')
+            for attempt in range(2):
+                compile_templates(template_path)
+                self.assertTrue(os.path.islink(compiled_path))
+                self.assertEqual(sorted(os.listdir(folder)), ['templates', 'templates_compiled', os.readlink(compiled_path)])
+                self.assertTrue(os.path.isfile(f'{compiled_path}/templates.json'))
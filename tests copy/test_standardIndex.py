@@ -0,0 +1,79 @@
+from rsScenario.standardIndex import StandardIndex, CompiledStandardView, compile_standard, open_compiled_standard, strip_index
+
+import os
+import tempfile
+import unittest
+
+class TestStandardIndex(unittest.TestCase):
+    def test_membership(self):
+
+        # test that dotted strings and segment lists are both accepted
+        index = StandardIndex(['Patient.Name.Given', ['patient', 'address', 'line']])
+        self.assertEqual(len(index), 2)
+        self.assertIn('patient.name.given', index)
+        self.assertIn(['patient', 'address', 'line'], index)
+        self.assertIn('patient.address.line', index)
+        
+        # test that prefixes of standard paths are not members
+        self.assertNotIn('patient.name', index)
+        self.assertNotIn('patient.name.given.extra', index)
+        
+    def test_indexes_are_ignored(self):
+
+        # test that [n] indexes are stripped from looked up paths
+        index = StandardIndex(['event.observation.value'])
+        self.assertIn('event.observation[12].value', index)
+        self.assertIn(['event[1]', 'observation[0][2]', 'value'], index)
+        self.assertEqual(strip_index('observation[]'), 'observation[]')
+        
+    def test_deepest_prefix(self):
+
+        # test that the valid part of a false path is reported
+        index = StandardIndex(['patient.name.given', 'patient.name.family'])
+        self.assertEqual(index.deepest_prefix('patient.name[1].middle'), ['patient', 'name'])
+        self.assertEqual(index.deepest_prefix('person.name'), [])
+        
+    def test_coerce(self):
+
+        # test that an existing index is reused
+        index = StandardIndex(['a.b'])
+        self.assertIs(StandardIndex.coerce(index), index)
+        self.assertIn('a.b', StandardIndex.coerce(['a.b']))
+
+
+
+class TestCompiledStandard(unittest.TestCase):
+    paths = ['Patient.Name.Given', 'patient.name.family', ['patient', 'address', 'line'], 'patient.tag[]']
+    
+    def test_matches_standard_index(self):
+
+        # test that the compiled view answers lookups like the trie
+        index = StandardIndex(self.paths)
+        view = CompiledStandardView(compile_standard(self.paths))
+        self.assertEqual(len(view), len(index))
+        for path in ['patient.name.given', 'patient.name[2].family', 'patient.name', 'patient.tag[]',
+                     'patient.address.line.extra', 'person', ['patient', 'address', 'line']]:
+            self.assertEqual(path in view, path in index)
+            self.assertEqual(view.deepest_prefix(path), index.deepest_prefix(path))
+            
+    def test_iteration_is_sorted(self):
+
+        # test that iterating the view yields the de-duplicated paths in order
+        view = CompiledStandardView(compile_standard(self.paths + ['patient.name.given']))
+        self.assertEqual(list(view), [
+            ['patient', 'address', 'line'],
+            ['patient', 'name', 'family'],
+            ['patient', 'name', 'given'],
+            ['patient', 'tag[]']
+        ])
+        
+    def test_memory_mapped(self):
+
+        # test that a compiled standard file can be memory-mapped
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'standard.bin')
+            with open(file_path, 'wb') as f:
+                f.write(compile_standard(self.paths))
+            view = open_compiled_standard(file_path)
+            self.assertIn('patient.name.given', view)
+            self.assertIs(StandardIndex.coerce(view), view)
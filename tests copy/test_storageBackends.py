@@ -0,0 +1,156 @@
+from rsScenario.storageBackends import InMemoryBackend, LocalDirectoryBackend, NotFound, BulkOperationError, PreconditionFailed
+from rsScenario import storageBackends
+
+import gzip
+import io
+import tempfile
+import unittest
+
+class StorageBackendTests:
+    def test_put_get(self):
+
+        # test that objects read back and replace each other
+        self.storage.put('project/personae/bob.json', '{}')
+        self.assertEqual(self.storage.get('project/personae/bob.json'), b'{}')
+        generation = self.storage.generation('project/personae/bob.json')
+        self.storage.put('project/personae/bob.json', b'{"a": 1}')
+        self.assertEqual(self.storage.get('project/personae/bob.json'), b'{"a": 1}')
+        self.assertNotEqual(self.storage.generation('project/personae/bob.json'), generation)
+        
+    def test_put_encoded(self):
+
+        # test that gzip encoded contents read back decoded
+        self.storage.put('project/website/story.html', gzip.compress(b'<p>story</p>'), 'text/html', 'gzip')
+        self.assertEqual(self.storage.get('project/website/story.html'), b'<p>story</p>')
+        
+    def test_missing(self):
+
+        # test that missing objects raise NotFound
+        self.assertIsNone(self.storage.stat('project/missing.json'))
+        self.assertFalse(self.storage.exists('project/missing.json'))
+        with self.assertRaises(NotFound):
+            self.storage.get('project/missing.json')
+        with self.assertRaises(NotFound):
+            self.storage.delete('project/missing.json')
+        with self.assertRaises(NotFound):
+            with self.storage.open('project/missing.json') as stream:
+                stream.read()
+                
+    def test_put_if_generation_match(self):
+
+        # test that conditional writes only replace the generation they were given
+        with self.assertRaises(PreconditionFailed):
+            self.storage.put('site/projects.json', '{}', if_generation_match=1)
+        self.storage.put('site/projects.json', '{}', if_generation_match=0)
+        generation = self.storage.generation('site/projects.json')
+        with self.assertRaises(PreconditionFailed):
+            self.storage.put('site/projects.json', '{"a": 1}', if_generation_match=0)
+        self.storage.put('site/projects.json', '{"a": 1}', if_generation_match=generation)
+        with self.assertRaises(PreconditionFailed):
+            self.storage.put('site/projects.json', '{"b": 1}', if_generation_match=generation)
+        self.assertEqual(self.storage.get('site/projects.json'), b'{"a": 1}')
+        
+    def test_update_object(self):
+
+        # test that updates are applied to the current contents, starting from None
+        self.assertEqual(storageBackends.update_object(self.storage, 'site/count.txt', lambda data: '1' if data is None else str(int(data) + 1)), b'1')
+        storageBackends.update_object(self.storage, 'site/count.txt', lambda data: str(int(data) + 1))
+        self.assertEqual(self.storage.get('site/count.txt'), b'2')
+        
+    def test_list_copy_delete(self):
+
+        # test prefix listing, copying and deleting
+        self.storage.put('project/standards/', '')
+        self.storage.put('project/standards/a.json', 'a')
+        self.storage.put_stream('project/standards/b.json', io.BytesIO(b'bb'))
+        self.storage.put('projectx/standards/c.json', 'c')
+        self.assertEqual([info.name for info in self.storage.list('project/')], ['project/standards/', 'project/standards/a.json', 'project/standards/b.json'])
+        self.assertEqual([info.size for info in self.storage.list('project/standards/b')], [2])
+        
+        self.storage.copy('project/standards/b.json', 'copy/standards/b.json')
+        with self.storage.open('copy/standards/b.json') as stream:
+            self.assertEqual(stream.read(), b'bb')
+        
+        self.storage.delete('project/standards/a.json')
+        self.assertEqual([info.name for info in self.storage.list('project/standards/')], ['project/standards/', 'project/standards/b.json'])
+        
+    def test_list_prefixes(self):
+
+        # test that only the folders directly under a prefix are listed
+        self.storage.put('site/asthma/personae/bob.json', '{}')
+        self.storage.put('site/diabetes/', '')
+        self.storage.put('site/projects.json', '{}')
+        self.storage.put('other/asthma/a.json', '{}')
+        self.assertEqual(self.storage.list_prefixes('site/'), ['site/asthma/', 'site/diabetes/'])
+        self.assertEqual(self.storage.list_prefixes('site/d'), ['site/diabetes/'])
+        self.assertEqual(self.storage.list_prefixes('missing/'), [])
+        
+    def test_bulk_copy_delete(self):
+
+        # test batched copies and deletes, with progress reported up to the total
+        names = [f'project/personae/{i}.json' for i in range(25)]
+        for name in names:
+            self.storage.put(name, name)
+        progress = []
+        copied = self.storage.copy_many([(name, name.replace('project', 'copy', 1)) for name in names], progress=lambda done, total: progress.append((done, total)), batch_size=4)
+        self.assertEqual(copied, 25)
+        self.assertEqual(max(progress), (25, 25))
+        self.assertEqual(self.storage.get('copy/personae/7.json'), b'project/personae/7.json')
+        
+        # missing objects count as deleted
+        deleted = self.storage.delete_many(names + ['project/missing.json'], batch_size=4)
+        self.assertEqual(deleted, 26)
+        self.assertEqual(list(self.storage.list('project/')), [])
+        self.assertEqual(len(list(self.storage.list('copy/'))), 25)
+        
+class TestStorageBackend(unittest.TestCase):
+    def test_incomplete_backend(self):
+
+        # test that a backend missing part of the interface cannot be created
+        class ReadOnlyBackend(storageBackends.StorageBackend):
+            def get(self, name, generation=None):
+                return b''
+            
+        with self.assertRaises(TypeError):
+            ReadOnlyBackend()
+            
+class TestInMemoryBackend(StorageBackendTests, unittest.TestCase):
+    def setUp(self):
+        self.storage = InMemoryBackend()
+        
+    def test_bulk_retry(self):
+
+        # test that failed objects are retried and ones that keep failing are raised together
+        retry_delay, storageBackends.BULK_RETRY_DELAY = storageBackends.BULK_RETRY_DELAY, 0
+        self.addCleanup(setattr, storageBackends, 'BULK_RETRY_DELAY', retry_delay)
+        for name in ['a', 'b', 'c']:
+            self.storage.put(name, name)
+        attempts = {}
+        delete = self.storage.delete
+        
+        def flaky_delete(name):
+            attempts[name] = attempts.get(name, 0) + 1
+            if name == 'c' or attempts[name] == 1 and name == 'b':
+                raise ConnectionError(name)
+            delete(name)
+        
+        self.storage.delete = flaky_delete
+        with self.assertRaises(BulkOperationError) as context:
+            self.storage.delete_many(['a', 'b', 'c'], batch_size=2)
+        self.assertEqual(list(context.exception.failures), ['c'])
+        self.assertEqual(attempts, {'a': 1, 'b': 2, 'c': storageBackends.BULK_ATTEMPTS})
+        self.assertEqual([info.name for info in self.storage.list('')], ['c'])
+        
+class TestLocalDirectoryBackend(StorageBackendTests, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = LocalDirectoryBackend(self.directory.name)
+        
+    def tearDown(self):
+        self.directory.cleanup()
+        
+    def test_outside_root(self):
+
+        # test that names cannot escape the storage root
+        with self.assertRaises(ValueError):
+            self.storage.put('../outside.json', '{}')